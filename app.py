@@ -1,33 +1,43 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory, make_response, session, redirect, url_for, flash
+from flask import Flask, Response, request, jsonify, render_template, send_file, send_from_directory, make_response, session, redirect, url_for, flash, g
 from flask_cors import CORS
 import sqlite3
 import os
 import base64
 from PIL import Image
-import pytesseract
-import cv2
-import numpy as np
 import re
 from datetime import datetime
 import json
+import hashlib
+import uuid
+import threading
+import atexit
 from io import BytesIO
 # import openai  # Comentado para reducir dependencias
 # from groq import Groq  # Comentado para reducir dependencias
 from config import EXCHANGE_RATES as CONFIG_EXCHANGE_RATES  # Importar tasas desde config
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from config import MAX_UPLOAD_SIZE, OCR_LANGUAGES, OCR_CONFIG, OCR_PREPROCESS
 import pandas as pd
 import tempfile
-import zipfile
-import shutil
 from functools import wraps
+from database import ConnectionPool, run_migrations, get_table_versions
+from jobs import JobQueue, QueueFullError, JOB_DONE, JOB_ERROR
+from extraction_cache import ExtractionCache, image_hash
+from ocr_engine import OcrEngine
+from receipt_preprocessing import ReceiptPreprocessor
+from extraction_strategy import ExtractionStrategy
+from llm_client import LLMClient, LLMError, NOVITA_BASE_URL
+from llm_image import encode_for_llm
+from ticket_parser import parse_ticket_text
+from reconciliation import CUADRE_TOLERANCIA, save_groups, solve, unlink
+from exchange_rates import ExchangeRates, recompute_eur_amounts
+from zip_stream import stream_zip
+from image_archive import reduced_image_entries, shutdown_image_pool
+from export_artifacts import ExportArtifactStore, export_cache_key
+from export_dataset import ExportEmptyError, render_export
+from export_renderers import PdfRenderer, ExcelRenderer, ImageEntriesRenderer
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Change-Seq'])
 
 # Configuración de idiomas
 LANGUAGES = {
@@ -43,10 +53,70 @@ DATABASE = os.getenv('DATABASE_URL', 'gastos.db').replace('sqlite:///', '') if o
 # Crear directorio de uploads
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Pool de conexiones SQLite (WAL) compartido por todas las rutas
+db_pool = ConnectionPool(DATABASE, max_idle=int(os.getenv('DB_POOL_SIZE', 8)))
+
+def get_db():
+    """Conexión de la petición actual (se toma del pool una sola vez por petición)"""
+    if '_db_conn' not in g:
+        g._db_conn = db_pool.acquire()
+    return g._db_conn
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    """Devolver la conexión al pool al terminar la petición"""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# Caché de extracciones: el mismo ticket no vuelve a pasar por OCR ni LLM
+extraction_cache = ExtractionCache(
+    db_pool,
+    max_entries=int(os.getenv('EXTRACTION_CACHE_ENTRIES', 5000)),
+    max_age_seconds=int(os.getenv('EXTRACTION_CACHE_DAYS', 90)) * 24 * 3600
+)
+
+# Cola de procesamiento de tickets (OCR + LLM fuera del hilo de la petición)
+image_jobs = JobQueue(
+    db_pool,
+    'process-image',
+    max_workers=int(os.getenv('IMAGE_WORKERS', 4)),
+    max_pending=int(os.getenv('IMAGE_QUEUE_SIZE', 32))
+)
+
+# OCR en procesos aparte (OCR_WORKERS, OCR_QUEUE_SIZE): las ráfagas de tickets no bloquean la web
+ocr_engine = OcrEngine(OCR_LANGUAGES, OCR_CONFIG)
+# Receta de preprocesado de la imagen antes del OCR (OpenCV)
+ocr_preprocessor = ReceiptPreprocessor(os.getenv('OCR_PREPROCESS', OCR_PREPROCESS))
+# Orden de OCR y LLM: llm-first (OCR solo si falla el LLM), parallel u ocr-only
+extraction_strategy = ExtractionStrategy(
+    os.getenv('EXTRACTION_MODE', 'llm-first'),
+    max_workers=image_jobs.max_workers
+)
+
+# Exportaciones en segundo plano y caché de los ficheros generados
+EXPORT_FOLDER = os.getenv('EXPORT_FOLDER', os.path.join(tempfile.gettempdir(), 'gastos_exports'))
+export_jobs = JobQueue(
+    db_pool,
+    'export',
+    max_workers=int(os.getenv('EXPORT_WORKERS', 2)),
+    max_pending=int(os.getenv('EXPORT_QUEUE_SIZE', 8))
+)
+export_artifacts = ExportArtifactStore(
+    db_pool,
+    EXPORT_FOLDER,
+    max_entries=int(os.getenv('EXPORT_CACHE_ENTRIES', 50)),
+    max_bytes=int(os.getenv('EXPORT_CACHE_MB', 2048)) * 1024 * 1024,
+    ttl_seconds=int(os.getenv('EXPORT_CACHE_HOURS', 24)) * 3600
+)
+
+# Tareas de mantenimiento (recalcular importes en EUR...): una a la vez
+maintenance_jobs = JobQueue(db_pool, 'mantenimiento', max_workers=1, max_pending=2)
+
 # Sistema de usuarios - ahora desde base de datos
 def authenticate_user(username, password):
     """Verifica credenciales de usuario desde la base de datos"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -56,7 +126,6 @@ def authenticate_user(username, password):
     ''', (username,))
     
     user = cursor.fetchone()
-    conn.close()
     
     if user and user[1] == password:  # user[1] es password
         return {
@@ -101,6 +170,38 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def conditional_etag(*tablas):
+    """Decorador: ETag fuerte a partir de la versión de las tablas consultadas
+
+    Si el If-None-Match del cliente coincide se responde 304 sin ejecutar la consulta.
+    El ETag incluye ruta, parámetros y usuario/rol, porque la respuesta depende de ellos.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            versiones = get_table_versions(get_db(), tablas)
+            clave = '|'.join([
+                request.path,
+                request.query_string.decode('utf-8', 'replace'),
+                session.get('username') or '',
+                session.get('role') or '',
+                ','.join(str(v) for v in versiones)
+            ])
+            etag = hashlib.sha1(clave.encode('utf-8')).hexdigest()
+            
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # El navegador debe revalidar siempre (If-None-Match) antes de usar su copia
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
 # Configuración LLM desde archivo externo
 try:
     from config_api import NOVITA_API_KEY, GROQ_API_KEY, OPENAI_API_KEY, is_llm_configured, get_configured_api
@@ -116,10 +217,16 @@ except ImportError:
 
 # Inicializar clientes LLM
 try:
-    # Cliente Novita AI (Llama 3.2 90B Vision) - Usar requests directamente
+    # Cliente Novita AI (Qwen2.5-VL-72B) - sesión HTTP persistente con reintentos
     if NOVITA_API_KEY and NOVITA_API_KEY != "tu-api-key-aquí":
-        novita_client = "requests_direct"  # Marcador para usar requests
-        print("✅ Cliente Novita configurado (Llama 3.2 90B Vision)")
+        novita_client = LLMClient(
+            NOVITA_API_KEY,
+            base_url=os.getenv('NOVITA_BASE_URL', NOVITA_BASE_URL),
+            pool_maxsize=int(os.getenv('LLM_POOL_SIZE', 8)),
+            read_timeout=float(os.getenv('LLM_TIMEOUT', 30)),
+            max_retries=int(os.getenv('LLM_MAX_RETRIES', 3))
+        )
+        print("✅ Cliente Novita configurado (Qwen2.5-VL-72B)")
     else:
         novita_client = None
     
@@ -132,26 +239,18 @@ except Exception as e:
     novita_client = None
     groq_client = None
 
-# Usar tasas de conversión desde config.py (EUR como base)
-EXCHANGE_RATES = CONFIG_EXCHANGE_RATES
+# Tipos de cambio por fecha (tabla tipos_cambio); config.py da el tipo fijo de las monedas sin histórico
+exchange_rates = ExchangeRates(db_pool, CONFIG_EXCHANGE_RATES)
 
-def convert_to_eur(amount, from_currency):
-    """Convertir cualquier moneda a EUR"""
+def convert_to_eur(amount, from_currency, fecha=None):
+    """Convertir cualquier moneda a EUR con el tipo vigente en fecha (hoy si no se indica)"""
     if not amount or amount == 0:
         return 0
     
     if from_currency == 'EUR' or not from_currency:
         return float(amount)
     
-    # Obtener tasa de cambio
-    from_rate = EXCHANGE_RATES.get(from_currency, 1)
-    
-    # Convertir a EUR
-    eur_amount = float(amount) / from_rate
-    
-    print(f"🔄 Conversión automática: {amount} {from_currency} → {eur_amount:.2f} EUR (tasa: {from_rate})")
-    
-    return round(eur_amount, 2)
+    return exchange_rates.to_eur(amount, from_currency, fecha)
 
 # Conceptos predeterminados
 DEFAULT_CONCEPTS = [
@@ -164,123 +263,58 @@ DEFAULT_CONCEPTS = [
 ]
 
 def init_db():
-    """Inicializar la base de datos"""
-    conn = sqlite3.connect(DATABASE)
+    """Inicializar la base de datos: migraciones pendientes y datos por defecto"""
+    with db_pool.connection() as conn:
+        run_migrations(conn)
+        _seed_db(conn)
+
+def create_app(inicializar_db=True):
+    """Aplicación lista para servir (wsgi.py y el servidor de desarrollo)
+
+    init_db se ejecuta una vez al arrancar: con gunicorn y preload_app en el
+    proceso maestro, antes de crear los workers, que por eso no heredan
+    conexiones SQLite abiertas. El cierre ordenado queda registrado para
+    cada proceso.
+    """
+    if inicializar_db:
+        init_db()
+        db_pool.close_all()
+    atexit.register(shutdown_background_work)
+    return app
+
+_shutdown_lock = threading.Lock()
+_shutdown_done = False
+
+def shutdown_background_work(wait=True):
+    """Cierre ordenado del proceso: terminar los trabajos encolados y parar los pools
+
+    Las colas dejan de aceptar trabajos (las rutas responden 503) y se
+    espera a los tickets y exportaciones en curso, cuyo resultado queda en
+    la tabla jobs para el cliente que lo esté consultando. Después se paran
+    los procesos de OCR y de imágenes y se cierran las conexiones.
+    """
+    global _shutdown_done
+    with _shutdown_lock:
+        if _shutdown_done:
+            return
+        _shutdown_done = True
+    pendientes = image_jobs.pending_count() + export_jobs.pending_count() + maintenance_jobs.pending_count()
+    print(f"🛑 Cerrando: {pendientes} trabajos en curso")
+    for cola in (image_jobs, export_jobs, maintenance_jobs):
+        cola.shutdown(wait=wait)
+    extraction_strategy.shutdown(wait=wait)
+    ocr_engine.shutdown(wait=wait)
+    shutdown_image_pool(wait=wait)
+    db_pool.close_all()
+    print("✅ Trabajos terminados y pools cerrados")
+
+def _seed_db(conn):
     cursor = conn.cursor()
     
-    # Tabla de gastos
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS gastos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            fecha TEXT NOT NULL,
-            concepto TEXT NOT NULL,
-            motivo TEXT,
-            descripcion TEXT,
-            importe_eur REAL NOT NULL,
-            importe_otra_moneda REAL,
-            moneda_otra TEXT,
-            imagen_path TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Tabla de conceptos personalizados
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS conceptos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT UNIQUE NOT NULL,
-            activo BOOLEAN DEFAULT TRUE
-        )
-    ''')
-    
-    # Tabla de motivos
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS motivos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT UNIQUE NOT NULL,
-            usado_veces INTEGER DEFAULT 0,
-            ultimo_uso TIMESTAMP,
-            activo BOOLEAN DEFAULT TRUE
-        )
-    ''')
-    
     # Insertar conceptos predeterminados
     for concept in DEFAULT_CONCEPTS:
         cursor.execute('INSERT OR IGNORE INTO conceptos (nombre) VALUES (?)', (concept,))
     
-    # Migración: Agregar campo checkeado si no existe
-    try:
-        cursor.execute('ALTER TABLE gastos ADD COLUMN checkeado BOOLEAN DEFAULT FALSE')
-        print("✅ Migración: Campo 'checkeado' añadido a la tabla gastos")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass  # La columna ya existe
-        else:
-            raise
-    
-    # Migración: Agregar campo usuario si no existe
-    try:
-        cursor.execute('ALTER TABLE gastos ADD COLUMN usuario TEXT DEFAULT "paul"')
-        print("✅ Migración: Campo 'usuario' añadido a la tabla gastos")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass  # La columna ya existe
-        else:
-            raise
-    
-    # Tabla de detalles de viajes
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS viaje_detalles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            motivo TEXT NOT NULL,
-            importe_eur REAL NOT NULL,
-            importe_original REAL NOT NULL,
-            moneda_original TEXT NOT NULL DEFAULT 'EUR',
-            cuadrado BOOLEAN DEFAULT FALSE,
-            gasto_id INTEGER,
-            usuario TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (gasto_id) REFERENCES gastos (id)
-        )
-    ''')
-    
-    # Migración: Agregar campos de moneda a viaje_detalles si no existen
-    try:
-        cursor.execute('ALTER TABLE viaje_detalles ADD COLUMN importe_original REAL')
-        cursor.execute('ALTER TABLE viaje_detalles ADD COLUMN moneda_original TEXT DEFAULT "EUR"')
-        # Actualizar registros existentes
-        cursor.execute('UPDATE viaje_detalles SET importe_original = importe_eur, moneda_original = "EUR" WHERE importe_original IS NULL')
-        print("✅ Migración: Campos de moneda añadidos a viaje_detalles")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass  # Las columnas ya existen
-        else:
-            raise
-    
-    # Migración: Agregar campo detalle_cuadrado si no existe
-    try:
-        cursor.execute('ALTER TABLE gastos ADD COLUMN detalle_cuadrado BOOLEAN DEFAULT FALSE')
-        print("✅ Migración: Campo 'detalle_cuadrado' añadido a la tabla gastos")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass  # La columna ya existe
-        else:
-            raise
-    
-    # Tabla de usuarios
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            name TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT 'user',
-            parent_admin TEXT,
-            active BOOLEAN DEFAULT TRUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
     # Insertar usuarios por defecto si no existen
     default_users = [
         ('paul', 'paul', 'Paul', 'user', 'edurne'),
@@ -293,27 +327,74 @@ def init_db():
             VALUES (?, ?, ?, ?, ?)
         ''', (username, password, name, role, parent_admin))
     
-    print("✅ Tabla de usuarios creada y usuarios por defecto insertados")
+    conn.commit()
+
+# Subidas en streaming: hasta este tamaño se quedan en memoria, por encima van a disco
+UPLOAD_SPOOL_MEMORY = 1024 * 1024
+
+class UploadTooLargeError(Exception):
+    """La imagen subida supera MAX_UPLOAD_SIZE"""
+
+def spool_upload(stream, max_size=MAX_UPLOAD_SIZE):
+    """Copiar por bloques un stream de subida a un fichero temporal propio
+
+    El fichero sobrevive a la petición, así que puede pasarse a la cola de trabajos.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY)
+    total = 0
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size:
+            spooled.close()
+            raise UploadTooLargeError(f'La imagen supera el máximo de {max_size // (1024 * 1024)}MB')
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+def get_uploaded_image():
+    """Datos e imagen de la petición en cualquiera de los formatos aceptados
+
+    - multipart/form-data: campos del formulario + fichero 'image'
+    - image/* u application/octet-stream: el cuerpo es la imagen
+    - JSON: campo 'image' con data URL base64 (compatibilidad)
+
+    Devuelve (data, image_source): image_source es un fichero temporal, una
+    data URL o None.
+    """
+    if request.mimetype == 'multipart/form-data':
+        data = {}
+        for key, value in request.form.items():
+            # Los formularios envían todo como texto
+            if value in ('true', 'false'):
+                value = value == 'true'
+            data[key] = value
+        upload = request.files.get('image')
+        image_source = spool_upload(upload.stream) if upload and upload.filename else None
+        return data, image_source
     
-    # Migración: Agregar campo activo a motivos si no existe
-    try:
-        cursor.execute('ALTER TABLE motivos ADD COLUMN activo BOOLEAN DEFAULT TRUE')
-        print("✅ Migración: Campo 'activo' añadido a la tabla motivos")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" in str(e):
-            pass  # La columna ya existe
-        else:
-            raise
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        return {}, spool_upload(request.stream)
     
-    conn.commit()
-    conn.close()
+    data = request.get_json() or {}
+    return data, data.get('image') or None
+
+def process_image(image_source):
+    """Procesar imagen: comprimir y extraer texto
 
-def process_image(image_data):
-    """Procesar imagen: comprimir y extraer texto"""
+    image_source puede ser una data URL base64 o un fichero abierto.
+    """
     try:
-        # Decodificar imagen base64
-        image_bytes = base64.b64decode(image_data.split(',')[1])
-        image = Image.open(BytesIO(image_bytes))
+        if isinstance(image_source, str):
+            # Decodificar imagen base64
+            image_bytes = base64.b64decode(image_source.split(',')[1])
+            image = Image.open(BytesIO(image_bytes))
+        else:
+            # Fichero subido: PIL lee directamente del fichero temporal
+            image_source.seek(0)
+            image = Image.open(image_source)
         
         # Comprimir imagen manteniendo legibilidad
         if image.mode in ('RGBA', 'LA'):
@@ -325,53 +406,46 @@ def process_image(image_data):
         
         # Guardar imagen comprimida
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'ticket_{timestamp}.jpg'
+        # Sufijo aleatorio: varios trabajos pueden guardar tickets en el mismo segundo
+        filename = f'ticket_{timestamp}_{uuid.uuid4().hex[:8]}.jpg'
         filepath = os.path.join(UPLOAD_FOLDER, filename)
-        image.save(filepath, 'JPEG', quality=85, optimize=True)
-        
-        # Extraer texto con OCR
-        text = ""
-        try:
-            # Mejorar imagen usando PIL para OCR
-            # Convertir a escala de grises
-            if image.mode != 'L':
-                image = image.convert('L')
-            
-            # Mejorar contraste usando PIL
-            from PIL import ImageEnhance
-            enhancer = ImageEnhance.Contrast(image)
-            enhanced = enhancer.enhance(2.0)  # Aumentar contraste
-            
-            # Extraer texto
-            text = pytesseract.image_to_string(enhanced, lang='spa+eng')
-            
-        except Exception as e:
-            print(f"Error en OCR: {e}")
-            text = ""
+        jpeg_buffer = BytesIO()
+        image.save(jpeg_buffer, 'JPEG', quality=85, optimize=True)
+        jpeg_bytes = jpeg_buffer.getvalue()
+        with open(filepath, 'wb') as f:
+            f.write(jpeg_bytes)
+        
+        # Consultar la caché antes de hacer OCR o llamar al LLM
+        cache_key = image_hash(jpeg_bytes)
+        cached = extraction_cache.get(cache_key)
+        if cached:
+            print(f"♻️  Extracción en caché ({cached['metodo']}) para {cache_key[:12]}")
+            return {
+                'filename': filename,
+                'text': cached['text'],
+                'extracted_info': cached['extracted_info'],
+                'cached': True
+            }
         
-        # Usar LLM para mejorar extracción si está disponible
-        if is_llm_configured():
-            try:
-                extracted_info = extract_with_llm(image_data, text)
-                api_type = get_configured_api()
-                if api_type == "novita":
-                    print("✅ Extracción con Llama 3.3 70B (Novita AI) completada")
-                elif api_type == "groq":
-                    print("✅ Extracción con GROQ completada")
-                elif api_type == "openai":
-                    print("✅ Extracción con OpenAI completada")
-                else:
-                    print("✅ Extracción con LLM completada")
-            except Exception as e:
-                print(f"❌ Error en LLM: {e}")
-                extracted_info = extract_ticket_info(text)
-        else:
+        def run_ocr():
+            # Preparar la imagen para el OCR (receta OCR_PREPROCESS) y leerla en el pool de OCR
+            enhanced, tiempos_pre = ocr_preprocessor.run(image)
+            text, tiempos = ocr_engine.recognize(enhanced)
+            print(f"🔍 Preprocesado {sum(tiempos_pre.values()) * 1000:.0f} ms, OCR {tiempos['total'] * 1000:.0f} ms "
+                  f"(cola {tiempos['espera_cola'] * 1000:.0f} ms, tesseract {tiempos['ocr'] * 1000:.0f} ms)")
+            return text
+        
+        # OCR y/o LLM según EXTRACTION_MODE
+        llm = (lambda: extract_with_llm(image)) if is_llm_configured() and novita_client else None
+        resultado = extraction_strategy.extract(run_ocr, extract_ticket_info, llm)
+        text = resultado['text']
+        extracted_info = resultado['extracted_info']
+        if llm is None:
             if not text or len(text.strip()) < 5:
                 print("⚠️  Sin OCR ni LLM disponibles - extracción muy limitada")
                 print("💡 SOLUCIÓN RÁPIDA: Configura Llama 3.3 70B (súper económico) o GROQ (gratis) en config_api.py")
             else:
                 print("ℹ️  Usando extracción básica (OCR solamente). Para mejor precisión, configura API keys en config_api.py")
-            extracted_info = extract_ticket_info(text)
             
         # Mostrar información extraída en el log
         if extracted_info:
@@ -379,10 +453,15 @@ def process_image(image_data):
         else:
             print("❌ No se pudo extraer información del ticket")
         
+        # Solo se guardan extracciones útiles (con importe); las vacías dependen de la fecha actual
+        if extracted_info and extracted_info.get('amount'):
+            extraction_cache.put(cache_key, text, extracted_info, resultado['metodo'])
+        
         return {
             'filename': filename,
             'text': text,
-            'extracted_info': extracted_info
+            'extracted_info': extracted_info,
+            'cached': False
         }
     except Exception as e:
         print(f"Error procesando imagen: {e}")
@@ -390,147 +469,22 @@ def process_image(image_data):
 
 def extract_ticket_info(text):
     """Extraer información relevante del texto del ticket"""
-    info = {}
-    
-    # Si no hay texto, intentar algunas extracciones básicas por defecto
     if not text or len(text.strip()) < 5:
         print("⚠️  Sin texto OCR disponible - usando fecha actual y conceptos por defecto")
-        from datetime import datetime
-        info['date'] = datetime.now().strftime('%Y-%m-%d')
-        info['concept'] = 'Otros'
-        return info
-    
-    # Buscar importes (patrones más amplios)
-    amount_patterns = [
-        r'total[:\s]*€?\s*(\d+[.,]\d{2})',
-        r'importe[:\s]*€?\s*(\d+[.,]\d{2})',
-        r'suma[:\s]*€?\s*(\d+[.,]\d{2})',
-        r'€\s*(\d+[.,]\d{2})',
-        r'(\d+[.,]\d{2})\s*€',
-        r'(\d+[.,]\d{2})\s*eur',
-        r'(\d+[.,]\d{2})\s*euros?',
-        r'total[:\s]*(\d+[.,]\d{2})',
-        r'(\d{1,3}[.,]\d{2})',  # Cualquier número con 2 decimales
-    ]
-    
-    amounts_found = []
-    for pattern in amount_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
-            try:
-                amount = float(match.replace(',', '.'))
-                if 0.01 <= amount <= 9999.99:  # Rango razonable
-                    amounts_found.append(amount)
-            except:
-                continue
-    
-    if amounts_found:
-        # Usar el mayor importe encontrado (usualmente el total)
-        info['amount'] = max(amounts_found)
-    
-    # Buscar fechas (patrones más amplios)
-    date_patterns = [
-        r'(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})',
-        r'(\d{1,2}\s+de\s+\w+\s+de\s+\d{4})',
-        r'(\d{1,2}\s+\w+\s+\d{4})',
-        r'(\d{4}[/.-]\d{1,2}[/.-]\d{1,2})',
-        r'(\d{2}[/.-]\d{2}[/.-]\d{4})'
-    ]
-    
-    for pattern in date_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        if matches:
-            try:
-                date_str = matches[0]
-                # Intentar parsear la fecha
-                from datetime import datetime
-                for fmt in ['%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d', '%Y-%m-%d']:
-                    try:
-                        parsed_date = datetime.strptime(date_str, fmt)
-                        info['date'] = parsed_date.strftime('%Y-%m-%d')
-                        break
-                    except:
-                        continue
-                if 'date' in info:
-                    break
-            except:
-                continue
-    
-    # Extraer posible descripción (líneas que contienen nombres de establecimiento)
-    lines = text.split('\n')
-    establishment_names = []
-    
-    for line in lines:
-        line = line.strip()
-        if len(line) > 3 and len(line) < 50:  # Longitud razonable para nombre
-            # Evitar líneas que son solo números o fechas
-            if not re.match(r'^[\d\s/.-]+$', line):
-                establishment_names.append(line)
-    
-    if establishment_names:
-        info['description'] = establishment_names[0]  # Primera línea relevante
-    
-    # Identificar tipo de establecimiento (patrones expandidos)
-    establishment_keywords = {
-        'Restaurante': [
-            'restaurante', 'bar', 'cafe', 'cafeteria', 'taberna', 'tapas', 'comida', 'menú',
-            'pizzeria', 'hamburgueseria', 'marisqueria', 'asador', 'braseria', 'cerveceria',
-            'tasca', 'bistro', 'gastrobar', 'parrilla', 'cocina', 'burger', 'pizza'
-        ],
-        'Transporte': [
-            'taxi', 'uber', 'cabify', 'metro', 'bus', 'tren', 'avión', 'vuelo', 'parking',
-            'aparcamiento', 'peaje', 'renfe', 'aena', 'aeropuerto', 'estacion', 'transport'
-        ],
-        'Alojamiento': [
-            'hotel', 'hostal', 'apartamento', 'alojamiento', 'booking', 'pension', 'resort',
-            'motel', 'airbnb', 'hospedaje', 'lodge', 'inn'
-        ],
-        'Combustible': [
-            'gasolina', 'diesel', 'combustible', 'repsol', 'cepsa', 'bp', 'shell', 'galp',
-            'petronor', 'esso', 'fuel', 'gas', 'carburante'
-        ],
-        'Compras': [
-            'supermercado', 'tienda', 'shop', 'centro comercial', 'farmacia', 'mercadona',
-            'carrefour', 'dia', 'lidl', 'alcampo', 'corte inglés', 'market', 'store'
-        ],
-        'Entretenimiento': [
-            'cine', 'teatro', 'concierto', 'museo', 'parque', 'discoteca', 'pub', 'club'
-        ],
-        'Salud': [
-            'farmacia', 'hospital', 'clinica', 'médico', 'dentista', 'veterinario', 'óptica'
-        ],
-        'Tecnología': [
-            'mediamarkt', 'fnac', 'apple', 'samsung', 'phone house', 'tech', 'electronics'
-        ]
-    }
-    
-    text_lower = text.lower()
-    concept_scores = {}
-    
-    for concept, keywords in establishment_keywords.items():
-        score = 0
-        for keyword in keywords:
-            if keyword in text_lower:
-                score += 1
-        if score > 0:
-            concept_scores[concept] = score
-    
-    if concept_scores:
-        # Elegir el concepto con mayor puntuación
-        info['concept'] = max(concept_scores, key=concept_scores.get)
-    
-    return info
+    return parse_ticket_text(text)
 
-def extract_with_llm(image_data, ocr_text=""):
-    """Extraer información usando Novita AI con Llama 3.3 70B Instruct"""
-    try:
-        # Solo usar Novita AI
-        if not novita_client:
-            print("❌ Cliente Novita no disponible")
-            return extract_ticket_info(ocr_text)
-        
-        # Preparar prompt optimizado para Llama 3.3 70B
-        prompt = """Analiza esta imagen de ticket y extrae EXACTAMENTE esta información en formato JSON:
+def extract_with_llm(image):
+    """Extraer información usando el LLM de visión de Novita AI
+
+    image es la imagen PIL ya normalizada por process_image; se envía
+    recodificada con los límites de llm_image (LLM_IMAGE_*). Lanza LLMError si la llamada falla y ValueError si la respuesta no es
+    JSON válido; el respaldo con OCR lo decide extraction_strategy.
+    """
+    if not novita_client:
+        raise LLMError('Cliente Novita no disponible')
+    
+    # Preparar prompt optimizado
+    prompt = """Analiza esta imagen de ticket y extrae EXACTAMENTE esta información en formato JSON:
 
 IMPORTANTE: Busca el TOTAL FINAL (no subtotales). Busca la FECHA completa. Busca el NOMBRE del establecimiento.
 
@@ -552,111 +506,92 @@ FECHA: Convierte al formato YYYY-MM-DD (ejemplo: 15/03/2024 → 2024-03-15)
 Si NO puedes ver algo claramente, usa null para ese campo.
 
 Responde SOLO con el JSON, nada más."""
-        
-        try:
-            # Usar requests directamente
-            import requests
-            
-            url = "https://api.novita.ai/v3/openai/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {NOVITA_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            # Extraer solo la parte base64 de la imagen
-            base64_image = image_data.split(',')[1] if ',' in image_data else image_data
-            
-            # Preparar mensaje con imagen usando Llama 3.3 70B Instruct Vision
-            messages = [
-                {"role": "system", "content": "Eres un experto extractor de datos de tickets. Respondes SOLO con JSON válido, sin texto adicional."},
-                {
-                    "role": "user", 
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]
-                }
+    
+    # JPEG acotado de la imagen normalizada (no el original del móvil)
+    image_bytes, codificacion = encode_for_llm(image)
+    base64_image = base64.b64encode(image_bytes).decode('ascii')
+    print(f"🖼️ Imagen para el LLM: {codificacion['ancho']}x{codificacion['alto']}, "
+          f"calidad {codificacion['calidad']}{', grises' if codificacion['grises'] else ''}, "
+          f"{codificacion['bytes'] / 1024:.0f} KB")
+    
+    # Preparar mensaje con imagen para Qwen2.5-VL-72B
+    messages = [
+        {"role": "system", "content": "Eres un experto extractor de datos de tickets. Respondes SOLO con JSON válido, sin texto adicional."},
+        {
+            "role": "user", 
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
             ]
-            
-            data = {
-                "model": "qwen/qwen2.5-vl-72b-instruct",  # Qwen2.5-VL-72B - Modelo vision que funciona en Novita
-                "messages": messages,
-                "temperature": 0.0,
-                "max_tokens": 1000
-            }
-            
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                result_text = result['choices'][0]['message']['content'].strip()
-                print(f"✅ Extracción con Qwen2.5-VL-72B (Novita AI) completada")
-                print(f"📝 Respuesta: {result_text[:150]}...")
-            else:
-                print(f"❌ Error HTTP {response.status_code}: {response.text}")
-                return extract_ticket_info(ocr_text)
-            
-            # Parsear JSON
-            try:
-                # Limpiar respuesta si tiene texto adicional
-                if '```json' in result_text:
-                    result_text = result_text.split('```json')[1].split('```')[0]
-                elif '```' in result_text:
-                    result_text = result_text.split('```')[1].split('```')[0]
-                
-                extracted_data = json.loads(result_text)
-                
-                # Validar y convertir datos
-                info = {}
-                
-                # Procesar amount
-                if 'amount' in extracted_data and extracted_data['amount'] is not None:
-                    try:
-                        amount_val = float(extracted_data['amount'])
-                        if amount_val > 0:  # Solo usar valores positivos
-                            info['amount'] = amount_val
-                    except (ValueError, TypeError):
-                        print(f"⚠️ No se pudo convertir amount: {extracted_data['amount']}")
-                
-                # Procesar currency
-                if 'currency' in extracted_data and extracted_data['currency'] is not None:
-                    currency_val = str(extracted_data['currency']).strip().upper()
-                    if currency_val and currency_val != 'NULL':
-                        info['currency'] = currency_val
-                
-                # Procesar date
-                if 'date' in extracted_data and extracted_data['date'] is not None:
-                    date_val = str(extracted_data['date']).strip()
-                    if date_val and date_val != 'null' and len(date_val) >= 8:
-                        info['date'] = date_val
-                
-                # Procesar description
-                if 'description' in extracted_data and extracted_data['description'] is not None:
-                    desc_val = str(extracted_data['description']).strip()
-                    if desc_val and desc_val != 'null' and desc_val != 'No disponible':
-                        info['description'] = desc_val
-                
-                # Procesar concept
-                if 'concept' in extracted_data and extracted_data['concept'] is not None:
-                    concept_val = str(extracted_data['concept']).strip()
-                    if concept_val and concept_val != 'null' and concept_val != 'Otros':
-                        info['concept'] = concept_val
-                
-                print(f"📊 Información extraída por LLM: {info}")
-                return info
-                
-            except json.JSONDecodeError as e:
-                print(f"❌ Error parseando JSON del LLM: {e}")
-                print(f"📝 Respuesta recibida: {result_text}")
-                return extract_ticket_info(ocr_text)
-                
-        except Exception as e:
-            print(f"❌ Error con Novita AI: {e}")
-            return extract_ticket_info(ocr_text)
-            
-    except Exception as e:
-        print(f"❌ Error general en extract_with_llm: {e}")
-        return extract_ticket_info(ocr_text)
+        }
+    ]
+    
+    result_text = novita_client.chat(messages, temperature=0.0, max_tokens=1000)
+    print(f"✅ Extracción con Qwen2.5-VL-72B (Novita AI) completada")
+    print(f"📝 Respuesta: {result_text[:150]}...")
+    
+    # Parsear JSON
+    try:
+        # Limpiar respuesta si tiene texto adicional
+        if '```json' in result_text:
+            result_text = result_text.split('```json')[1].split('```')[0]
+        elif '```' in result_text:
+            result_text = result_text.split('```')[1].split('```')[0]
+        
+        extracted_data = json.loads(result_text)
+    except (json.JSONDecodeError, IndexError) as e:
+        print(f"📝 Respuesta recibida: {result_text}")
+        raise ValueError(f'Error parseando JSON del LLM: {e}')
+    if not isinstance(extracted_data, dict):
+        raise ValueError(f'Respuesta del LLM sin objeto JSON: {result_text[:150]}')
+    
+    # Validar y convertir datos
+    info = {}
+    
+    # Procesar amount
+    if 'amount' in extracted_data and extracted_data['amount'] is not None:
+        try:
+            amount_val = float(extracted_data['amount'])
+            if amount_val > 0:  # Solo usar valores positivos
+                info['amount'] = amount_val
+        except (ValueError, TypeError):
+            print(f"⚠️ No se pudo convertir amount: {extracted_data['amount']}")
+    
+    # Procesar currency
+    if 'currency' in extracted_data and extracted_data['currency'] is not None:
+        currency_val = str(extracted_data['currency']).strip().upper()
+        if currency_val and currency_val != 'NULL':
+            info['currency'] = currency_val
+    
+    # Procesar date
+    if 'date' in extracted_data and extracted_data['date'] is not None:
+        date_val = str(extracted_data['date']).strip()
+        if date_val and date_val != 'null' and len(date_val) >= 8:
+            info['date'] = date_val
+    
+    # Procesar description
+    if 'description' in extracted_data and extracted_data['description'] is not None:
+        desc_val = str(extracted_data['description']).strip()
+        if desc_val and desc_val != 'null' and desc_val != 'No disponible':
+            info['description'] = desc_val
+    
+    # Procesar concept
+    if 'concept' in extracted_data and extracted_data['concept'] is not None:
+        concept_val = str(extracted_data['concept']).strip()
+        if concept_val and concept_val != 'null' and concept_val != 'Otros':
+            info['concept'] = concept_val
+    
+    print(f"📊 Información extraída por LLM: {info}")
+    return info
+
+@app.route('/health')
+def health():
+    """Comprobación de vida para el balanceador (sin autenticación)"""
+    try:
+        get_db().execute('SELECT 1').fetchone()
+    except sqlite3.Error as e:
+        return jsonify({'status': 'error', 'error': str(e)}), 503
+    return jsonify({'status': 'ok'})
 
 @app.route('/')
 @app.route('/<lang>/')
@@ -741,92 +676,351 @@ def get_users():
         })
     return jsonify(users_list)
 
+@app.route('/api/metrics')
+@admin_required
+def get_metrics():
+    """Métricas de este proceso: base de datos, caché, cola de tickets, OCR y LLM (solo admin)"""
+    return jsonify({
+        'database': db_pool.stats(),
+        'extraction_cache': extraction_cache.stats(),
+        'image_jobs': {'pendientes': image_jobs.pending_count()},
+        'ocr': ocr_engine.stats(),
+        'preprocesado': ocr_preprocessor.stats(),
+        'extraccion': extraction_strategy.stats(),
+        'export_jobs': {'pendientes': export_jobs.pending_count()},
+        'export_cache': export_artifacts.stats(),
+        'tipos_cambio': exchange_rates.stats(),
+        'maintenance_jobs': {'pendientes': maintenance_jobs.pending_count()},
+        'llm': novita_client.stats() if novita_client else None
+    })
+
+# Columnas devueltas por la API de gastos (el orden importa para gasto_to_dict)
+GASTO_API_COLUMNS = '''id, fecha, concepto, motivo, descripcion, importe_eur, 
+                       importe_otra_moneda, moneda_otra, imagen_path, checkeado, usuario, detalle_cuadrado, created_at'''
+
+# Tamaño máximo de página para GET /api/gastos
+GASTOS_PAGE_MAX = 500
+
+def gasto_to_dict(gasto):
+    """Fila de GASTO_API_COLUMNS -> JSON de la API"""
+    return {
+        'id': gasto[0],
+        'fecha': gasto[1],
+        'concepto': gasto[2],
+        'motivo': gasto[3],
+        'descripcion': gasto[4],
+        'importe_eur': gasto[5],
+        'importe_otra_moneda': gasto[6],
+        'moneda_otra': gasto[7],
+        'imagen_path': gasto[8],
+        'checkeado': bool(gasto[9]),
+        'usuario': gasto[10],
+        'detalle_cuadrado': bool(gasto[11]),
+        'created_at': gasto[12]
+    }
+
+def get_change_seq(cursor):
+    """Último número de secuencia del registro de cambios"""
+    cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios')
+    return cursor.fetchone()[0]
+
+# Gastos cuadrados con cada detalle (tabla cuadre_enlaces), como '1,2,3'
+DETALLE_GASTO_IDS = '(SELECT GROUP_CONCAT(gasto_id) FROM cuadre_enlaces WHERE detalle_id = viaje_detalles.id)'
+
+def detalle_gastos(gasto_ids):
+    """Campos de gastos cuadrados de un detalle; gasto_id (el primero) se mantiene por compatibilidad"""
+    ids = sorted(int(gasto_id) for gasto_id in gasto_ids.split(',')) if gasto_ids else []
+    return {'gasto_id': ids[0] if ids else None, 'gasto_ids': ids}
+
+def encode_gastos_cursor(fecha, created_at, gasto_id):
+    """Cursor opaco con la clave de ordenación (fecha, created_at, id) de la última fila
+
+    created_at nulo (gastos anteriores a la columna) se guarda como '', igual
+    que lo ordena get_gastos.
+    """
+    raw = json.dumps([fecha, created_at or '', gasto_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_gastos_cursor(cursor_value):
+    padded = cursor_value + '=' * (-len(cursor_value) % 4)
+    fecha, created_at, gasto_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    return fecha, created_at or '', int(gasto_id)
+
 @app.route('/api/gastos', methods=['GET'])
 @login_required
+@conditional_etag('gastos')
 def get_gastos():
-    """Obtener gastos según el rol del usuario"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
+    """Obtener gastos según el rol del usuario
+
+    Filtros opcionales: user (solo admin), fecha_inicio, fecha_fin, concepto, motivo, checkeado.
+    Paginación por cursor: limit y cursor. Si hay más resultados se devuelve
+    la cabecera X-Next-Cursor con el valor a pasar en la siguiente petición.
+    Sin limit se devuelven todos los gastos (compatibilidad).
+    """
     # Obtener parámetros de filtro
     filter_user = request.args.get('user')  # Para admin filtrar por usuario específico
+    fecha_inicio = request.args.get('fecha_inicio')
+    fecha_fin = request.args.get('fecha_fin')
+    concepto = request.args.get('concepto')
+    motivo = request.args.get('motivo')
+    checkeado = request.args.get('checkeado')
+    cursor_value = request.args.get('cursor')
+    
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = max(1, min(int(limit), GASTOS_PAGE_MAX))
+        except ValueError:
+            return jsonify({'error': 'limit debe ser un número entero'}), 400
+    
+    query = f'SELECT {GASTO_API_COLUMNS} FROM gastos WHERE 1 = 1'
+    params = []
     
     if is_admin():
         # Admin puede ver todos los gastos o filtrar por usuario
         if filter_user:
-            cursor.execute('''
-                SELECT id, fecha, concepto, motivo, descripcion, importe_eur, 
-                       importe_otra_moneda, moneda_otra, imagen_path, checkeado, usuario, detalle_cuadrado
-                FROM gastos WHERE usuario = ? ORDER BY fecha DESC, created_at DESC
-            ''', (filter_user,))
-        else:
-            cursor.execute('''
-                SELECT id, fecha, concepto, motivo, descripcion, importe_eur, 
-                       importe_otra_moneda, moneda_otra, imagen_path, checkeado, usuario, detalle_cuadrado
-                FROM gastos ORDER BY fecha DESC, created_at DESC
-            ''')
+            query += ' AND usuario = ?'
+            params.append(filter_user)
     else:
         # Usuario normal solo ve sus propios gastos
-        cursor.execute('''
-            SELECT id, fecha, concepto, motivo, descripcion, importe_eur, 
-                   importe_otra_moneda, moneda_otra, imagen_path, checkeado, usuario, detalle_cuadrado
-            FROM gastos WHERE usuario = ? ORDER BY fecha DESC, created_at DESC
-        ''', (get_current_user(),))
+        query += ' AND usuario = ?'
+        params.append(get_current_user())
+    
+    if fecha_inicio:
+        query += ' AND fecha >= ?'
+        params.append(fecha_inicio)
+    if fecha_fin:
+        query += ' AND fecha <= ?'
+        params.append(fecha_fin)
+    if concepto:
+        query += ' AND concepto = ?'
+        params.append(concepto)
+    if motivo:
+        query += ' AND motivo = ?'
+        params.append(motivo)
+    if checkeado is not None and checkeado != '':
+        query += ' AND checkeado = ?'
+        params.append(1 if checkeado.lower() in ('true', '1', 'si', 'sí') else 0)
+    
+    if cursor_value:
+        try:
+            cursor_fecha, cursor_created_at, cursor_id = decode_gastos_cursor(cursor_value)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Cursor no válido'}), 400
+        query += " AND (fecha, COALESCE(created_at, ''), id) < (?, ?, ?)"
+        params.extend([cursor_fecha, cursor_created_at, cursor_id])
+    
+    # COALESCE: con created_at nulo la comparación del cursor daría NULL y saltaría esas filas
+    query += " ORDER BY fecha DESC, COALESCE(created_at, '') DESC, id DESC"
+    if limit is not None:
+        # Una fila extra para saber si hay página siguiente
+        query += ' LIMIT ?'
+        params.append(limit + 1)
     
+    conn = get_db()
+    cursor = conn.cursor()
+    # Leer la secuencia antes que los datos: un cambio intermedio se reenvía en el siguiente delta
+    change_seq = get_change_seq(cursor)
+    cursor.execute(query, params)
     gastos = cursor.fetchall()
-    conn.close()
     
-    gastos_list = []
-    for gasto in gastos:
-        gastos_list.append({
-            'id': gasto[0],
-            'fecha': gasto[1],
-            'concepto': gasto[2],
-            'motivo': gasto[3],
-            'descripcion': gasto[4],
-            'importe_eur': gasto[5],
-            'importe_otra_moneda': gasto[6],
-            'moneda_otra': gasto[7],
-            'imagen_path': gasto[8],
-            'checkeado': bool(gasto[9]),
-            'usuario': gasto[10],
-            'detalle_cuadrado': bool(gasto[11]) if len(gasto) > 11 else False
-        })
+    next_cursor = None
+    if limit is not None and len(gastos) > limit:
+        gastos = gastos[:limit]
+        last = gastos[-1]
+        next_cursor = encode_gastos_cursor(last[1], last[12], last[0])
+    
+    response = jsonify([gasto_to_dict(gasto) for gasto in gastos])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.headers['X-Change-Seq'] = str(change_seq)
+    return response
+
+# Máximo de cambios devueltos por llamada a /api/gastos/changes
+CHANGES_PAGE_MAX = 1000
+
+@app.route('/api/gastos/changes', methods=['GET'])
+@login_required
+def get_gastos_changes():
+    """Cambios en gastos y viaje_detalles posteriores a ?since=<seq>
+
+    Devuelve upserts (fila completa) y borrados (solo id). Si has_more es true,
+    hay que volver a llamar con since=seq para obtener el resto.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since debe ser un número entero'}), 400
+    
+    filter_user = request.args.get('user')
+    if is_admin():
+        usuario = filter_user or None
+    else:
+        usuario = get_current_user()
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Cota superior fija: los cambios posteriores quedan para la siguiente llamada
+    snapshot_seq = get_change_seq(cursor)
+    
+    query = 'SELECT seq, tabla, registro_id, operacion FROM cambios WHERE seq > ? AND seq <= ?'
+    params = [since, snapshot_seq]
+    if usuario:
+        query += ' AND usuario = ?'
+        params.append(usuario)
+    query += ' ORDER BY seq LIMIT ?'
+    params.append(CHANGES_PAGE_MAX + 1)
     
-    return jsonify(gastos_list)
+    cursor.execute(query, params)
+    cambios = cursor.fetchall()
+    
+    has_more = len(cambios) > CHANGES_PAGE_MAX
+    if has_more:
+        cambios = cambios[:CHANGES_PAGE_MAX]
+        last_seq = cambios[-1][0]
+    else:
+        # Sin más cambios para este usuario: el cliente puede avanzar hasta la cota
+        last_seq = max(since, snapshot_seq)
+    
+    upsert_ids = {'gastos': [], 'viaje_detalles': []}
+    deleted_ids = {'gastos': [], 'viaje_detalles': []}
+    for seq, tabla, registro_id, operacion in cambios:
+        if operacion == 'delete':
+            deleted_ids[tabla].append(registro_id)
+        else:
+            upsert_ids[tabla].append(registro_id)
+    
+    gastos_upserts = []
+    for chunk_start in range(0, len(upsert_ids['gastos']), 500):
+        chunk = upsert_ids['gastos'][chunk_start:chunk_start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT {GASTO_API_COLUMNS} FROM gastos WHERE id IN ({placeholders})', chunk)
+        gastos_upserts.extend(gasto_to_dict(row) for row in cursor.fetchall())
+    
+    detalles_upserts = []
+    for chunk_start in range(0, len(upsert_ids['viaje_detalles']), 500):
+        chunk = upsert_ids['viaje_detalles'][chunk_start:chunk_start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT id, motivo, importe_eur, importe_original, moneda_original, cuadrado, {DETALLE_GASTO_IDS}, usuario, created_at
+            FROM viaje_detalles WHERE id IN ({placeholders})
+        ''', chunk)
+        for detalle in cursor.fetchall():
+            detalles_upserts.append({
+                'id': detalle[0],
+                'motivo': detalle[1],
+                'importe_eur': detalle[2],
+                'importe_original': detalle[3],
+                'moneda_original': detalle[4],
+                'cuadrado': bool(detalle[5]),
+                **detalle_gastos(detalle[6]),
+                'usuario': detalle[7],
+                'created_at': detalle[8]
+            })
+    
+    return jsonify({
+        'seq': last_seq,
+        'has_more': has_more,
+        'gastos': {
+            'upserts': gastos_upserts,
+            'deleted': deleted_ids['gastos']
+        },
+        'viaje_detalles': {
+            'upserts': detalles_upserts,
+            'deleted': deleted_ids['viaje_detalles']
+        }
+    })
+
+def process_image_job(image_source):
+    """Trabajo de la cola: procesar la imagen y devolver el resultado serializable"""
+    try:
+        image_result = process_image(image_source)
+    finally:
+        if hasattr(image_source, 'close'):
+            image_source.close()
+    if not image_result:
+        raise ValueError('Error procesando imagen')
+    return image_result
+
+def image_job_response(job):
+    """Respuesta JSON de un trabajo de procesamiento de imagen"""
+    payload = {
+        'job_id': job['id'],
+        'status': job['estado']
+    }
+    if job['estado'] == JOB_DONE:
+        resultado = job['resultado']
+        payload.update({
+            'success': True,
+            'filename': resultado['filename'],
+            'extracted_info': resultado['extracted_info'],
+            'text': resultado['text']
+        })
+    elif job['estado'] == JOB_ERROR:
+        payload.update({'success': False, 'error': job['error'] or 'Error procesando imagen'})
+    return payload
 
 @app.route('/api/process-image', methods=['POST'])
+@login_required
 def process_image_only():
-    """Procesar imagen sin guardar gasto - solo extraer información"""
+    """Encolar el procesamiento de una imagen sin guardar gasto - solo extraer información
+
+    Responde 202 con job_id al instante; el resultado se consulta en
+    GET /api/process-image/<job_id>. Con ?wait=1 se espera al resultado (compatibilidad).
+    La imagen puede llegar como multipart (campo 'image'), como cuerpo binario
+    o como data URL en JSON.
+    """
     try:
-        data = request.get_json()
+        try:
+            data, image_source = get_uploaded_image()
+        except UploadTooLargeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 413
         
-        if 'image' not in data or not data['image']:
+        if not image_source:
             return jsonify({'success': False, 'error': 'No se proporcionó imagen'})
         
-        # Procesar imagen
-        image_result = process_image(data['image'])
+        try:
+            job_id = image_jobs.submit(process_image_job, image_source, usuario=get_current_user())
+        except QueueFullError:
+            if hasattr(image_source, 'close'):
+                image_source.close()
+            response = jsonify({'success': False, 'error': 'Servidor ocupado procesando tickets, inténtalo en unos segundos'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
         
-        if image_result:
-            return jsonify({
-                'success': True,
-                'filename': image_result['filename'],
-                'extracted_info': image_result['extracted_info'],
-                'text': image_result['text']
-            })
-        else:
-            return jsonify({'success': False, 'error': 'Error procesando imagen'})
+        if request.args.get('wait', '').lower() in ('1', 'true'):
+            job = image_jobs.wait(job_id, timeout=120)
+            return jsonify(image_job_response(job))
+        
+        return jsonify({'success': True, 'job_id': job_id, 'status': 'pendiente'}), 202
             
     except Exception as e:
         print(f"Error procesando imagen: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/process-image/<job_id>', methods=['GET'])
+@login_required
+def get_process_image_job(job_id):
+    """Estado y resultado de un trabajo de procesamiento de imagen"""
+    job = image_jobs.get(job_id)
+    if not job or job['tipo'] != image_jobs.nombre:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    
+    if job['usuario'] != get_current_user() and not is_admin():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    
+    return jsonify(image_job_response(job))
+
 @app.route('/api/gastos', methods=['POST'])
 @login_required
 def add_gasto():
-    """Añadir nuevo gasto"""
+    """Añadir nuevo gasto (JSON o multipart/form-data con fichero 'image')"""
     try:
-        data = request.get_json()
+        try:
+            data, image_source = get_uploaded_image()
+        except UploadTooLargeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 413
         
         # Manejar imagen (ya procesada o nueva)
         image_filename = None
@@ -835,9 +1029,11 @@ def add_gasto():
         if 'processed_image_filename' in data and data['processed_image_filename']:
             # Usar imagen ya procesada
             image_filename = data['processed_image_filename']
-        elif 'image' in data and data['image']:
+        elif image_source:
             # Procesar nueva imagen
-            image_result = process_image(data['image'])
+            image_result = process_image(image_source)
+            if hasattr(image_source, 'close'):
+                image_source.close()
             if image_result:
                 image_filename = image_result['filename']
                 extracted_info = image_result['extracted_info']
@@ -875,7 +1071,7 @@ def add_gasto():
         # CONVERSIÓN AUTOMÁTICA: Si hay moneda diferente a EUR, convertir automáticamente
         if importe_otra_moneda and moneda_otra and moneda_otra != 'EUR':
             # Convertir automáticamente a EUR
-            auto_eur = convert_to_eur(importe_otra_moneda, moneda_otra)
+            auto_eur = convert_to_eur(importe_otra_moneda, moneda_otra, fecha)
             
             # Si no se proporcionó importe_eur o es 0, usar la conversión automática
             if not importe_eur or importe_eur == 0:
@@ -903,7 +1099,7 @@ def add_gasto():
             fecha = datetime.now().strftime('%Y-%m-%d')
         
         # Insertar en base de datos
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO gastos (fecha, concepto, motivo, descripcion, importe_eur, 
@@ -922,7 +1118,6 @@ def add_gasto():
             ''', (motivo, motivo, datetime.now().isoformat()))
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True, 
@@ -937,23 +1132,24 @@ def add_gasto():
 @app.route('/api/gastos/<int:gasto_id>', methods=['PUT'])
 @login_required
 def update_gasto(gasto_id):
-    """Actualizar gasto existente"""
+    """Actualizar gasto existente (JSON o multipart/form-data con fichero 'image')"""
     try:
-        data = request.get_json()
+        try:
+            data, image_source = get_uploaded_image()
+        except UploadTooLargeError as e:
+            return jsonify({'success': False, 'error': str(e)}), 413
         
         # Verificar autorización: usuario solo puede editar sus propios gastos
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT usuario FROM gastos WHERE id = ?', (gasto_id,))
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Gasto no encontrado'}), 404
         
         gasto_owner = result[0]
         if not is_admin() and gasto_owner != get_current_user():
-            conn.close()
             return jsonify({'success': False, 'error': 'No autorizado para editar este gasto'}), 403
         
         # Manejar imagen
@@ -961,9 +1157,11 @@ def update_gasto(gasto_id):
         if 'processed_image_filename' in data:
             # Usar imagen ya procesada
             image_filename = data['processed_image_filename']
-        elif 'image' in data:
+        elif image_source:
             # Procesar nueva imagen
-            image_result = process_image(data['image'])
+            image_result = process_image(image_source)
+            if hasattr(image_source, 'close'):
+                image_source.close()
             if image_result:
                 image_filename = image_result['filename']
         elif 'existing_image_filename' in data:
@@ -991,7 +1189,7 @@ def update_gasto(gasto_id):
         # CONVERSIÓN AUTOMÁTICA: Si hay moneda diferente a EUR, convertir automáticamente
         if importe_otra_moneda and moneda_otra and moneda_otra != 'EUR':
             # Convertir automáticamente a EUR
-            auto_eur = convert_to_eur(importe_otra_moneda, moneda_otra)
+            auto_eur = convert_to_eur(importe_otra_moneda, moneda_otra, data.get('fecha'))
             
             # Si no se proporcionó importe_eur o es 0, usar la conversión automática
             if not importe_eur or importe_eur == 0:
@@ -1011,8 +1209,8 @@ def update_gasto(gasto_id):
                     importe_eur = ?, importe_otra_moneda = ?, moneda_otra = ?, imagen_path = ?, checkeado = ?
                 WHERE id = ?
             ''', (data['fecha'], data['concepto'], data['motivo'], data['descripcion'],
-                  data['importe_eur'], data.get('importe_otra_moneda'), 
-                  data.get('moneda_otra'), image_filename, data.get('checkeado', False), gasto_id))
+                  importe_eur, importe_otra_moneda, 
+                  moneda_otra, image_filename, data.get('checkeado', False), gasto_id))
         else:
             cursor.execute('''
                 UPDATE gastos 
@@ -1020,8 +1218,8 @@ def update_gasto(gasto_id):
                     importe_eur = ?, importe_otra_moneda = ?, moneda_otra = ?, checkeado = ?
                 WHERE id = ?
             ''', (data['fecha'], data['concepto'], data['motivo'], data['descripcion'],
-                  data['importe_eur'], data.get('importe_otra_moneda'), 
-                  data.get('moneda_otra'), data.get('checkeado', False), gasto_id))
+                  importe_eur, importe_otra_moneda, 
+                  moneda_otra, data.get('checkeado', False), gasto_id))
         
         # Actualizar motivo si se proporciona
         if data.get('motivo'):
@@ -1031,7 +1229,6 @@ def update_gasto(gasto_id):
             ''', (data['motivo'], data['motivo'], datetime.now().isoformat()))
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -1043,7 +1240,7 @@ def update_gasto(gasto_id):
 def delete_gasto(gasto_id):
     """Eliminar gasto"""
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verificar autorización: usuario solo puede eliminar sus propios gastos
@@ -1051,17 +1248,15 @@ def delete_gasto(gasto_id):
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Gasto no encontrado'}), 404
         
         image_path, gasto_owner, detalle_cuadrado = result
         if not is_admin() and gasto_owner != get_current_user():
-            conn.close()
             return jsonify({'success': False, 'error': 'No autorizado para eliminar este gasto'}), 403
         
         # Si el gasto está cuadrado con algún viaje, descuadrarlo automáticamente
         if detalle_cuadrado:
-            cursor.execute('UPDATE viaje_detalles SET cuadrado = FALSE, gasto_id = NULL WHERE gasto_id = ?', (gasto_id,))
+            unlink(cursor, gasto_ids=[gasto_id])
             print(f"✅ Gasto {gasto_id} descuadrado automáticamente al ser eliminado")
         
         # Eliminar archivo de imagen si existe
@@ -1072,7 +1267,6 @@ def delete_gasto(gasto_id):
         
         cursor.execute('DELETE FROM gastos WHERE id = ?', (gasto_id,))
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -1087,7 +1281,7 @@ def update_checkeado(gasto_id):
         data = request.get_json()
         checkeado = data.get('checkeado', False)
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verificar autorización: usuario solo puede actualizar sus propios gastos
@@ -1095,23 +1289,19 @@ def update_checkeado(gasto_id):
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Gasto no encontrado'}), 404
         
         gasto_owner = result[0]
         if not is_admin() and gasto_owner != get_current_user():
-            conn.close()
             return jsonify({'success': False, 'error': 'No autorizado para actualizar este gasto'}), 403
         
         # Actualizar solo el campo checkeado
         cursor.execute('UPDATE gastos SET checkeado = ? WHERE id = ?', (checkeado, gasto_id))
         
         if cursor.rowcount == 0:
-            conn.close()
             return jsonify({'success': False, 'error': 'Gasto no encontrado'}), 404
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -1119,21 +1309,22 @@ def update_checkeado(gasto_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/conceptos', methods=['GET'])
+@conditional_etag('conceptos')
 def get_conceptos():
     """Obtener lista de conceptos"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT nombre FROM conceptos WHERE activo = TRUE ORDER BY nombre')
     conceptos = [row[0] for row in cursor.fetchall()]
-    conn.close()
     return jsonify(conceptos)
 
 @app.route('/api/motivos', methods=['GET'])
+@conditional_etag('motivos')
 def get_motivos():
     """Obtener lista de motivos ordenados por uso (solo activos por defecto)"""
     solo_activos = request.args.get('solo_activos', 'true').lower() == 'true'
     
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     if solo_activos:
@@ -1142,7 +1333,6 @@ def get_motivos():
         cursor.execute('SELECT nombre, activo FROM motivos ORDER BY activo DESC, usado_veces DESC, ultimo_uso DESC')
     
     motivos_data = cursor.fetchall()
-    conn.close()
     
     # Si se pide todos, devolver con info de estado activo
     if not solo_activos:
@@ -1161,13 +1351,12 @@ def add_motivo():
         if not motivo:
             return jsonify({'success': False, 'error': 'El motivo no puede estar vacío'}), 400
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verificar si ya existe
         cursor.execute('SELECT nombre FROM motivos WHERE nombre = ?', (motivo,))
         if cursor.fetchone():
-            conn.close()
             return jsonify({'success': False, 'error': 'Este motivo ya existe'}), 400
         
         # Insertar nuevo motivo (activo por defecto)
@@ -1177,7 +1366,6 @@ def add_motivo():
         ''', (motivo, datetime.now().isoformat()))
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True, 'message': 'Motivo añadido correctamente'})
         
@@ -1192,13 +1380,12 @@ def delete_motivo(motivo_nombre):
         from urllib.parse import unquote
         motivo_nombre = unquote(motivo_nombre)
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verificar si el motivo existe
         cursor.execute('SELECT nombre FROM motivos WHERE nombre = ?', (motivo_nombre,))
         if not cursor.fetchone():
-            conn.close()
             return jsonify({'success': False, 'error': 'Motivo no encontrado'}), 404
         
         # Verificar si el motivo está siendo usado en gastos
@@ -1206,7 +1393,6 @@ def delete_motivo(motivo_nombre):
         gastos_count = cursor.fetchone()[0]
         
         if gastos_count > 0:
-            conn.close()
             return jsonify({
                 'success': False, 
                 'error': f'No se puede eliminar el motivo porque está siendo usado en {gastos_count} gasto(s). Elimina primero esos gastos o cambia su motivo.'
@@ -1215,7 +1401,6 @@ def delete_motivo(motivo_nombre):
         # Eliminar el motivo
         cursor.execute('DELETE FROM motivos WHERE nombre = ?', (motivo_nombre,))
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True, 'message': 'Motivo eliminado correctamente'})
         
@@ -1229,7 +1414,7 @@ def toggle_motivo_activo(motivo_nombre):
         from urllib.parse import unquote
         motivo_nombre = unquote(motivo_nombre)
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Obtener estado actual
@@ -1237,7 +1422,6 @@ def toggle_motivo_activo(motivo_nombre):
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Motivo no encontrado'}), 404
         
         # Cambiar estado
@@ -1245,7 +1429,6 @@ def toggle_motivo_activo(motivo_nombre):
         cursor.execute('UPDATE motivos SET activo = ? WHERE nombre = ?', (nuevo_estado, motivo_nombre))
         
         conn.commit()
-        conn.close()
         
         estado_texto = "activado" if nuevo_estado else "desactivado"
         return jsonify({'success': True, 'message': f'Viaje {estado_texto} correctamente', 'activo': nuevo_estado})
@@ -1255,50 +1438,90 @@ def toggle_motivo_activo(motivo_nombre):
 
 @app.route('/api/convert-currency', methods=['POST'])
 def convert_currency():
-    """Convertir moneda"""
+    """Convertir moneda con el tipo vigente en 'fecha' (opcional, hoy si no se indica)"""
     try:
         data = request.get_json()
         amount = float(data['amount'])
         from_currency = data['from_currency']
         to_currency = data['to_currency']
-        
-        print(f"🔄 Conversión: {amount} {from_currency} → {to_currency}")
+        fecha = data.get('fecha') or None
         
         if from_currency == to_currency:
-            print(f"✅ Misma moneda, retornando: {amount}")
             return jsonify({'converted_amount': amount})
         
-        # Obtener tasas de cambio
-        from_rate = EXCHANGE_RATES.get(from_currency, 1)
-        to_rate = EXCHANGE_RATES.get(to_currency, 1)
-        
-        print(f"📊 Tasas - {from_currency}: {from_rate}, {to_currency}: {to_rate}")
-        
-        # Convertir a EUR primero si no es EUR
-        if from_currency != 'EUR':
-            amount_eur = amount / from_rate
-            print(f"💱 {amount} {from_currency} / {from_rate} = {amount_eur} EUR")
-        else:
-            amount_eur = amount
-            print(f"💰 Ya en EUR: {amount_eur}")
-        
-        # Convertir de EUR a moneda destino
-        if to_currency != 'EUR':
-            converted_amount = amount_eur * to_rate
-            print(f"💱 {amount_eur} EUR * {to_rate} = {converted_amount} {to_currency}")
-        else:
-            converted_amount = amount_eur
-            print(f"💰 Resultado en EUR: {converted_amount}")
-        
-        final_amount = round(converted_amount, 2)
-        print(f"✅ Resultado final: {final_amount} {to_currency}")
-        
-        return jsonify({'converted_amount': final_amount})
+        converted_amount = exchange_rates.convert(amount, from_currency, to_currency, fecha)
+        return jsonify({'converted_amount': round(converted_amount, 2)})
         
     except Exception as e:
         print(f"❌ Error en conversión: {e}")
         return jsonify({'error': str(e)}), 400
 
+@app.route('/api/tipos-cambio', methods=['GET'])
+@admin_required
+def get_tipos_cambio():
+    """Monedas con histórico (rango de fechas y último tipo) y tipos fijos de config.py (solo admin)"""
+    return jsonify(exchange_rates.summary())
+
+@app.route('/api/tipos-cambio/importar', methods=['POST'])
+@admin_required
+def importar_tipos_cambio():
+    """Importar un CSV de tipos de cambio (fichero 'file'): formato del BCE o moneda,fecha,tasa"""
+    fichero = request.files.get('file')
+    if not fichero:
+        return jsonify({'success': False, 'error': 'Falta el fichero CSV'}), 400
+    try:
+        texto = fichero.read().decode('utf-8-sig')
+        guardados = exchange_rates.import_csv(texto, fuente=fichero.filename or 'csv')
+    except (UnicodeDecodeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'CSV no válido: {e}'}), 400
+    print(f"💱 {guardados} tipos de cambio importados de {fichero.filename}")
+    return jsonify({'success': True, 'importados': guardados})
+
+def run_recompute_eur_job(desde, hasta, dry_run):
+    with db_pool.connection() as conn:
+        return recompute_eur_amounts(conn, exchange_rates, desde, hasta, dry_run,
+                                     progress=maintenance_jobs.report_progress)
+
+@app.route('/api/tipos-cambio/recalcular', methods=['POST'])
+@admin_required
+def recalcular_importes_eur():
+    """Encolar el recálculo de importe_eur de gastos y detalles en otra moneda con el tipo de su fecha
+
+    Opcional: desde / hasta (YYYY-MM-DD) y dry_run para ver cuántos importes
+    cambiarían sin guardarlos. Los gastos y detalles ya cuadrados no se tocan.
+    """
+    data = request.get_json(silent=True) or {}
+    desde, hasta = data.get('desde') or None, data.get('hasta') or None
+    for valor in (desde, hasta):
+        if valor:
+            try:
+                datetime.strptime(valor, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'success': False, 'error': f'Fecha no válida: {valor}'}), 400
+    try:
+        job_id = maintenance_jobs.submit(run_recompute_eur_job, desde, hasta, bool(data.get('dry_run')),
+                                         usuario=get_current_user())
+    except QueueFullError:
+        response = jsonify({'success': False, 'error': 'Ya hay un recálculo en curso, inténtalo más tarde'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    return jsonify({'success': True, 'job_id': job_id, 'status': 'pendiente'}), 202
+
+@app.route('/api/tipos-cambio/recalcular/<job_id>', methods=['GET'])
+@admin_required
+def get_recalculo_job(job_id):
+    """Estado y resultado de un recálculo de importes en EUR"""
+    job = maintenance_jobs.get(job_id)
+    if not job or job['tipo'] != maintenance_jobs.nombre:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['estado'],
+        'progress': job['progreso'],
+        'resultado': job['resultado'],
+        'error': job['error']
+    })
+
 # ====================== ENDPOINTS DETALLES DE VIAJES ======================
 
 @app.route('/api/viajes/<motivo>/detalles', methods=['GET'])
@@ -1309,20 +1532,20 @@ def get_viaje_detalles(motivo):
         from urllib.parse import unquote
         motivo = unquote(motivo)
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Obtener detalles del viaje según el usuario - ordenados de más barato a más caro
         if is_admin():
-            cursor.execute('''
-                SELECT id, importe_eur, importe_original, moneda_original, cuadrado, gasto_id, usuario, created_at
+            cursor.execute(f'''
+                SELECT id, importe_eur, importe_original, moneda_original, cuadrado, {DETALLE_GASTO_IDS}, usuario, created_at
                 FROM viaje_detalles 
                 WHERE motivo = ?
                 ORDER BY importe_eur ASC, created_at DESC
             ''', (motivo,))
         else:
-            cursor.execute('''
-                SELECT id, importe_eur, importe_original, moneda_original, cuadrado, gasto_id, usuario, created_at
+            cursor.execute(f'''
+                SELECT id, importe_eur, importe_original, moneda_original, cuadrado, {DETALLE_GASTO_IDS}, usuario, created_at
                 FROM viaje_detalles 
                 WHERE motivo = ? AND usuario = ?
                 ORDER BY importe_eur ASC, created_at DESC
@@ -1332,7 +1555,6 @@ def get_viaje_detalles(motivo):
         
         # Obtener número total de gastos esperados (detalles del viaje)
         total_gastos_esperados = len(detalles)
-        conn.close()
         
         detalles_list = []
         for detalle in detalles:
@@ -1342,7 +1564,7 @@ def get_viaje_detalles(motivo):
                 'importe_original': detalle[2],
                 'moneda_original': detalle[3],
                 'cuadrado': bool(detalle[4]),
-                'gasto_id': detalle[5],
+                **detalle_gastos(detalle[5]),
                 'usuario': detalle[6],
                 'created_at': detalle[7]
             })
@@ -1380,7 +1602,7 @@ def add_viaje_detalle(motivo):
         else:
             importe_eur = convert_to_eur(importe_original, moneda_original)
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1390,7 +1612,6 @@ def add_viaje_detalle(motivo):
         
         detalle_id = cursor.lastrowid
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True, 'id': detalle_id})
         
@@ -1402,7 +1623,7 @@ def add_viaje_detalle(motivo):
 def delete_viaje_detalle(detalle_id):
     """Eliminar detalle de viaje"""
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verificar autorización
@@ -1410,16 +1631,15 @@ def delete_viaje_detalle(detalle_id):
         result = cursor.fetchone()
         
         if not result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Detalle no encontrado'}), 404
         
         if not is_admin() and result[0] != get_current_user():
-            conn.close()
             return jsonify({'success': False, 'error': 'No autorizado'}), 403
         
+        # Un detalle cuadrado deja de nuevo pendientes a sus gastos
+        unlink(cursor, detalle_ids=[detalle_id])
         cursor.execute('DELETE FROM viaje_detalles WHERE id = ?', (detalle_id,))
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -1428,10 +1648,11 @@ def delete_viaje_detalle(detalle_id):
 
 @app.route('/api/viajes/todos-con-detalles', methods=['GET'])
 @login_required
+@conditional_etag('viaje_detalles')
 def get_todos_viajes_con_detalles():
     """Obtener todos los viajes que tienen detalles configurados (incluyendo los completamente cuadrados)"""
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         if is_admin():
@@ -1449,7 +1670,6 @@ def get_todos_viajes_con_detalles():
             ''', (get_current_user(),))
         
         resultados = cursor.fetchall()
-        conn.close()
         
         viajes = []
         for resultado in resultados:
@@ -1470,44 +1690,35 @@ def get_todos_viajes_con_detalles():
 
 @app.route('/api/viajes/resumen', methods=['GET'])
 @login_required
+@conditional_etag('viaje_detalles')
 def get_viajes_resumen():
-    """Obtener resumen de viajes con detalles pendientes"""
+    """Obtener resumen de viajes con detalles pendientes
+
+    Lee trip_summary, que los triggers de viaje_detalles mantienen al día:
+    una fila por viaje y usuario en lugar de agregar todos los detalles.
+    """
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         if is_admin():
             cursor.execute('''
-                SELECT 
-                    motivo,
-                    usuario,
-                    COUNT(*) as total_detalles,
-                    SUM(CASE WHEN cuadrado = 0 THEN 1 ELSE 0 END) as pendientes,
-                    SUM(importe_eur) as total_importe,
-                    SUM(CASE WHEN cuadrado = 0 THEN importe_eur ELSE 0 END) as importe_pendiente
-                FROM viaje_detalles 
-                GROUP BY motivo, usuario
-                HAVING total_detalles > 0 AND importe_pendiente > 0
+                SELECT motivo, usuario, total_detalles, pendientes,
+                       total_cents / 100.0, pendiente_cents / 100.0
+                FROM trip_summary
+                WHERE pendiente_cents > 0
                 ORDER BY motivo, usuario
             ''')
         else:
             cursor.execute('''
-                SELECT 
-                    motivo,
-                    usuario,
-                    COUNT(*) as total_detalles,
-                    SUM(CASE WHEN cuadrado = 0 THEN 1 ELSE 0 END) as pendientes,
-                    SUM(importe_eur) as total_importe,
-                    SUM(CASE WHEN cuadrado = 0 THEN importe_eur ELSE 0 END) as importe_pendiente
-                FROM viaje_detalles 
-                WHERE usuario = ?
-                GROUP BY motivo
-                HAVING total_detalles > 0 AND importe_pendiente > 0
+                SELECT motivo, usuario, total_detalles, pendientes,
+                       total_cents / 100.0, pendiente_cents / 100.0
+                FROM trip_summary
+                WHERE usuario = ? AND pendiente_cents > 0
                 ORDER BY motivo
             ''', (get_current_user(),))
         
         resultados = cursor.fetchall()
-        conn.close()
         
         resumen = []
         for resultado in resultados:
@@ -1533,7 +1744,7 @@ def cuadrar_gasto(gasto_id):
         data = request.get_json()
         detalle_id = data.get('detalle_id')
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verificar que el gasto existe y pertenece al usuario
@@ -1541,11 +1752,9 @@ def cuadrar_gasto(gasto_id):
         gasto_result = cursor.fetchone()
         
         if not gasto_result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Gasto no encontrado'}), 404
         
         if not is_admin() and gasto_result[0] != get_current_user():
-            conn.close()
             return jsonify({'success': False, 'error': 'No autorizado'}), 403
         
         # Verificar que el detalle existe y no está cuadrado
@@ -1553,24 +1762,19 @@ def cuadrar_gasto(gasto_id):
         detalle_result = cursor.fetchone()
         
         if not detalle_result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Detalle no encontrado'}), 404
         
         if detalle_result[2]:  # Ya está cuadrado
-            conn.close()
             return jsonify({'success': False, 'error': 'Este detalle ya está cuadrado'}), 400
         
         # Verificar que el motivo coincide
         if gasto_result[1] != detalle_result[0]:
-            conn.close()
             return jsonify({'success': False, 'error': 'El gasto y el detalle no pertenecen al mismo viaje'}), 400
         
         # Cuadrar
-        cursor.execute('UPDATE viaje_detalles SET cuadrado = TRUE, gasto_id = ? WHERE id = ?', (gasto_id, detalle_id))
-        cursor.execute('UPDATE gastos SET detalle_cuadrado = TRUE WHERE id = ?', (gasto_id,))
+        save_groups(cursor, [{'gastos': [gasto_id], 'detalles': [detalle_id]}])
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -1582,7 +1786,7 @@ def cuadrar_gasto(gasto_id):
 def descuadrar_gasto(gasto_id):
     """Descuadrar un gasto"""
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Verificar que el gasto existe y pertenece al usuario
@@ -1590,19 +1794,15 @@ def descuadrar_gasto(gasto_id):
         gasto_result = cursor.fetchone()
         
         if not gasto_result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Gasto no encontrado'}), 404
         
         if not is_admin() and gasto_result[0] != get_current_user():
-            conn.close()
             return jsonify({'success': False, 'error': 'No autorizado'}), 403
         
         # Descuadrar
-        cursor.execute('UPDATE viaje_detalles SET cuadrado = FALSE, gasto_id = NULL WHERE gasto_id = ?', (gasto_id,))
-        cursor.execute('UPDATE gastos SET detalle_cuadrado = FALSE WHERE id = ?', (gasto_id,))
+        unlink(cursor, gasto_ids=[gasto_id])
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
         
@@ -1614,7 +1814,7 @@ def descuadrar_gasto(gasto_id):
 def buscar_cuadre_automatico(gasto_id):
     """Buscar automáticamente detalles de viaje que coincidan con el importe del gasto"""
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Obtener información del gasto
@@ -1622,17 +1822,14 @@ def buscar_cuadre_automatico(gasto_id):
         gasto_result = cursor.fetchone()
         
         if not gasto_result:
-            conn.close()
             return jsonify({'success': False, 'error': 'Gasto no encontrado'}), 404
         
         if not is_admin() and gasto_result[0] != get_current_user():
-            conn.close()
             return jsonify({'success': False, 'error': 'No autorizado'}), 403
         
         usuario, motivo, importe_eur = gasto_result
         
         if not motivo:
-            conn.close()
             return jsonify({'candidatos': []})
         
         # Buscar detalles no cuadrados con el mismo importe y motivo
@@ -1644,7 +1841,6 @@ def buscar_cuadre_automatico(gasto_id):
         ''', (motivo, usuario, importe_eur))
         
         candidatos = cursor.fetchall()
-        conn.close()
         
         candidatos_list = []
         for candidato in candidatos:
@@ -1660,785 +1856,375 @@ def buscar_cuadre_automatico(gasto_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/viajes/<motivo>/auto-cuadrar', methods=['POST'])
+@login_required
+def auto_cuadrar_viaje(motivo):
+    """Cuadrar de una vez todos los gastos pendientes de un viaje con sus detalles
+
+    Exactos al céntimo primero, después los más cercanos dentro de la
+    tolerancia (solo uno a uno) y por último grupos de varios gastos o varios
+    detalles que suman el mismo importe al céntimo (JSON: tolerancia en EUR, dry_run para ver la propuesta sin
+    aplicarla; el admin puede limitarlo a un usuario).
+    """
+    try:
+        from urllib.parse import unquote
+        motivo = unquote(motivo)
+        
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run', False))
+        try:
+            tolerancia = float(data.get('tolerancia', CUADRE_TOLERANCIA))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Tolerancia no válida'}), 400
+        if tolerancia < 0:
+            return jsonify({'success': False, 'error': 'La tolerancia no puede ser negativa'}), 400
+        usuario = data.get('usuario') if is_admin() else get_current_user()
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        if not dry_run:
+            # Lectura y escritura en la misma transacción: nadie cuadra a mano entre medias
+            cursor.execute('BEGIN IMMEDIATE')
+        
+        filtro_usuario = ' AND usuario = ?' if usuario else ''
+        params = (motivo, usuario) if usuario else (motivo,)
+        cursor.execute(f'''
+            SELECT id, usuario, importe_eur, concepto FROM gastos
+            WHERE motivo = ? AND COALESCE(detalle_cuadrado, 0) = 0{filtro_usuario}
+            ORDER BY created_at, id
+        ''', params)
+        gastos = cursor.fetchall()
+        # Detalles más recientes primero, igual que buscar-cuadre
+        cursor.execute(f'''
+            SELECT id, usuario, importe_eur FROM viaje_detalles
+            WHERE motivo = ? AND COALESCE(cuadrado, 0) = 0{filtro_usuario}
+            ORDER BY created_at DESC, id DESC
+        ''', params)
+        detalles = cursor.fetchall()
+        
+        # Cada usuario cuadra sus gastos con sus propios detalles
+        gastos_por_usuario, detalles_por_usuario = {}, {}
+        importes_gasto, importes_detalle, conceptos = {}, {}, {}
+        for gasto_id, gasto_usuario, importe, concepto in gastos:
+            gastos_por_usuario.setdefault(gasto_usuario, []).append((gasto_id, importe))
+            importes_gasto[gasto_id] = importe
+            conceptos[gasto_id] = concepto
+        for detalle_id, detalle_usuario, importe in detalles:
+            detalles_por_usuario.setdefault(detalle_usuario, []).append((detalle_id, importe))
+            importes_detalle[detalle_id] = importe
+        
+        grupos = []
+        for gasto_usuario, gastos_usuario in gastos_por_usuario.items():
+            grupos.extend(solve(gastos_usuario, detalles_por_usuario.get(gasto_usuario, []), tolerancia,
+                                conceptos=conceptos))
+        gastos_cuadrados = sum(len(grupo['gastos']) for grupo in grupos)
+        detalles_cuadrados = sum(len(grupo['detalles']) for grupo in grupos)
+        
+        if not dry_run:
+            save_groups(cursor, grupos)
+            conn.commit()
+            print(f"⚖️ Viaje {motivo}: {gastos_cuadrados} gastos cuadrados automáticamente con {detalles_cuadrados} detalles")
+        
+        return jsonify({
+            'success': True,
+            'dry_run': dry_run,
+            'tolerancia': tolerancia,
+            # Un emparejamiento puede tener varios gastos (un detalle pagado en varios tickets)
+            # o varios detalles (un ticket que cubre varios importes esperados)
+            'emparejamientos': [{
+                'gasto_ids': grupo['gastos'],
+                'detalle_ids': grupo['detalles'],
+                'importe_gastos': round(sum(importes_gasto[g] for g in grupo['gastos']), 2),
+                'importe_detalles': round(sum(importes_detalle[d] for d in grupo['detalles']), 2),
+                'diferencia': grupo['diferencia'] / 100,
+                'exacto': grupo['diferencia'] == 0
+            } for grupo in grupos],
+            'gastos_cuadrados': gastos_cuadrados,
+            'gastos_pendientes': len(gastos) - gastos_cuadrados,
+            'detalles_pendientes': len(detalles) - detalles_cuadrados
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     """Servir archivos de imagen"""
     return send_from_directory(UPLOAD_FOLDER, filename)
 
+def export_filters(args):
+    """Filtros de exportación a partir de los parámetros de la petición"""
+    filtros = {
+        'fecha_inicio': args.get('fecha_inicio'),
+        'fecha_fin': args.get('fecha_fin'),
+        'user': args.get('user') or None,  # Filtro de usuario (solo admin)
+        'viaje': args.get('viaje') or None,  # Filtro de viaje
+        'tamano': 'reducido' if args.get('tamano') == 'reducido' else 'original',  # Imágenes reducidas o originales
+        'admin': is_admin(),
+        'usuario': get_current_user()
+    }
+    if not filtros['admin']:
+        filtros['user'] = None
+    return filtros
+
+def export_ambito(filtros):
+    """Quién puede ver una exportación: todos los admin o solo su usuario"""
+    return 'admin' if filtros['admin'] else filtros['usuario']
+
+def export_key(conn, formato, filtros):
+    """Clave de caché: formato, filtros, ámbito y versión actual de la tabla gastos"""
+    data_version = get_table_versions(conn, ['gastos'])[0]
+    claves = {campo: filtros[campo] for campo in ('fecha_inicio', 'fecha_fin', 'user', 'viaje', 'tamano')}
+    return export_cache_key(formato, claves, export_ambito(filtros), data_version)
+
+def artifact_response(artifact):
+    """Descargar un fichero de exportación guardado en la caché"""
+    return send_file(artifact['path'], mimetype=artifact['mimetype'], as_attachment=True,
+                     download_name=artifact['filename'], max_age=0)
+
+def export_response(formato):
+    """Exportación síncrona: se sirve de la caché si existe o se genera en la petición"""
+    filtros = export_filters(request.args)
+    if not filtros['fecha_inicio'] or not filtros['fecha_fin']:
+        return jsonify({'error': 'Fechas requeridas'}), 400
+    
+    artifact = export_artifacts.get(export_key(get_db(), formato, filtros))
+    if artifact:
+        return artifact_response(artifact)
+    
+    filename, mimetype, contenido = EXPORT_BUILDERS[formato](get_db(), filtros)
+    if mimetype == 'application/zip':
+        return zip_response(contenido, filename)
+    response = make_response(contenido)
+    response.headers['Content-Type'] = mimetype
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+def zip_response(entries, zip_filename):
+    """Respuesta HTTP que envía el ZIP en trozos según se va generando"""
+    response = Response(stream_zip(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={zip_filename}'
+    return response
+
+def build_pdf_export(conn, filtros):
+    """Generar el PDF de gastos filtrados"""
+    pdf, = render_export(conn, filtros, [PdfRenderer(filtros)])
+    return pdf
+
 @app.route('/api/export/pdf', methods=['GET'])
 @login_required
 def export_pdf():
     """Exportar gastos filtrados a PDF"""
     try:
-        fecha_inicio = request.args.get('fecha_inicio')
-        fecha_fin = request.args.get('fecha_fin')
-        filter_user = request.args.get('user')  # Filtro de usuario para admin
-        filter_viaje = request.args.get('viaje')  # Filtro de viaje
-        
-        if not fecha_inicio or not fecha_fin:
-            return jsonify({'error': 'Fechas requeridas'}), 400
-        
-        # Obtener gastos filtrados
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Construir consulta SQL con filtros dinámicos para PDF
-        if is_admin():
-            base_query = '''
-                SELECT fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ?
-            '''
-            params = [fecha_inicio, fecha_fin]
-            
-            if filter_user:
-                base_query += ' AND usuario = ?'
-                params.append(filter_user)
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        else:
-            # Usuario normal solo puede exportar sus propios gastos
-            base_query = '''
-                SELECT fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ? AND usuario = ?
-            '''
-            params = [fecha_inicio, fecha_fin, get_current_user()]
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        
-        gastos = cursor.fetchall()
-        conn.close()
-        
-        if not gastos:
-            return jsonify({'error': 'No hay gastos en el rango seleccionado'}), 404
-        
-        # Crear PDF simple
-        filename = f"gastos_{fecha_inicio}_{fecha_fin}.pdf"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        
-        doc = SimpleDocTemplate(filepath, pagesize=A4)
-        styles = getSampleStyleSheet()
-        
-        # Contenido del PDF
-        story = []
-        
-        # Formatear fechas del período a dd/mm/yyyy
-        def format_period_date(date_str):
-            try:
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                return date_obj.strftime('%d/%m/%Y')
-            except:
-                return date_str
-        
-        fecha_inicio_formatted = format_period_date(fecha_inicio)
-        fecha_fin_formatted = format_period_date(fecha_fin)
-        
-        # Título simple
-        story.append(Paragraph("Reporte de Gastos", styles['Title']))
-        story.append(Paragraph(f"Período: {fecha_inicio_formatted} - {fecha_fin_formatted}", styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Estadísticas básicas (sin promedio)
-        total_gastos = len(gastos)
-        total_importe = sum(gasto[4] for gasto in gastos)
-        
-        story.append(Paragraph(f"Total de tickets: {total_gastos}", styles['Normal']))
-        story.append(Paragraph(f"Importe total: EUR {total_importe:.2f}", styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Tabla simple
-        if is_admin():
-            data = [['Fecha', 'Concepto', 'Viaje', 'Descripción', 'Importe EUR', 'Otra Moneda', 'Moneda', 'Checkeado', 'Usuario']]
-        else:
-            data = [['Fecha', 'Concepto', 'Viaje', 'Descripción', 'Importe EUR', 'Otra Moneda', 'Moneda', 'Checkeado']]
-        
-        # Función para formatear fechas a dd/mm/yyyy
-        def format_date_for_pdf(date_str):
-            if date_str:
-                try:
-                    # Convertir de YYYY-MM-DD a DD/MM/YYYY
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                    return date_obj.strftime('%d/%m/%Y')
-                except:
-                    return date_str
-            return date_str
-        
-        for gasto in gastos:
-            fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario = gasto
-            fecha_formatted = format_date_for_pdf(fecha)
-            motivo_text = motivo or '-'
-            descripcion_text = descripcion or '-'
-            checkeado_text = 'Si' if checkeado else 'No'
-            
-            # Formatear otras monedas
-            importe_otra_text = f'{importe_otra_moneda:.2f}' if importe_otra_moneda else ''
-            moneda_otra_text = moneda_otra or ''
-            
-            # Truncar texto largo
-            if len(descripcion_text) > 25:
-                descripcion_text = descripcion_text[:25] + '...'
-            
-            if is_admin():
-                data.append([
-                    fecha_formatted,
-                    concepto,
-                    motivo_text,
-                    descripcion_text,
-                    f'{importe_eur:.2f}',
-                    importe_otra_text,
-                    moneda_otra_text,
-                    checkeado_text,
-                    usuario
-                ])
-            else:
-                data.append([
-                    fecha_formatted,
-                    concepto,
-                    motivo_text,
-                    descripcion_text,
-                    f'{importe_eur:.2f}',
-                    importe_otra_text,
-                    moneda_otra_text,
-                    checkeado_text
-                ])
-        
-        # Crear tabla simple
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ]))
-        
-        story.append(table)
-        
-        # Generar PDF
-        doc.build(story)
-        
-        # Leer archivo y enviarlo
-        with open(filepath, 'rb') as f:
-            pdf_data = f.read()
-        
-        # Limpiar archivo
-        os.unlink(filepath)
-        
-        # Crear respuesta
-        response = make_response(pdf_data)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-        
-        return response
-        
+        return export_response('pdf')
+    except ExportEmptyError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error exportando PDF: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Error generando PDF'}), 500
 
+def build_excel_export(conn, filtros):
+    """Generar el Excel de gastos filtrados"""
+    excel, = render_export(conn, filtros, [ExcelRenderer(filtros)])
+    return excel
+
 @app.route('/api/export/excel', methods=['GET'])
 @login_required
 def export_excel():
     """Exportar gastos filtrados a Excel"""
     try:
-        fecha_inicio = request.args.get('fecha_inicio')
-        fecha_fin = request.args.get('fecha_fin')
-        filter_user = request.args.get('user')  # Filtro de usuario para admin
-        filter_viaje = request.args.get('viaje')  # Filtro de viaje
-        
-        if not fecha_inicio or not fecha_fin:
-            return jsonify({'error': 'Fechas requeridas'}), 400
-        
-        # Obtener gastos filtrados
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Construir consulta SQL con filtros dinámicos para Excel
-        if is_admin():
-            base_query = '''
-                SELECT fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ?
-            '''
-            params = [fecha_inicio, fecha_fin]
-            
-            if filter_user:
-                base_query += ' AND usuario = ?'
-                params.append(filter_user)
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        else:
-            # Usuario normal solo puede exportar sus propios gastos
-            base_query = '''
-                SELECT fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ? AND usuario = ?
-            '''
-            params = [fecha_inicio, fecha_fin, get_current_user()]
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        
-        gastos = cursor.fetchall()
-        conn.close()
-        
-        if not gastos:
-            return jsonify({'error': 'No hay gastos en el rango seleccionado'}), 404
-        
-        # Crear datos para Excel sin pandas
-        if is_admin():
-            columns = ['Fecha', 'Concepto', 'Motivo', 'Descripcion', 'Importe EUR', 'Importe Otra Moneda', 'Moneda', 'Checkeado', 'Usuario']
-        else:
-            columns = ['Fecha', 'Concepto', 'Motivo', 'Descripcion', 'Importe EUR', 'Importe Otra Moneda', 'Moneda', 'Checkeado']
-        
-        # Convertir gastos a formato de lista para Excel
-        excel_data = []
-        for gasto in gastos:
-            row = [
-                gasto.get('fecha', ''),
-                gasto.get('concepto', ''),
-                gasto.get('motivo', ''),
-                gasto.get('descripcion', ''),
-                gasto.get('importe_eur', ''),
-                gasto.get('importe_otra_moneda', ''),
-                gasto.get('moneda', ''),
-                'Sí' if gasto.get('checkeado') else 'No'
-            ]
-            if is_admin():
-                row.append(gasto.get('usuario', ''))
-            excel_data.append(row)
-        
-        # Formatear fechas a formato dd/mm/yyyy
-        def format_date_for_excel(date_str):
-            if date_str:
-                try:
-                    # Convertir de YYYY-MM-DD a DD/MM/YYYY
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                    return date_obj.strftime('%d/%m/%Y')
-                except:
-                    return date_str
-            return date_str
-        
-        # Aplicar formato de fecha a los datos
-        for row in excel_data:
-            if row[0]:  # Fecha está en la primera columna
-                row[0] = format_date_for_excel(row[0])
-        
-        # Crear archivo Excel usando openpyxl directamente
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Gastos"
-        
-        # Añadir encabezados
-        for col, header in enumerate(columns, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center")
-        
-        # Añadir datos
-        for row_idx, row_data in enumerate(excel_data, 2):
-            for col_idx, value in enumerate(row_data, 1):
-                ws.cell(row=row_idx, column=col_idx, value=value)
-        
-        # Ajustar ancho de columnas
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Crear archivo Excel
-        filename = f"gastos_{fecha_inicio}_{fecha_fin}.xlsx"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # Guardar archivo
-        wb.save(filepath)
-        
-        # Leer archivo y enviarlo
-        with open(filepath, 'rb') as f:
-            excel_data = f.read()
-        
-        # Limpiar archivo
-        os.unlink(filepath)
-        
-        # Crear respuesta
-        response = make_response(excel_data)
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-        
-        return response
-        
+        return export_response('excel')
+    except ExportEmptyError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error exportando Excel: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Error generando Excel'}), 500
 
+def build_images_export(conn, filtros):
+    """Entradas del ZIP de imágenes de gastos filtrados"""
+    images, = render_export(conn, filtros, [ImageEntriesRenderer(filtros, UPLOAD_FOLDER)],
+                            solo_con_imagen=True, mensaje_vacio='No hay imágenes en el rango seleccionado')
+    filename, mimetype, entries = images
+    print(f"📷 ZIP de imágenes: {len(entries)} imágenes ({filtros['tamano']})")
+    if filtros['tamano'] == 'reducido':
+        entries = reduced_image_entries(entries)
+    return filename, mimetype, entries
+
 @app.route('/api/export/images', methods=['GET'])
 @login_required
 def export_images():
     """Exportar imágenes de gastos filtrados en un ZIP"""
     try:
-        fecha_inicio = request.args.get('fecha_inicio')
-        fecha_fin = request.args.get('fecha_fin')
-        filter_user = request.args.get('user')  # Filtro de usuario para admin
-        filter_viaje = request.args.get('viaje')  # Filtro de viaje
-        
-        if not fecha_inicio or not fecha_fin:
-            return jsonify({'error': 'Fechas requeridas'}), 400
-        
-        # Obtener gastos filtrados que tienen imágenes
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Construir consulta SQL con filtros dinámicos para imágenes
-        if is_admin():
-            base_query = '''
-                SELECT fecha, descripcion, imagen_path
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ? AND imagen_path IS NOT NULL AND imagen_path != ''
-            '''
-            params = [fecha_inicio, fecha_fin]
-            
-            if filter_user:
-                base_query += ' AND usuario = ?'
-                params.append(filter_user)
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        else:
-            # Usuario normal solo puede exportar sus propias imágenes
-            base_query = '''
-                SELECT fecha, descripcion, imagen_path
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ? AND imagen_path IS NOT NULL AND imagen_path != '' AND usuario = ?
-            '''
-            params = [fecha_inicio, fecha_fin, get_current_user()]
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        
-        gastos_con_imagenes = cursor.fetchall()
-        conn.close()
-        
-        if not gastos_con_imagenes:
-            return jsonify({'error': 'No hay imágenes en el rango seleccionado'}), 404
-        
-        # Crear archivo ZIP temporal
-        zip_filename = f"imagenes_gastos_{fecha_inicio}_{fecha_fin}.zip"
-        zip_filepath = os.path.join(UPLOAD_FOLDER, zip_filename)
-        
-        with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for i, (fecha, descripcion, imagen_path) in enumerate(gastos_con_imagenes):
-                # Construir ruta completa de la imagen
-                imagen_full_path = os.path.join(UPLOAD_FOLDER, imagen_path)
-                
-                # Verificar que la imagen existe
-                if os.path.exists(imagen_full_path):
-                    # Limpiar descripción para nombre de archivo
-                    descripcion_clean = descripcion or f"Gasto_{i+1}"
-                    # Remover caracteres no válidos para nombres de archivo
-                    descripcion_clean = re.sub(r'[<>:"/\\|?*]', '_', descripcion_clean)
-                    # Limitar longitud
-                    if len(descripcion_clean) > 50:
-                        descripcion_clean = descripcion_clean[:50]
-                    
-                    # Obtener extensión original
-                    _, ext = os.path.splitext(imagen_path)
-                    if not ext:
-                        ext = '.jpg'  # Por defecto
-                    
-                    # Crear nombre de archivo: descripcion_fecha.ext
-                    nuevo_nombre = f"{descripcion_clean}_{fecha}{ext}"
-                    
-                    # Añadir al ZIP
-                    zipf.write(imagen_full_path, nuevo_nombre)
-                    print(f"📷 Añadida imagen: {nuevo_nombre}")
-        
-        # Leer archivo ZIP
-        with open(zip_filepath, 'rb') as f:
-            zip_data = f.read()
-        
-        # Limpiar archivo temporal
-        os.unlink(zip_filepath)
-        
-        # Crear respuesta
-        response = make_response(zip_data)
-        response.headers['Content-Type'] = 'application/zip'
-        response.headers['Content-Disposition'] = f'attachment; filename={zip_filename}'
-        
-        print(f"✅ ZIP de imágenes generado: {len(gastos_con_imagenes)} imágenes")
-        return response
-        
+        return export_response('images')
+    except ExportEmptyError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error exportando imágenes: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Error generando ZIP de imágenes'}), 500
 
+def build_zip_export(conn, filtros):
+    """Entradas del ZIP completo (PDF + Excel + Imágenes) de gastos filtrados
+
+    Una sola consulta alimenta a la vez los tres renderizadores.
+    """
+    pdf, excel, images = render_export(
+        conn, filtros,
+        [PdfRenderer(filtros), ExcelRenderer(filtros), ImageEntriesRenderer(filtros, UPLOAD_FOLDER, carpeta='imagenes')],
+        mensaje_vacio='No se encontraron gastos en el rango de fechas especificado'
+    )
+    entries = [(pdf[0], pdf[2]), (excel[0], excel[2])] + images[2]
+    print(f"📦 ZIP completo: {len(images[2])} imágenes ({filtros['tamano']})")
+    if filtros['tamano'] == 'reducido':
+        entries = reduced_image_entries(entries)
+    
+    sufijo = '_reducido' if filtros['tamano'] == 'reducido' else ''
+    zip_filename = f"gastos_completo_{filtros['fecha_inicio']}_{filtros['fecha_fin']}{sufijo}.zip"
+    return zip_filename, 'application/zip', entries
+
 @app.route('/api/export/zip', methods=['GET'])
 @login_required
 def export_zip():
     """Exportar gastos filtrados en un ZIP completo (PDF + Excel + Imágenes)"""
     try:
-        fecha_inicio = request.args.get('fecha_inicio')
-        fecha_fin = request.args.get('fecha_fin')
-        filter_user = request.args.get('user')  # Filtro de usuario para admin
-        filter_viaje = request.args.get('viaje')  # Filtro de viaje
-        
-        if not fecha_inicio or not fecha_fin:
-            return jsonify({'error': 'Fechas requeridas'}), 400
-        
-        # Obtener gastos filtrados
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Construir consulta SQL con filtros dinámicos para ZIP
-        if is_admin():
-            base_query = '''
-                SELECT fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario, imagen_path
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ?
-            '''
-            params = [fecha_inicio, fecha_fin]
-            
-            if filter_user:
-                base_query += ' AND usuario = ?'
-                params.append(filter_user)
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        else:
-            # Usuario normal solo puede exportar sus propios gastos
-            base_query = '''
-                SELECT fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario, imagen_path
-                FROM gastos 
-                WHERE fecha BETWEEN ? AND ? AND usuario = ?
-            '''
-            params = [fecha_inicio, fecha_fin, get_current_user()]
-            
-            if filter_viaje:
-                base_query += ' AND motivo = ?'
-                params.append(filter_viaje)
-            
-            base_query += ' ORDER BY fecha DESC'
-            cursor.execute(base_query, params)
-        
-        gastos = cursor.fetchall()
-        conn.close()
-        
-        if not gastos:
-            return jsonify({'error': 'No se encontraron gastos en el rango de fechas especificado'}), 404
-        
-        # Crear directorio temporal
-        temp_dir = tempfile.mkdtemp()
-        
-        try:
-            # 1. Generar PDF
-            pdf_filename = f"gastos_{fecha_inicio}_{fecha_fin}.pdf"
-            pdf_path = os.path.join(temp_dir, pdf_filename)
-            
-            # Crear documento PDF
-            doc = SimpleDocTemplate(pdf_path, pagesize=A4)
-            story = []
-            styles = getSampleStyleSheet()
-            
-            # Título
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=20,
-                spaceAfter=30,
-                alignment=TA_CENTER
-            )
-            story.append(Paragraph("📊 Reporte de Gastos", title_style))
-            story.append(Spacer(1, 20))
-            
-            # Información del reporte
-            info_style = ParagraphStyle(
-                'InfoStyle',
-                parent=styles['Normal'],
-                fontSize=12,
-                spaceAfter=10
-            )
-            # Formatear fechas del período a dd/mm/yyyy
-            def format_period_date_zip(date_str):
-                try:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                    return date_obj.strftime('%d/%m/%Y')
-                except:
-                    return date_str
-            
-            fecha_inicio_formatted = format_period_date_zip(fecha_inicio)
-            fecha_fin_formatted = format_period_date_zip(fecha_fin)
-            
-            story.append(Paragraph(f"<b>Período:</b> {fecha_inicio_formatted} al {fecha_fin_formatted}", info_style))
-            story.append(Paragraph(f"<b>Generado:</b> {datetime.now().strftime('%d/%m/%Y %H:%M')}", info_style))
-            if filter_user:
-                story.append(Paragraph(f"<b>Usuario:</b> {filter_user}", info_style))
-            story.append(Spacer(1, 20))
-            
-            # Tabla de gastos
-            if is_admin():
-                table_data = [['Fecha', 'Concepto', 'Viaje', 'Descripción', 'Importe EUR', 'Otra Moneda', 'Moneda', 'Usuario']]
-            else:
-                table_data = [['Fecha', 'Concepto', 'Viaje', 'Descripción', 'Importe EUR', 'Otra Moneda', 'Moneda']]
-            
-            # Función para formatear fechas a dd/mm/yyyy
-            def format_date_for_zip_pdf(date_str):
-                if date_str:
-                    try:
-                        # Convertir de YYYY-MM-DD a DD/MM/YYYY
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                        return date_obj.strftime('%d/%m/%Y')
-                    except:
-                        return date_str
-                return date_str
-            
-            for gasto in gastos:
-                fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario, imagen_path = gasto
-                fecha_formatted = format_date_for_zip_pdf(fecha)
-                
-                                # Formatear otras monedas
-                importe_otra_text = f'{importe_otra_moneda:.2f}' if importe_otra_moneda else ''
-                moneda_otra_text = moneda_otra or ''
-                
-                if is_admin():
-                    table_data.append([
-                        fecha_formatted,
-                        concepto or '',
-                        motivo or '',
-                        descripcion or '',
-                        f"{importe_eur:.2f}" if importe_eur else '',
-                        importe_otra_text,
-                        moneda_otra_text,
-                        usuario or ''
-                    ])
-                else:
-                    table_data.append([
-                        fecha_formatted,
-                        concepto or '',
-                        motivo or '',
-                        descripcion or '',
-                        f"{importe_eur:.2f}" if importe_eur else '',
-                        importe_otra_text,
-                        moneda_otra_text
-                    ])
-            
-            # Ajustar anchos de columna según el número de columnas
-            if is_admin():
-                table = Table(table_data, colWidths=[0.8*inch, 1.2*inch, 1*inch, 1.5*inch, 0.8*inch, 0.8*inch, 0.6*inch, 0.8*inch])
-            else:
-                table = Table(table_data, colWidths=[0.8*inch, 1.2*inch, 1*inch, 1.8*inch, 0.8*inch, 0.8*inch, 0.6*inch])
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(table)
-            
-            # Calcular totales
-            total_eur = sum(float(gasto[4]) for gasto in gastos if gasto[4])
-            story.append(Spacer(1, 20))
-            story.append(Paragraph(f"<b>Total: {total_eur:.2f} €</b>", info_style))
-            
-            doc.build(story)
-            
-            # 2. Generar Excel
-            excel_filename = f"gastos_{fecha_inicio}_{fecha_fin}.xlsx"
-            excel_path = os.path.join(temp_dir, excel_filename)
-            
-            df_data = []
-            for gasto in gastos:
-                fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda, moneda_otra, checkeado, usuario, imagen_path = gasto
-                df_data.append({
-                    'Fecha': fecha,
-                    'Concepto': concepto or '',
-                    'Motivo': motivo or '',
-                    'Descripción': descripcion or '',
-                    'Importe EUR': importe_eur or 0,
-                    'Importe Otra Moneda': importe_otra_moneda if importe_otra_moneda is not None else '',
-                    'Moneda': moneda_otra or '',
-                    'Checkeado': 'Sí' if checkeado else 'No',
-                    'Usuario': usuario or ''
-                })
-            
-            # Formatear fechas a formato dd/mm/yyyy
-            def format_date_for_excel_zip(date_str):
-                if date_str:
-                    try:
-                        # Convertir de YYYY-MM-DD a DD/MM/YYYY
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                        return date_obj.strftime('%d/%m/%Y')
-                    except:
-                        return date_str
-                return date_str
-            
-            # Aplicar formato de fecha a los datos
-            for row in df_data:
-                if 'Fecha' in row:
-                    row['Fecha'] = format_date_for_excel_zip(row['Fecha'])
-            
-            # Crear archivo Excel usando openpyxl directamente
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, PatternFill, Alignment
-            
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Gastos"
-            
-            # Obtener columnas
-            if df_data:
-                columns = list(df_data[0].keys())
-                
-                # Añadir encabezados
-                for col, header in enumerate(columns, 1):
-                    cell = ws.cell(row=1, column=col, value=header)
-                    cell.font = Font(bold=True)
-                    cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-                    cell.alignment = Alignment(horizontal="center")
-                
-                # Añadir datos
-                for row_idx, row_data in enumerate(df_data, 2):
-                    for col_idx, header in enumerate(columns, 1):
-                        ws.cell(row=row_idx, column=col_idx, value=row_data.get(header, ''))
-                
-                # Ajustar ancho de columnas
-                for column in ws.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    ws.column_dimensions[column_letter].width = adjusted_width
-            
-            # Guardar archivo Excel
-            wb.save(excel_path)
-            
-            # 3. Copiar imágenes
-            images_dir = os.path.join(temp_dir, 'imagenes')
-            os.makedirs(images_dir, exist_ok=True)
-            
-            images_copied = 0
-            for gasto in gastos:
-                imagen_path = gasto[9]  # imagen_path es el índice 9
-                if imagen_path:
-                    # Construir ruta completa de la imagen
-                    imagen_full_path = os.path.join(UPLOAD_FOLDER, imagen_path)
-                    
-                    # Verificar que la imagen existe
-                    if os.path.exists(imagen_full_path):
-                        # Crear nombre único para la imagen
-                        base_name = os.path.basename(imagen_path)
-                        name, ext = os.path.splitext(base_name)
-                        new_name = f"{gasto[0]}_{name}{ext}"  # fecha_nombreoriginal.ext
-                        
-                        dest_path = os.path.join(images_dir, new_name)
-                        shutil.copy2(imagen_full_path, dest_path)
-                        images_copied += 1
-                        print(f"📷 Copiada imagen: {new_name}")
-                    else:
-                        print(f"⚠️ Imagen no encontrada: {imagen_full_path}")
-            
-            # 4. Crear ZIP final
-            zip_filename = f"gastos_completo_{fecha_inicio}_{fecha_fin}.zip"
-            zip_path = os.path.join(temp_dir, zip_filename)
-            
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Agregar PDF
-                zipf.write(pdf_path, pdf_filename)
-                
-                # Agregar Excel
-                zipf.write(excel_path, excel_filename)
-                
-                # Agregar imágenes
-                if images_copied > 0:
-                    for root, dirs, files in os.walk(images_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arc_name = os.path.join('imagenes', file)
-                            zipf.write(file_path, arc_name)
-            
-            # Leer ZIP para respuesta
-            with open(zip_path, 'rb') as f:
-                zip_data = f.read()
-            
-            # Crear respuesta
-            response = make_response(zip_data)
-            response.headers['Content-Type'] = 'application/zip'
-            response.headers['Content-Disposition'] = f'attachment; filename={zip_filename}'
-            
-            print(f"✅ ZIP completo generado: {len(gastos)} gastos, {images_copied} imágenes")
-            return response
-            
-        finally:
-            # Limpiar directorio temporal
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
-        
+        return export_response('zip')
+    except ExportEmptyError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         print(f"Error exportando ZIP completo: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Error generando ZIP completo'}), 500
 
+# Generadores de cada formato: (conn, filtros) -> (filename, mimetype, bytes o entradas de ZIP)
+EXPORT_BUILDERS = {
+    'pdf': build_pdf_export,
+    'excel': build_excel_export,
+    'images': build_images_export,
+    'zip': build_zip_export
+}
+
+# Trabajos de exportación en curso en este proceso, por clave de caché
+export_jobs_activos = {}
+export_jobs_lock = threading.Lock()
+
+def run_export_job(formato, filtros, cache_key):
+    """Generar una exportación y guardarla en la caché de ficheros"""
+    try:
+        with db_pool.connection() as conn:
+            filename, mimetype, contenido = EXPORT_BUILDERS[formato](conn, filtros)
+        export_jobs.report_progress(50)
+        artifact = export_artifacts.put(cache_key, formato, filename, mimetype, contenido, export_ambito(filtros))
+        return {'cache_key': cache_key, 'filename': artifact['filename'], 'size': artifact['size']}
+    finally:
+        with export_jobs_lock:
+            export_jobs_activos.pop(cache_key, None)
+
+def export_job_response(job):
+    """Respuesta JSON de un trabajo de exportación"""
+    payload = {
+        'job_id': job['id'],
+        'status': job['estado'],
+        'progress': job['progreso']
+    }
+    if job['estado'] == JOB_DONE:
+        resultado = job['resultado']
+        payload.update({
+            'success': True,
+            'filename': resultado['filename'],
+            'size': resultado['size'],
+            'download_url': url_for('download_export', cache_key=resultado['cache_key'])
+        })
+    elif job['estado'] == JOB_ERROR:
+        payload.update({'success': False, 'error': job['error'] or 'Error generando la exportación'})
+    return payload
+
+@app.route('/api/export/jobs', methods=['POST'])
+@login_required
+def create_export_job():
+    """Encolar una exportación (formato: pdf, excel, images o zip) con los mismos filtros que las rutas síncronas
+
+    Si ya existe el fichero para esos filtros y los datos no han cambiado se
+    devuelve directamente su download_url; si hay un trabajo igual en curso
+    se devuelve ese mismo job_id.
+    """
+    try:
+        data = request.get_json(silent=True) or request.form
+        formato = data.get('formato')
+        if formato not in EXPORT_BUILDERS:
+            return jsonify({'success': False, 'error': f'Formato no soportado: {formato}'}), 400
+        
+        filtros = export_filters(data)
+        if not filtros['fecha_inicio'] or not filtros['fecha_fin']:
+            return jsonify({'success': False, 'error': 'Fechas requeridas'}), 400
+        
+        cache_key = export_key(get_db(), formato, filtros)
+        artifact = export_artifacts.get(cache_key)
+        if artifact:
+            return jsonify({
+                'success': True,
+                'status': JOB_DONE,
+                'cached': True,
+                'filename': artifact['filename'],
+                'size': artifact['size'],
+                'download_url': url_for('download_export', cache_key=cache_key)
+            })
+        
+        with export_jobs_lock:
+            job_id = export_jobs_activos.get(cache_key)
+            job = export_jobs.get(job_id) if job_id else None
+            if not job or job['estado'] in (JOB_DONE, JOB_ERROR):
+                try:
+                    job_id = export_jobs.submit(run_export_job, formato, filtros, cache_key,
+                                                usuario=get_current_user())
+                except QueueFullError:
+                    response = jsonify({'success': False, 'error': 'Demasiadas exportaciones en curso, inténtalo en unos segundos'})
+                    response.headers['Retry-After'] = '10'
+                    return response, 503
+                export_jobs_activos[cache_key] = job_id
+        
+        return jsonify({'success': True, 'job_id': job_id, 'status': 'pendiente'}), 202
+        
+    except Exception as e:
+        print(f"Error encolando exportación: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/export/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_export_job(job_id):
+    """Estado, progreso y enlace de descarga de un trabajo de exportación"""
+    job = export_jobs.get(job_id)
+    if not job or job['tipo'] != export_jobs.nombre:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    
+    if job['usuario'] != get_current_user() and not is_admin():
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    
+    return jsonify(export_job_response(job))
+
+@app.route('/api/export/artifacts/<cache_key>', methods=['GET'])
+@login_required
+def download_export(cache_key):
+    """Descargar un fichero de exportación ya generado"""
+    artifact = export_artifacts.get(cache_key)
+    if not artifact:
+        return jsonify({'error': 'Exportación no encontrada o caducada'}), 404
+    
+    if artifact['ambito'] == 'admin' and not is_admin():
+        return jsonify({'error': 'No autorizado'}), 403
+    if artifact['ambito'] != 'admin' and artifact['ambito'] != get_current_user() and not is_admin():
+        return jsonify({'error': 'No autorizado'}), 403
+    
+    return artifact_response(artifact)
+
 if __name__ == '__main__':
-    init_db()
+    # Desarrollo: servidor de Werkzeug en un solo proceso
+    # (producción: gunicorn -c gunicorn.conf.py wsgi:app)
+    create_app()
     port = int(os.getenv('PORT', 5100))
-    app.run(debug=False, host='0.0.0.0', port=port) 
\ No newline at end of file
+    app.run(debug=False, host='0.0.0.0', port=port)
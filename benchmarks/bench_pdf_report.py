@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del reporte PDF de gastos (export_renderers.PdfRenderer)
+
+Compara el motor por páginas (tablas del tamaño de una página maquetadas
+según llegan los bloques) con la implementación anterior (una única tabla
+con todas las filas construida al final) para 10.000 y 100.000 filas.
+La versión anterior solo se mide hasta --legacy-max filas: su coste crece
+mucho más que linealmente.
+
+Uso:
+    python benchmarks/bench_pdf_report.py
+    python benchmarks/bench_pdf_report.py -n 10000 -n 100000 --legacy-max 100000
+    python benchmarks/bench_pdf_report.py -n 10000 --memoria
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib import colors  # noqa: E402
+from reportlab.lib.pagesizes import A4  # noqa: E402
+from reportlab.lib.styles import getSampleStyleSheet  # noqa: E402
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle  # noqa: E402
+
+from export_dataset import EXPORT_BATCH_SIZE, ExportBatch  # noqa: E402
+from export_renderers import PdfRenderer, format_fecha  # noqa: E402
+
+CONCEPTOS = ['Restaurante', 'Taxi', 'Hotel', 'Gasolina', 'Parking', 'Supermercado', 'Otros']
+VIAJES = ['Madrid 2024', 'Cliente Lisboa', 'Feria Milán', 'Oficina', None]
+
+
+def synthetic_rows(count, seed):
+    rng = random.Random(seed)
+    inicio = date(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        otra = rng.random() < 0.2
+        rows.append((
+            (inicio + timedelta(days=rng.randrange(365))).isoformat(),
+            rng.choice(CONCEPTOS),
+            rng.choice(VIAJES),
+            f'Ticket {i} ' + rng.choice(['comida equipo', 'desplazamiento aeropuerto', 'cena', '']),
+            round(rng.uniform(1, 300), 2),
+            round(rng.uniform(1, 300), 2) if otra else None,
+            'USD' if otra else None,
+            rng.random() < 0.5,
+            rng.choice(['ana', 'luis', 'marta']),
+            None
+        ))
+    return rows
+
+
+def legacy_pdf(filtros, rows):
+    """Implementación anterior, conservada solo como referencia del benchmark"""
+    data = [['Fecha', 'Concepto', 'Viaje', 'Descripción', 'Importe EUR', 'Otra Moneda', 'Moneda', 'Checkeado', 'Usuario']]
+    total_importe = 0.0
+    for (fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda,
+         moneda_otra, checkeado, usuario, _) in rows:
+        total_importe += importe_eur or 0
+        descripcion_text = descripcion or '-'
+        if len(descripcion_text) > 25:
+            descripcion_text = descripcion_text[:25] + '...'
+        data.append([format_fecha(fecha), concepto, motivo or '-', descripcion_text, f'{importe_eur or 0:.2f}',
+                     f'{importe_otra_moneda:.2f}' if importe_otra_moneda else '', moneda_otra or '',
+                     'Si' if checkeado else 'No', usuario])
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph("Reporte de Gastos", styles['Title']),
+        Paragraph(f"Total de tickets: {len(rows)}", styles['Normal']),
+        Paragraph(f"Importe total: EUR {total_importe:.2f}", styles['Normal']),
+        Spacer(1, 20)
+    ]
+    table = Table(data)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ]))
+    story.append(table)
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def paged_pdf(filtros, rows):
+    renderer = PdfRenderer(filtros)
+    for i in range(0, len(rows), EXPORT_BATCH_SIZE):
+        renderer.add_batch(ExportBatch(rows[i:i + EXPORT_BATCH_SIZE]))
+    return renderer.finish()[2]
+
+
+def measure(func, filtros, rows, memoria=False):
+    """Tiempo y tamaño del PDF; con memoria=True, además el pico de memoria
+    en una segunda pasada (tracemalloc ralentiza mucho la medida de tiempo)"""
+    inicio = time.perf_counter()
+    pdf = func(filtros, rows)
+    segundos = time.perf_counter() - inicio
+    pico = None
+    if memoria:
+        tracemalloc.start()
+        func(filtros, rows)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return segundos, pico, len(pdf)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--rows', type=int, action='append', help='Filas del reporte (repetible)')
+    parser.add_argument('--legacy-max', type=int, default=10000,
+                        help='Medir la versión anterior solo hasta este número de filas')
+    parser.add_argument('--memoria', action='store_true', help='Medir también el pico de memoria')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    filtros = {'fecha_inicio': '2024-01-01', 'fecha_fin': '2024-12-31', 'admin': True}
+    for count in args.rows or [10000, 100000]:
+        rows = synthetic_rows(count, args.seed)
+        print(f'{count} filas')
+        implementaciones = [('paginado', paged_pdf)]
+        if count <= args.legacy_max:
+            implementaciones.append(('anterior', legacy_pdf))
+        resultados = {}
+        for nombre, func in implementaciones:
+            segundos, pico, tamano = measure(func, filtros, rows, args.memoria)
+            resultados[nombre] = segundos
+            linea = f'{nombre:>10}: {segundos:7.2f} s  {count / segundos:8.0f} filas/s  PDF {tamano / 1024:7.0f} KB'
+            if pico is not None:
+                linea += f'  pico {pico / 1024 / 1024:6.1f} MB'
+            print(linea)
+        if len(resultados) == 2:
+            print(f'Aceleración: x{resultados["anterior"] / resultados["paginado"]:.1f}')
+
+
+if __name__ == '__main__':
+    main()
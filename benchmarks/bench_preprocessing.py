@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del preprocesado de tickets antes del OCR (receipt_preprocessing)
+
+Compara el preprocesado anterior (PIL: escala de grises + contraste x2 sobre
+la miniatura de 1200 px) con una receta de OpenCV: tiempo de preprocesado,
+tiempo de Tesseract y aciertos de importe, fecha y concepto tras
+parse_ticket_text.
+
+Por defecto genera tickets sintéticos (torcidos, sobre fondo oscuro, con
+iluminación desigual y ruido) cuyo contenido se conoce. También acepta un
+directorio de fotos reales con un .json al lado de cada imagen:
+    {"amount": 12.5, "date": "2024-03-01", "concept": "Restaurante"}
+
+Sin Tesseract instalado solo se mide el tiempo de preprocesado.
+
+Uso:
+    python benchmarks/bench_preprocessing.py
+    python benchmarks/bench_preprocessing.py -n 50 --receta grayscale,crop,deskew,dpi:300,threshold:41:12
+    python benchmarks/bench_preprocessing.py fotos_tickets/
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import OCR_CONFIG, OCR_LANGUAGES, OCR_PREPROCESS  # noqa: E402
+from receipt_preprocessing import ReceiptPreprocessor  # noqa: E402
+from ticket_parser import parse_ticket_text  # noqa: E402
+
+FONT_PATHS = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
+    '/usr/share/fonts/TTF/DejaVuSansMono.ttf',
+    '/Library/Fonts/Courier New.ttf',
+    'C:/Windows/Fonts/cour.ttf'
+]
+
+COMERCIOS = [
+    ('RESTAURANTE EL PUERTO', 'Restaurante'), ('HOTEL CENTRAL', 'Alojamiento'),
+    ('TAXI LICENCIA 1234', 'Transporte'), ('ESTACION SERVICIO REPSOL GASOLINA', 'Combustible'),
+    ('SUPERMERCADO DIA', 'Compras')
+]
+
+
+def load_font(size):
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size)
+
+
+def synthetic_ticket(rng):
+    """Foto simulada de un ticket y los campos que contiene"""
+    nombre, concepto = rng.choice(COMERCIOS)
+    dia, mes = rng.randint(1, 28), rng.randint(1, 12)
+    fecha = f'2024-{mes:02d}-{dia:02d}'
+    lineas = [(f'ARTICULO {i + 1}', round(rng.uniform(0.5, 40), 2)) for i in range(rng.randint(3, 9))]
+    total = round(sum(importe for _, importe in lineas), 2)
+
+    font = load_font(26)
+    papel = Image.new('L', (620, 220 + 36 * (len(lineas) + 8)), rng.randint(215, 245))
+    draw = ImageDraw.Draw(papel)
+    y = 30
+    textos = [nombre, 'C/ MAYOR 12 MADRID', f'FECHA: {dia:02d}/{mes:02d}/2024  12:{rng.randint(10, 59)}', '']
+    textos += [f'{articulo:<20}{importe:>8.2f}' for articulo, importe in lineas]
+    textos += ['', f'{"TOTAL EUR":<20}{total:>8.2f}', '', 'GRACIAS POR SU VISITA']
+    tinta = rng.randint(10, 70)
+    for texto in textos:
+        draw.text((30, y), texto.replace('.', ','), font=font, fill=tinta)
+        y += 36
+
+    # Torcido sobre una mesa, con sombra lateral y ruido de la cámara
+    angulo = rng.uniform(-8, 8)
+    mascara = Image.new('L', papel.size, 255).rotate(angulo, expand=True)
+    papel = papel.rotate(angulo, expand=True, resample=Image.BICUBIC)
+    fondo = Image.new('L', (papel.width + 300, papel.height + 300), rng.randint(40, 110))
+    fondo.paste(papel, (rng.randint(60, 240), rng.randint(60, 240)), mascara)
+    arr = np.asarray(fondo).astype(np.float32)
+    sombra = np.linspace(rng.uniform(0.55, 0.8), 1.0, arr.shape[1])[None, :]
+    arr = arr * sombra + np.random.default_rng(rng.randint(0, 10 ** 6)).normal(0, 6, arr.shape)
+    foto = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(0.8))
+    return foto.convert('RGB'), {'amount': total, 'date': fecha, 'concept': concepto}
+
+
+def load_corpus(path):
+    corpus = []
+    for imagen in sorted(glob.glob(os.path.join(path, '*'))):
+        etiqueta = os.path.splitext(imagen)[0] + '.json'
+        if imagen.endswith('.json') or not os.path.exists(etiqueta):
+            continue
+        with open(etiqueta, encoding='utf-8') as f:
+            corpus.append((Image.open(imagen).convert('RGB'), json.load(f)))
+    return corpus
+
+
+def thumbnail(image):
+    """Miniatura de 1200 px como la que genera process_image"""
+    image = image.copy()
+    image.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
+    return image
+
+
+def legacy_preprocess(image):
+    """Preprocesado anterior de process_image"""
+    return ImageEnhance.Contrast(image.convert('L')).enhance(2.0)
+
+
+def tesseract_available():
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def evaluate(nombre, preprocess, corpus, ocr):
+    import pytesseract
+    t_pre = t_ocr = 0.0
+    aciertos = {'amount': 0, 'date': 0, 'concept': 0}
+    for image, esperado in corpus:
+        inicio = time.perf_counter()
+        preparada = preprocess(image)
+        t_pre += time.perf_counter() - inicio
+        if not ocr:
+            continue
+        inicio = time.perf_counter()
+        texto = pytesseract.image_to_string(preparada, lang=OCR_LANGUAGES, config=OCR_CONFIG)
+        t_ocr += time.perf_counter() - inicio
+        info = parse_ticket_text(texto)
+        aciertos['amount'] += abs((info.get('amount') or 0) - esperado['amount']) < 0.005
+        aciertos['date'] += info.get('date') == esperado['date']
+        aciertos['concept'] += info.get('concept') == esperado['concept']
+
+    n = len(corpus)
+    linea = f'{nombre:>10}: preprocesado {t_pre / n * 1000:6.1f} ms/ticket'
+    if ocr:
+        linea += (f'  OCR {t_ocr / n * 1000:7.1f} ms/ticket  aciertos: importe {aciertos["amount"]}/{n}'
+                  f'  fecha {aciertos["date"]}/{n}  concepto {aciertos["concept"]}/{n}')
+    print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus_dir', nargs='?', help='Directorio con fotos de tickets y sus .json')
+    parser.add_argument('-n', '--count', type=int, default=20, help='Tickets sintéticos a generar')
+    parser.add_argument('--receta', default=OCR_PREPROCESS, help='Receta de OpenCV a comparar')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.corpus_dir:
+        corpus = load_corpus(args.corpus_dir)
+    else:
+        rng = random.Random(args.seed)
+        corpus = [synthetic_ticket(rng) for _ in range(args.count)]
+    corpus = [(thumbnail(image), esperado) for image, esperado in corpus]
+    print(f'Corpus: {len(corpus)} tickets')
+
+    ocr = tesseract_available()
+    if not ocr:
+        print('⚠️ Tesseract no está instalado: solo se mide el preprocesado')
+
+    preprocessor = ReceiptPreprocessor(args.receta)
+    evaluate('anterior', legacy_preprocess, corpus, ocr)
+    evaluate('opencv', lambda image: preprocessor.run(image)[0], corpus, ocr)
+    print(f'Receta: {args.receta}')
+    for paso, stats in preprocessor.stats()['pasos'].items():
+        print(f'  {paso:>10}: {stats["avg_ms"]} ms de media')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del cuadre automático de un viaje (reconciliation.solve)
+
+Genera un viaje con N detalles esperados y los tickets que los pagan:
+la mayoría uno a uno (algunos con céntimos de diferencia), otros pagados
+en varios tickets, tickets que cubren varios detalles y ruido sin pareja
+en ambos lados. Mide el tiempo, cuántos gastos se cuadran y cuántos
+cuadres (uno a uno y de varios elementos) coinciden con los reales.
+
+El caso "sin pareja" (importes aleatorios) mide los cuadres casuales: todo
+lo que se cuadra ahí es un error. Con cientos de importes libres casi
+cualquier cifra es suma de unos pocos, así que el buscador se abstiene
+(CUADRE_MAX_AZAR) en lugar de proponer grupos que serían casualidad.
+
+Uso:
+    python benchmarks/bench_reconciliation.py
+    python benchmarks/bench_reconciliation.py -n 500 -n 1000 -n 2000
+    python benchmarks/bench_reconciliation.py --max-grupo 3
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reconciliation  # noqa: E402
+from reconciliation import CUADRE_TOLERANCIA, CUADRE_TOLERANCIA_GRUPOS, match_amounts, solve  # noqa: E402
+
+
+def split_amount(rng, cents, partes):
+    cortes = sorted(rng.sample(range(1, cents), partes - 1))
+    return [b - a for a, b in zip([0] + cortes, cortes + [cents])]
+
+
+CONCEPTOS = ['Restaurante', 'Transporte', 'Alojamiento', 'Combustible', 'Compras', 'Otros']
+
+
+def synthetic_trip(rng, n):
+    """(gastos, detalles, verdad, conceptos) con gastos y detalles como listas de (id, importe_eur)
+
+    verdad son los cuadres correctos: pares (gastos, detalles) como frozensets
+    de ids; los tickets de un mismo pago comparten concepto.
+    """
+    detalles, gastos, verdad, conceptos = [], [], [], {}
+    pendientes_unir = []
+    for detalle_id in range(1, n + 1):
+        cents = rng.randint(300, 60000)
+        detalles.append((detalle_id, cents / 100))
+        tipo = rng.random()
+        if tipo < 0.70:
+            partes = [cents + (rng.randint(-3, 3) if rng.random() < 0.1 else 0)]
+        elif tipo < 0.80:
+            partes = split_amount(rng, cents, rng.randint(2, 4))
+        elif tipo < 0.90:
+            pendientes_unir.append((detalle_id, cents))
+            if len(pendientes_unir) < rng.randint(2, 3):
+                continue
+            partes = [sum(c for _, c in pendientes_unir)]
+        else:
+            continue  # detalle sin ticket
+        ids = [len(gastos) + i + 1 for i in range(len(partes))]
+        gastos.extend(zip(ids, (c / 100 for c in partes)))
+        concepto = rng.choice(CONCEPTOS)
+        conceptos.update((gasto_id, concepto) for gasto_id in ids)
+        cubiertos = [d for d, _ in pendientes_unir] if tipo >= 0.80 and tipo < 0.90 else [detalle_id]
+        verdad.append((frozenset(ids), frozenset(cubiertos)))
+        pendientes_unir = []
+    # Tickets sin detalle
+    for _ in range(n // 10):
+        gastos.append((len(gastos) + 1, rng.randint(300, 60000) / 100))
+        conceptos[len(gastos)] = rng.choice(CONCEPTOS)
+    rng.shuffle(gastos)
+    return gastos, detalles, set(verdad), conceptos
+
+
+def random_trip(rng, n):
+    return ([(i + 1, rng.randint(300, 60000) / 100) for i in range(n)],
+            [(i + 1, rng.randint(300, 60000) / 100) for i in range(n)], set(),
+            {i + 1: rng.choice(CONCEPTOS) for i in range(n)})
+
+
+def run(nombre, gastos, detalles, verdad, conceptos, max_grupo):
+    inicio = time.perf_counter()
+    uno_a_uno = match_amounts(gastos, detalles, CUADRE_TOLERANCIA)
+    t_uno = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    grupos = solve(gastos, detalles, CUADRE_TOLERANCIA, max_grupo, conceptos=conceptos)
+    t_total = time.perf_counter() - inicio
+
+    uno = [g for g in grupos if len(g['gastos']) == 1 and len(g['detalles']) == 1]
+    varios = [g for g in grupos if len(g['gastos']) > 1 or len(g['detalles']) > 1]
+    cuadrados = sum(len(g['gastos']) for g in grupos)
+    esperados_varios = sum(1 for g, d in verdad if len(g) > 1 or len(d) > 1)
+
+    def correctos(lista):
+        return sum(1 for g in lista if (frozenset(g['gastos']), frozenset(g['detalles'])) in verdad)
+
+    print(f'{nombre:>10}: {len(gastos):5d} gastos / {len(detalles):5d} detalles  '
+          f'uno a uno {t_uno * 1000:6.1f} ms  total {t_total * 1000:7.1f} ms  '
+          f'cuadrados {cuadrados}/{len(gastos)} gastos  '
+          f'1:1 correctos {correctos(uno)}/{len(uno)}  '
+          f'grupos correctos {correctos(varios)}/{len(varios)} (reales {esperados_varios})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--detalles', type=int, action='append',
+                        help='Detalles esperados del viaje (repetible; por defecto 100, 500 y 1000)')
+    parser.add_argument('--max-grupo', type=int, default=reconciliation.CUADRE_MAX_GRUPO)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f'Tolerancia {CUADRE_TOLERANCIA:.2f} EUR (grupos {CUADRE_TOLERANCIA_GRUPOS:.2f} EUR), '
+          f'hasta {args.max_grupo} elementos por grupo')
+    for n in args.detalles or [100, 500, 1000]:
+        rng = random.Random(args.seed)
+        run('realista', *synthetic_trip(rng, n), args.max_grupo)
+        run('sin pareja', *random_trip(rng, n), args.max_grupo)
+
+
+if __name__ == '__main__':
+    main()
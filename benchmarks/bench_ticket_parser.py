@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del parser de texto de tickets (ticket_parser.parse_ticket_text)
+
+Compara el rendimiento con la implementación anterior de extract_ticket_info
+(regex en cada llamada, strptime en bucles y búsqueda de palabras clave una
+a una) sobre un corpus de textos OCR.
+
+Uso:
+    python benchmarks/bench_ticket_parser.py              # corpus sintético
+    python benchmarks/bench_ticket_parser.py textos/      # ficheros .txt de OCR reales
+    python benchmarks/bench_ticket_parser.py -n 5000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ticket_parser import ESTABLISHMENT_KEYWORDS, parse_ticket_text  # noqa: E402
+
+
+def legacy_extract_ticket_info(text):
+    """Implementación anterior, conservada solo como referencia del benchmark"""
+    info = {}
+    if not text or len(text.strip()) < 5:
+        info['date'] = datetime.now().strftime('%Y-%m-%d')
+        info['concept'] = 'Otros'
+        return info
+
+    amount_patterns = [
+        r'total[:\s]*€?\s*(\d+[.,]\d{2})', r'importe[:\s]*€?\s*(\d+[.,]\d{2})',
+        r'suma[:\s]*€?\s*(\d+[.,]\d{2})', r'€\s*(\d+[.,]\d{2})', r'(\d+[.,]\d{2})\s*€',
+        r'(\d+[.,]\d{2})\s*eur', r'(\d+[.,]\d{2})\s*euros?', r'total[:\s]*(\d+[.,]\d{2})',
+        r'(\d{1,3}[.,]\d{2})',
+    ]
+    amounts_found = []
+    for pattern in amount_patterns:
+        for match in re.findall(pattern, text, re.IGNORECASE):
+            amount = float(match.replace(',', '.'))
+            if 0.01 <= amount <= 9999.99:
+                amounts_found.append(amount)
+    if amounts_found:
+        info['amount'] = max(amounts_found)
+
+    date_patterns = [
+        r'(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4})', r'(\d{1,2}\s+de\s+\w+\s+de\s+\d{4})',
+        r'(\d{1,2}\s+\w+\s+\d{4})', r'(\d{4}[/.-]\d{1,2}[/.-]\d{1,2})', r'(\d{2}[/.-]\d{2}[/.-]\d{4})'
+    ]
+    for pattern in date_patterns:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        if matches:
+            for fmt in ['%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d', '%Y-%m-%d']:
+                try:
+                    info['date'] = datetime.strptime(matches[0], fmt).strftime('%Y-%m-%d')
+                    break
+                except ValueError:
+                    continue
+            if 'date' in info:
+                break
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if 3 < len(line) < 50 and not re.match(r'^[\d\s/.-]+$', line):
+            info['description'] = line
+            break
+
+    text_lower = text.lower()
+    concept_scores = {}
+    for concept, keywords in ESTABLISHMENT_KEYWORDS.items():
+        score = sum(1 for keyword in keywords if keyword in text_lower)
+        if score > 0:
+            concept_scores[concept] = score
+    if concept_scores:
+        info['concept'] = max(concept_scores, key=concept_scores.get)
+    return info
+
+
+ESTABLECIMIENTOS = [
+    'MERCADONA S.A.', 'RESTAURANTE CASA PEPE', 'BAR LA ESQUINA', 'REPSOL E.S. 4021',
+    'HOTEL CENTRAL **', 'TAXI LICENCIA 1234', 'FARMACIA LDA. GARCIA', 'FNAC CALLAO',
+    'CAFETERIA EL SOL', 'PARKING PLAZA MAYOR', 'CARREFOUR EXPRESS', 'CINE IDEAL'
+]
+PRODUCTOS = ['PAN', 'AGUA 1.5L', 'CAFE SOLO', 'MENU DIA', 'GASOLINA 95', 'CERVEZA', 'TAPAS VARIAS',
+             'HABITACION DOBLE', 'IBUPROFENO', 'CABLE USB', 'ENTRADA', 'TICKET HORA']
+
+
+def synthetic_ticket(rng):
+    """Texto con el aspecto de la salida de Tesseract para un ticket"""
+    lineas = [rng.choice(ESTABLECIMIENTOS), f'C/ Mayor {rng.randint(1, 200)}, Madrid',
+              f'NIF B{rng.randint(10000000, 99999999)}']
+    fecha = datetime(2024, rng.randint(1, 12), rng.randint(1, 28))
+    formato = rng.choice(['%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%d.%m.%Y'])
+    lineas.append(f'{fecha.strftime(formato)} {rng.randint(8, 23):02d}:{rng.randint(0, 59):02d}')
+    total = 0.0
+    for _ in range(rng.randint(3, 40)):
+        unidades = rng.randint(1, 4)
+        precio = rng.randint(50, 3000) / 100
+        total += unidades * precio
+        lineas.append(f'{rng.choice(PRODUCTOS)}  {unidades} x {precio:.2f}  {unidades * precio:.2f}'.replace('.', ','))
+    lineas.append(f'BASE IMPONIBLE {total / 1.21:.2f}'.replace('.', ','))
+    lineas.append(f'IVA 21% {total - total / 1.21:.2f}'.replace('.', ','))
+    lineas.append(f'TOTAL {total:.2f} €'.replace('.', ','))
+    lineas.append('GRACIAS POR SU VISITA')
+    # Ruido típico del OCR
+    if rng.random() < 0.3:
+        lineas.insert(rng.randint(0, len(lineas)), ''.join(rng.choice('|!;:.,_-~') for _ in range(rng.randint(3, 12))))
+    return '\n'.join(lineas)
+
+
+def load_corpus(path, count, seed):
+    if path:
+        corpus = []
+        for nombre in sorted(os.listdir(path)):
+            if nombre.endswith('.txt'):
+                with open(os.path.join(path, nombre), encoding='utf-8', errors='replace') as f:
+                    corpus.append(f.read())
+        return corpus
+    rng = random.Random(seed)
+    return [synthetic_ticket(rng) for _ in range(count)]
+
+
+def measure(func, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            func(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus_dir', nargs='?', help='Directorio con textos OCR (.txt)')
+    parser.add_argument('-n', '--count', type=int, default=2000, help='Tickets sintéticos a generar')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Repeticiones (se toma la mejor)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus_dir, args.count, args.seed)
+    if not corpus:
+        sys.exit('Corpus vacío')
+    total_kb = sum(len(text) for text in corpus) / 1024
+    print(f'Corpus: {len(corpus)} textos, {total_kb:.0f} KB')
+
+    resultados = {}
+    for nombre, func in (('anterior', legacy_extract_ticket_info), ('compilado', parse_ticket_text)):
+        segundos = measure(func, corpus, args.repeat)
+        resultados[nombre] = segundos
+        print(f'{nombre:>10}: {len(corpus) / segundos:9.0f} tickets/s  '
+              f'{total_kb / segundos:8.0f} KB/s  {segundos / len(corpus) * 1e6:7.1f} µs/ticket')
+    print(f'Aceleración: x{resultados["anterior"] / resultados["compilado"]:.1f}')
+
+    # Diferencias de resultado campo a campo
+    diferencias = {}
+    for text in corpus:
+        antes, ahora = legacy_extract_ticket_info(text), parse_ticket_text(text)
+        for campo in ('amount', 'date', 'description', 'concept'):
+            if antes.get(campo) != ahora.get(campo):
+                diferencias[campo] = diferencias.get(campo, 0) + 1
+    print(f'Campos distintos respecto a la versión anterior: {diferencias or "ninguno"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -60,6 +60,8 @@ DEFAULT_CONCEPTS = [
 # Configuración de OCR
 OCR_LANGUAGES = 'spa+eng'  # Idiomas para Tesseract (español + inglés)
 OCR_CONFIG = '--psm 6'      # Configuración de Tesseract
+# Pasos de preprocesado antes del OCR (ver receipt_preprocessing.py); 'grayscale,contrast' es el preprocesado anterior
+OCR_PREPROCESS = 'grayscale,crop,deskew,dpi,threshold'
 
 # Patrones de reconocimiento para diferentes tipos de tickets
 ESTABLISHMENT_KEYWORDS = {
@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+"""
+Gestión de la base de datos SQLite del Gestor de Gastos
+Pool de conexiones reutilizables con WAL y migraciones versionadas del esquema
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+
+# PRAGMAs aplicados a cada conexión nueva
+# - WAL: los lectores no se bloquean mientras se inserta un ticket
+# - synchronous=NORMAL: seguro con WAL y mucho más rápido que FULL
+# - mmap_size / cache_size: lecturas del dashboard servidas desde memoria
+CONNECTION_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA mmap_size = 268435456',   # 256MB
+    'PRAGMA cache_size = -32000',     # ~32MB (valor negativo = KiB)
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',     # ms esperando a otro escritor
+]
+
+
+def configure_connection(conn):
+    """Aplicar los PRAGMAs de rendimiento a una conexión"""
+    cursor = conn.cursor()
+    for pragma in CONNECTION_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+    return conn
+
+
+class ConnectionPool:
+    """Pool de conexiones SQLite compartido entre hilos
+
+    Cada petición toma una conexión ya calentada (page cache, mmap) y la
+    devuelve al terminar. Una conexión solo la usa un hilo a la vez.
+    """
+
+    def __init__(self, database, max_idle=8, timeout=30.0):
+        self.database = database
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = LifoQueue(maxsize=max_idle)
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False)
+        configure_connection(conn)
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def acquire(self):
+        """Obtener una conexión del pool (o crear una nueva si no hay libres)"""
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def release(self, conn):
+        """Devolver una conexión al pool descartando cualquier transacción abierta"""
+        if conn is None:
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (Full, sqlite3.Error):
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Context manager para usar el pool fuera de una petición"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Cerrar todas las conexiones libres del pool"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+
+    def stats(self):
+        return {
+            'database': self.database,
+            'idle': self._idle.qsize(),
+            'created': self._created,
+            'max_idle': self.max_idle
+        }
+
+
+# ====================== MIGRACIONES DEL ESQUEMA ======================
+#
+# Cada migración se aplica una sola vez y queda registrada en schema_migrations.
+# Para cambiar el esquema se añade una nueva entrada al final de MIGRATIONS,
+# nunca se modifica una migración ya publicada.
+
+def _column_exists(cursor, table, column):
+    cursor.execute(f'PRAGMA table_info({table})')
+    return any(row[1] == column for row in cursor.fetchall())
+
+def _add_column(cursor, table, column, definition):
+    """ALTER TABLE idempotente (bases de datos anteriores al control de versiones)"""
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+    return False
+
+def _migration_tablas_base(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gastos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TEXT NOT NULL,
+            concepto TEXT NOT NULL,
+            motivo TEXT,
+            descripcion TEXT,
+            importe_eur REAL NOT NULL,
+            importe_otra_moneda REAL,
+            moneda_otra TEXT,
+            imagen_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conceptos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT UNIQUE NOT NULL,
+            activo BOOLEAN DEFAULT TRUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS motivos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT UNIQUE NOT NULL,
+            usado_veces INTEGER DEFAULT 0,
+            ultimo_uso TIMESTAMP,
+            activo BOOLEAN DEFAULT TRUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS viaje_detalles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            motivo TEXT NOT NULL,
+            importe_eur REAL NOT NULL,
+            importe_original REAL NOT NULL,
+            moneda_original TEXT NOT NULL DEFAULT 'EUR',
+            cuadrado BOOLEAN DEFAULT FALSE,
+            gasto_id INTEGER,
+            usuario TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (gasto_id) REFERENCES gastos (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            name TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'user',
+            parent_admin TEXT,
+            active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_gastos_checkeado(cursor):
+    _add_column(cursor, 'gastos', 'checkeado', 'BOOLEAN DEFAULT FALSE')
+
+def _migration_gastos_usuario(cursor):
+    _add_column(cursor, 'gastos', 'usuario', "TEXT DEFAULT 'paul'")
+
+def _migration_viaje_detalles_monedas(cursor):
+    _add_column(cursor, 'viaje_detalles', 'importe_original', 'REAL')
+    _add_column(cursor, 'viaje_detalles', 'moneda_original', "TEXT DEFAULT 'EUR'")
+    cursor.execute("UPDATE viaje_detalles SET importe_original = importe_eur, moneda_original = 'EUR' WHERE importe_original IS NULL")
+
+def _migration_gastos_detalle_cuadrado(cursor):
+    _add_column(cursor, 'gastos', 'detalle_cuadrado', 'BOOLEAN DEFAULT FALSE')
+
+def _migration_motivos_activo(cursor):
+    _add_column(cursor, 'motivos', 'activo', 'BOOLEAN DEFAULT TRUE')
+
+def _migration_indices(cursor):
+    # Listado de gastos por usuario (get_gastos, exportaciones de un usuario)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_gastos_usuario_fecha ON gastos (usuario, fecha DESC, created_at DESC)')
+    # Listado de admin sin filtro de usuario
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_gastos_fecha_created ON gastos (fecha DESC, created_at DESC)')
+    # Exportaciones por rango de fechas y viaje
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_gastos_fecha_motivo ON gastos (fecha, motivo)')
+    # Gastos de un viaje (borrado de motivos, cuadre)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_gastos_motivo_usuario ON gastos (motivo, usuario)')
+    # Cuadre automático: índice de cobertura para buscar_cuadre_automatico y el resumen
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_viaje_detalles_cuadre ON viaje_detalles (motivo, usuario, cuadrado, importe_eur)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_viaje_detalles_usuario ON viaje_detalles (usuario, motivo)')
+    # Descuadre al borrar/descuadrar un gasto (WHERE gasto_id = ?)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_viaje_detalles_gasto ON viaje_detalles (gasto_id)')
+
+def _migration_cambios(cursor):
+    # Registro de cambios para sincronización incremental (GET /api/gastos/changes).
+    # Una fila por registro: cada cambio borra la anterior y toma un seq nuevo,
+    # así el log no crece más que las propias tablas.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabla TEXT NOT NULL,
+            registro_id INTEGER NOT NULL,
+            operacion TEXT NOT NULL,
+            usuario TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_cambios_registro ON cambios (tabla, registro_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cambios_usuario_seq ON cambios (usuario, seq)')
+    
+    # Los triggers cubren todas las escrituras (rutas, cuadre, descuadre al borrar...)
+    for tabla in ('gastos', 'viaje_detalles'):
+        for evento, fila, operacion in (('INSERT', 'NEW', 'upsert'),
+                                        ('UPDATE', 'NEW', 'upsert'),
+                                        ('DELETE', 'OLD', 'delete')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_cambios_{tabla}_{evento.lower()}
+                AFTER {evento} ON {tabla}
+                BEGIN
+                    DELETE FROM cambios WHERE tabla = '{tabla}' AND registro_id = {fila}.id;
+                    INSERT INTO cambios (tabla, registro_id, operacion, usuario)
+                    VALUES ('{tabla}', {fila}.id, '{operacion}', {fila}.usuario);
+                END
+            ''')
+    
+    # Registros existentes: los clientes que sincronicen desde 0 los reciben como upserts
+    for tabla in ('gastos', 'viaje_detalles'):
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO cambios (tabla, registro_id, operacion, usuario)
+            SELECT '{tabla}', id, 'upsert', usuario FROM {tabla} ORDER BY id
+        ''')
+
+def _migration_tabla_versiones(cursor):
+    # Contador de versión por tabla, base de los ETag de los endpoints de listado
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tabla_versiones (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for tabla in VERSIONED_TABLES:
+        _version_triggers(cursor, tabla)
+
+def _version_triggers(cursor, tabla):
+    """Fila de la tabla en tabla_versiones y triggers que la incrementan en cada escritura"""
+    cursor.execute('INSERT OR IGNORE INTO tabla_versiones (tabla, version) VALUES (?, 1)', (tabla,))
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{evento.lower()}
+            AFTER {evento} ON {tabla}
+            BEGIN
+                UPDATE tabla_versiones SET version = version + 1 WHERE tabla = '{tabla}';
+            END
+        ''')
+
+def _migration_jobs(cursor):
+    # Trabajos en segundo plano (jobs.JobQueue); los tiempos son epoch en segundos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            progreso REAL DEFAULT 0,
+            resultado TEXT,
+            error TEXT,
+            usuario TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_tipo_estado ON jobs (tipo, estado, finished_at)')
+
+def _migration_extraction_cache(cursor):
+    # Caché de extracciones por hash del JPEG normalizado (extraction_cache.ExtractionCache)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS extraction_cache (
+            hash TEXT PRIMARY KEY,
+            texto TEXT,
+            extracted_info TEXT,
+            metodo TEXT,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache (last_used_at)')
+
+def _migration_export_artifacts(cursor):
+    # Ficheros de exportación ya generados, por (formato, filtros, versión de datos)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_artifacts (
+            cache_key TEXT PRIMARY KEY,
+            formato TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            mimetype TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            ambito TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_export_artifacts_last_used ON export_artifacts (last_used_at)')
+
+def _migration_cuadre_enlaces(cursor):
+    # Un cuadre puede unir varios gastos con un detalle (hotel pagado en varios
+    # tickets) o un gasto con varios detalles; viaje_detalles.gasto_id solo
+    # admitía uno y deja de usarse (se conserva la columna, ya vacía)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cuadre_enlaces (
+            gasto_id INTEGER NOT NULL,
+            detalle_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (gasto_id, detalle_id),
+            FOREIGN KEY (gasto_id) REFERENCES gastos (id),
+            FOREIGN KEY (detalle_id) REFERENCES viaje_detalles (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cuadre_enlaces_detalle ON cuadre_enlaces (detalle_id)')
+    cursor.execute('''
+        INSERT OR IGNORE INTO cuadre_enlaces (gasto_id, detalle_id)
+        SELECT gasto_id, id FROM viaje_detalles WHERE gasto_id IS NOT NULL AND cuadrado
+    ''')
+    cursor.execute('UPDATE viaje_detalles SET gasto_id = NULL WHERE gasto_id IS NOT NULL')
+
+# Aportación de una fila de viaje_detalles al resumen de su viaje ({fila} es NEW u OLD)
+_TRIP_SUMMARY_DELTA = '''
+    total_detalles = total_detalles {signo} 1,
+    pendientes = pendientes {signo} (CASE WHEN {fila}.cuadrado = 0 THEN 1 ELSE 0 END),
+    total_cents = total_cents {signo} CAST(ROUND({fila}.importe_eur * 100) AS INTEGER),
+    pendiente_cents = pendiente_cents {signo}
+        (CASE WHEN {fila}.cuadrado = 0 THEN CAST(ROUND({fila}.importe_eur * 100) AS INTEGER) ELSE 0 END)
+'''
+
+def _migration_trip_summary(cursor):
+    # Resumen materializado por viaje y usuario (GET /api/viajes/resumen).
+    # Importes en céntimos enteros: sumar y restar en REAL dejaría residuos
+    # (0.0000001 pendiente) tras muchos cuadres y descuadres.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trip_summary (
+            usuario TEXT NOT NULL,
+            motivo TEXT NOT NULL,
+            total_detalles INTEGER NOT NULL DEFAULT 0,
+            pendientes INTEGER NOT NULL DEFAULT 0,
+            total_cents INTEGER NOT NULL DEFAULT 0,
+            pendiente_cents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (usuario, motivo)
+        )
+    ''')
+
+    # Igual que cambios: los triggers cubren todas las escrituras (alta y borrado de
+    # detalles, cuadre manual y automático, descuadre al borrar un gasto...) dentro
+    # de la misma transacción
+    sumar = _TRIP_SUMMARY_DELTA.format(signo='+', fila='NEW')
+    restar = _TRIP_SUMMARY_DELTA.format(signo='-', fila='OLD')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_trip_summary_insert
+        AFTER INSERT ON viaje_detalles
+        BEGIN
+            INSERT OR IGNORE INTO trip_summary (usuario, motivo) VALUES (NEW.usuario, NEW.motivo);
+            UPDATE trip_summary SET {sumar} WHERE usuario = NEW.usuario AND motivo = NEW.motivo;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_trip_summary_delete
+        AFTER DELETE ON viaje_detalles
+        BEGIN
+            UPDATE trip_summary SET {restar} WHERE usuario = OLD.usuario AND motivo = OLD.motivo;
+            DELETE FROM trip_summary WHERE usuario = OLD.usuario AND motivo = OLD.motivo AND total_detalles <= 0;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_trip_summary_update
+        AFTER UPDATE OF usuario, motivo, importe_eur, cuadrado ON viaje_detalles
+        BEGIN
+            UPDATE trip_summary SET {restar} WHERE usuario = OLD.usuario AND motivo = OLD.motivo;
+            INSERT OR IGNORE INTO trip_summary (usuario, motivo) VALUES (NEW.usuario, NEW.motivo);
+            UPDATE trip_summary SET {sumar} WHERE usuario = NEW.usuario AND motivo = NEW.motivo;
+            DELETE FROM trip_summary WHERE usuario = OLD.usuario AND motivo = OLD.motivo AND total_detalles <= 0;
+        END
+    ''')
+
+    cursor.execute('DELETE FROM trip_summary')
+    cursor.execute('''
+        INSERT INTO trip_summary (usuario, motivo, total_detalles, pendientes, total_cents, pendiente_cents)
+        SELECT usuario, motivo, COUNT(*),
+               SUM(CASE WHEN cuadrado = 0 THEN 1 ELSE 0 END),
+               SUM(CAST(ROUND(importe_eur * 100) AS INTEGER)),
+               SUM(CASE WHEN cuadrado = 0 THEN CAST(ROUND(importe_eur * 100) AS INTEGER) ELSE 0 END)
+        FROM viaje_detalles
+        GROUP BY usuario, motivo
+    ''')
+
+def _migration_tipos_cambio(cursor):
+    # Tipos de cambio históricos (exchange_rates.ExchangeRates): unidades de la
+    # moneda por 1 EUR publicadas en cada fecha, como en los ficheros del BCE
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tipos_cambio (
+            moneda TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            tasa REAL NOT NULL,
+            fuente TEXT,
+            PRIMARY KEY (moneda, fecha)
+        )
+    ''')
+    # Cada proceso recarga su índice en memoria cuando cambia la versión
+    _version_triggers(cursor, 'tipos_cambio')
+
+def _migration_indices_orden_gastos(cursor):
+    # get_gastos ordena y pagina por (fecha, COALESCE(created_at, ''), id): los
+    # gastos antiguos sin created_at también entran en el cursor. Índices con la
+    # misma expresión para que SQLite siga sin ordenar en memoria.
+    cursor.execute('DROP INDEX IF EXISTS idx_gastos_usuario_fecha')
+    cursor.execute('DROP INDEX IF EXISTS idx_gastos_fecha_created')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_usuario_orden ON gastos (usuario, fecha DESC, COALESCE(created_at, '') DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_orden ON gastos (fecha DESC, COALESCE(created_at, '') DESC, id DESC)")
+
+# Tablas con contador de versión en tabla_versiones
+VERSIONED_TABLES = ('gastos', 'viaje_detalles', 'conceptos', 'motivos')
+
+# (versión, descripción, función) - en orden estricto
+MIGRATIONS = [
+    (1, 'Tablas base', _migration_tablas_base),
+    (2, "Campo 'checkeado' en gastos", _migration_gastos_checkeado),
+    (3, "Campo 'usuario' en gastos", _migration_gastos_usuario),
+    (4, 'Campos de moneda en viaje_detalles', _migration_viaje_detalles_monedas),
+    (5, "Campo 'detalle_cuadrado' en gastos", _migration_gastos_detalle_cuadrado),
+    (6, "Campo 'activo' en motivos", _migration_motivos_activo),
+    (7, 'Índices secundarios de gastos y viaje_detalles', _migration_indices),
+    (8, 'Registro de cambios (cambios) para sincronización incremental', _migration_cambios),
+    (9, 'Contadores de versión por tabla (ETag)', _migration_tabla_versiones),
+    (10, 'Tabla de trabajos en segundo plano', _migration_jobs),
+    (11, 'Caché de extracciones por hash de imagen', _migration_extraction_cache),
+    (12, 'Caché de ficheros de exportación', _migration_export_artifacts),
+    (13, 'Enlaces de cuadre gasto-detalle (varios a uno y divididos)', _migration_cuadre_enlaces),
+    (14, 'Resumen materializado de viajes (trip_summary)', _migration_trip_summary),
+    (15, 'Tipos de cambio históricos por fecha', _migration_tipos_cambio),
+    (16, 'Índices de orden de gastos con created_at nulo', _migration_indices_orden_gastos),
+]
+
+def get_schema_version(conn):
+    """Versión actual del esquema (0 si nunca se ha migrado)"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cursor.fetchone()[0]
+
+def get_table_versions(conn, tablas):
+    """Versión actual de cada tabla indicada, en el mismo orden"""
+    placeholders = ','.join('?' * len(tablas))
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT tabla, version FROM tabla_versiones WHERE tabla IN ({placeholders})', tablas)
+    versiones = dict(cursor.fetchall())
+    return [versiones.get(tabla, 0) for tabla in tablas]
+
+def run_migrations(conn, migrations=None):
+    """Aplicar en orden las migraciones pendientes, cada una en su propia transacción"""
+    migrations = MIGRATIONS if migrations is None else migrations
+    current = get_schema_version(conn)
+    conn.commit()
+
+    applied = []
+    for version, descripcion, migration in migrations:
+        if version <= current:
+            continue
+        cursor = conn.cursor()
+        try:
+            # IMMEDIATE y nueva comprobación: si varios procesos arrancan a la vez
+            # (workers sin preload), solo uno aplica cada migración
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,))
+            if cursor.fetchone():
+                conn.rollback()
+                continue
+            migration(cursor)
+            cursor.execute('INSERT INTO schema_migrations (version, descripcion) VALUES (?, ?)',
+                           (version, descripcion))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+        print(f"✅ Migración {version}: {descripcion}")
+
+    if applied:
+        conn.execute('PRAGMA optimize')
+    return applied
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Tipos de cambio históricos (EUR como base)
+Tabla tipos_cambio: unidades de cada moneda por 1 EUR en cada fecha, como los
+publica el BCE. En memoria, por moneda, un array ordenado de días para buscar
+el tipo vigente en una fecha (el último publicado en o antes de ella) y
+convertir miles de importes de una vez con NumPy
+"""
+
+import csv
+import io
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from database import get_table_versions
+from metrics import LatencyRecorder
+
+# Formatos de fecha aceptados en los ficheros (el diario del BCE usa "17 October 2025")
+CSV_DATE_FORMATS = ('%Y-%m-%d', '%d %B %Y', '%d/%m/%Y')
+
+# Cabeceras del formato largo (una fila por moneda y fecha)
+_LONG_COLUMNS = {
+    'moneda': ('moneda', 'currency'),
+    'fecha': ('fecha', 'date', 'time_period'),
+    'tasa': ('tasa', 'rate', 'obs_value'),
+}
+
+# Segundos entre comprobaciones de la versión de tipos_cambio (cambios de otros procesos)
+RELOAD_CHECK_SECONDS = 5.0
+
+
+def parse_date(valor):
+    """Texto de fecha de un fichero de tipos -> date (ValueError si no se reconoce)"""
+    valor = valor.strip()
+    for formato in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Fecha no reconocida: {valor}')
+
+
+def parse_rates_csv(texto):
+    """Filas (moneda, fecha ISO, tasa) de un CSV de tipos de cambio
+
+    Acepta el formato ancho del BCE (eurofxref.csv / eurofxref-hist.csv:
+    columna Date y una columna por moneda, N/A si no hay dato) y el formato
+    largo con columnas moneda/currency, fecha/date y tasa/rate.
+    """
+    lector = csv.reader(io.StringIO(texto))
+    cabecera = [columna.strip() for columna in next(lector, [])]
+    normalizada = [columna.lower() for columna in cabecera]
+    filas = []
+
+    posiciones = {}
+    for campo, nombres in _LONG_COLUMNS.items():
+        posiciones[campo] = next((normalizada.index(nombre) for nombre in nombres if nombre in normalizada), None)
+
+    if None not in posiciones.values():
+        for fila in lector:
+            if not fila or not any(celda.strip() for celda in fila):
+                continue
+            tasa = _parse_rate(fila[posiciones['tasa']])
+            if tasa:
+                filas.append((fila[posiciones['moneda']].strip().upper(),
+                              parse_date(fila[posiciones['fecha']]).isoformat(), tasa))
+        return filas
+
+    if not normalizada or normalizada[0] != 'date':
+        raise ValueError('Formato de CSV no reconocido: se espera Date,<monedas>... o moneda,fecha,tasa')
+    monedas = cabecera[1:]
+    for fila in lector:
+        if not fila or not fila[0].strip():
+            continue
+        fecha = parse_date(fila[0]).isoformat()
+        for moneda, celda in zip(monedas, fila[1:]):
+            tasa = _parse_rate(celda)
+            if moneda and tasa:
+                filas.append((moneda.upper(), fecha, tasa))
+    return filas
+
+
+def _parse_rate(celda):
+    try:
+        tasa = float(celda)
+    except (TypeError, ValueError):
+        return None  # N/A, celdas vacías
+    return tasa if tasa > 0 else None
+
+
+def _to_days(fechas, n):
+    """Fechas (texto ISO, date o None = hoy) -> array int64 de días desde 1970-01-01"""
+    hoy = np.datetime64(date.today(), 'D')
+    if fechas is None:
+        return np.full(n, hoy.astype(np.int64))
+    valores = [str(fecha)[:10] if fecha else None for fecha in fechas]
+    try:
+        dias = np.array(valores, dtype='datetime64[D]')
+    except ValueError:
+        # Alguna fecha no válida: se convierten una a una y esas usan el tipo de hoy
+        dias = np.array([_safe_day(valor) for valor in valores], dtype='datetime64[D]')
+    dias[np.isnat(dias)] = hoy
+    return dias.astype(np.int64)
+
+
+def _safe_day(valor):
+    try:
+        return np.datetime64(valor, 'D') if valor else np.datetime64('NaT')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+class ExchangeRates:
+    """Tipos de cambio por fecha, cargados de tipos_cambio en arrays ordenados
+
+    Para una moneda con histórico se usa el último tipo publicado en o antes
+    de la fecha (el más antiguo si la fecha es anterior a todo el histórico);
+    sin histórico, el tipo fijo de config.EXCHANGE_RATES; una moneda que no
+    está en ninguno de los dos se toma 1:1 como hasta ahora.
+    """
+
+    def __init__(self, pool, fijos=None):
+        self.pool = pool
+        self.fijos = dict(fijos or {})
+        self._lock = threading.Lock()
+        self._historico = {}   # moneda -> (días int64 ordenados, tasas float64)
+        self._version = None
+        self._last_check = 0.0
+        self.metrics = LatencyRecorder()
+
+    # ------------------------------------------------------------ carga
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._last_check < RELOAD_CHECK_SECONDS:
+                return
+            self._last_check = now
+        with self.pool.connection() as conn:
+            version = get_table_versions(conn, ['tipos_cambio'])[0]
+            if version == self._version:
+                return
+            cursor = conn.cursor()
+            cursor.execute('SELECT moneda, fecha, tasa FROM tipos_cambio ORDER BY moneda, fecha')
+            filas = cursor.fetchall()
+
+        historico = {}
+        if filas:
+            monedas = np.array([fila[0] for fila in filas])
+            dias = np.array([fila[1] for fila in filas], dtype='datetime64[D]').astype(np.int64)
+            tasas = np.array([fila[2] for fila in filas], dtype=np.float64)
+            # Las filas ya vienen ordenadas por moneda y fecha: un tramo por moneda
+            cortes = np.flatnonzero(monedas[1:] != monedas[:-1]) + 1
+            for inicio, fin in zip(np.r_[0, cortes], np.r_[cortes, len(filas)]):
+                historico[str(monedas[inicio])] = (dias[inicio:fin], tasas[inicio:fin])
+        with self._lock:
+            self._historico = historico
+            self._version = version
+        print(f"💱 Tipos de cambio cargados: {len(filas)} tipos de {len(historico)} monedas")
+
+    def invalidate(self):
+        """Forzar la recarga en la próxima consulta"""
+        with self._lock:
+            self._version = None
+
+    def import_rows(self, filas, fuente=None):
+        """Guardar filas (moneda, fecha ISO, tasa); las de la misma moneda y fecha se sustituyen"""
+        with self.pool.connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO tipos_cambio (moneda, fecha, tasa, fuente)
+                VALUES (?, ?, ?, ?)
+            ''', [(moneda, fecha, tasa, fuente) for moneda, fecha, tasa in filas])
+            conn.commit()
+        self.invalidate()
+        return len(filas)
+
+    def import_csv(self, texto, fuente='csv'):
+        """Importar un CSV (formato del BCE o largo); devuelve el número de tipos guardados"""
+        return self.import_rows(parse_rates_csv(texto), fuente)
+
+    # ------------------------------------------------------------ consulta
+
+    def rates(self, monedas, fechas=None):
+        """Array de tasas (unidades por 1 EUR) para cada par moneda/fecha"""
+        self._maybe_reload()
+        with self._lock:
+            historico = self._historico
+
+        monedas = np.asarray([(moneda or 'EUR').upper() for moneda in monedas], dtype=object)
+        tasas = np.ones(len(monedas), dtype=np.float64)
+        if not len(monedas):
+            return tasas
+        dias = _to_days(fechas, len(monedas))
+
+        for moneda in set(monedas.tolist()):
+            if moneda == 'EUR':
+                continue
+            mascara = monedas == moneda
+            if moneda in historico:
+                dias_moneda, tasas_moneda = historico[moneda]
+                posiciones = np.searchsorted(dias_moneda, dias[mascara], side='right') - 1
+                anteriores = int(np.count_nonzero(posiciones < 0))
+                if anteriores:
+                    self.metrics.incr('anteriores_al_historico', anteriores)
+                tasas[mascara] = tasas_moneda[np.maximum(posiciones, 0)]
+            elif moneda in self.fijos:
+                self.metrics.incr('tipo_fijo', int(np.count_nonzero(mascara)))
+                tasas[mascara] = self.fijos[moneda]
+            else:
+                self.metrics.incr('moneda_desconocida', int(np.count_nonzero(mascara)))
+        return tasas
+
+    def to_eur_bulk(self, importes, monedas, fechas=None):
+        """Importes en EUR (redondeados al céntimo) de una vez para arrays de importes, monedas y fechas"""
+        inicio = time.perf_counter()
+        importes = np.asarray(importes, dtype=np.float64)
+        resultado = np.round(importes / self.rates(monedas, fechas), 2)
+        self.metrics.record(time.perf_counter() - inicio)
+        self.metrics.incr('importes', len(importes))
+        return resultado
+
+    def to_eur(self, importe, moneda, fecha=None):
+        """Un importe en EUR al tipo vigente en fecha (hoy si no se indica)"""
+        if not importe:
+            return 0
+        return float(self.to_eur_bulk([importe], [moneda], None if fecha is None else [fecha])[0])
+
+    def convert(self, importe, origen, destino, fecha=None):
+        """Importe de una moneda a otra pasando por EUR, con los tipos vigentes en fecha"""
+        fechas = None if fecha is None else [fecha, fecha]
+        tasa_origen, tasa_destino = self.rates([origen, destino], fechas)
+        self.metrics.incr('conversiones')
+        return float(importe) / tasa_origen * tasa_destino
+
+    def rate_info(self, moneda, fecha=None):
+        """{'tasa', 'fecha'} del tipo que se aplicaría (fecha None si es un tipo fijo)"""
+        moneda = (moneda or 'EUR').upper()
+        tasa = float(self.rates([moneda], None if fecha is None else [fecha])[0])
+        with self._lock:
+            serie = self._historico.get(moneda)
+        if serie is None:
+            return {'tasa': tasa, 'fecha': None}
+        dia = _to_days(None if fecha is None else [fecha], 1)[0]
+        posicion = max(int(np.searchsorted(serie[0], dia, side='right')) - 1, 0)
+        return {'tasa': tasa, 'fecha': str(np.datetime64(int(serie[0][posicion]), 'D'))}
+
+    # ------------------------------------------------------------ métricas
+
+    def summary(self):
+        """Por moneda: número de tipos, primera y última fecha y último tipo"""
+        self._maybe_reload()
+        with self._lock:
+            historico = self._historico
+        monedas = {}
+        for moneda, (dias, tasas) in sorted(historico.items()):
+            monedas[moneda] = {
+                'tipos': len(dias),
+                'desde': str(np.datetime64(int(dias[0]), 'D')),
+                'hasta': str(np.datetime64(int(dias[-1]), 'D')),
+                'ultimo': float(tasas[-1])
+            }
+        return {
+            'historico': monedas,
+            'fijos': {moneda: tasa for moneda, tasa in sorted(self.fijos.items()) if moneda not in historico}
+        }
+
+    def stats(self):
+        with self._lock:
+            cargadas = len(self._historico)
+        return dict(self.metrics.snapshot(), monedas_con_historico=cargadas)
+
+
+def recompute_eur_amounts(conn, rates, desde=None, hasta=None, dry_run=False, progress=None):
+    """Recalcular importe_eur de gastos y detalles en otra moneda con el tipo de su fecha
+
+    Gastos: importe_otra_moneda / moneda_otra a la fecha del gasto. Detalles
+    de viaje: importe_original / moneda_original a su fecha de alta. Los ya
+    cuadrados no se tocan (cambiar su importe desharía el cuadre a la vista
+    del usuario). Sobrescribe el importe en EUR aunque se hubiera escrito a
+    mano; con dry_run solo cuenta lo que cambiaría.
+
+    Los importes se calculan fuera de la transacción de escritura; al guardar,
+    una fila que alguien haya editado o cuadrado mientras tanto se deja como está
+    (IS y no =, para que las filas con importe_eur NULL también se actualicen).
+    """
+    consultas = {
+        'gastos': ('''
+            SELECT id, fecha, importe_otra_moneda, moneda_otra, importe_eur
+            FROM gastos
+            WHERE moneda_otra IS NOT NULL AND moneda_otra != 'EUR' AND importe_otra_moneda > 0
+              AND COALESCE(detalle_cuadrado, 0) = 0
+        ''', 'fecha', '''
+            UPDATE gastos SET importe_eur = ?
+            WHERE id = ? AND importe_eur IS ? AND COALESCE(detalle_cuadrado, 0) = 0
+        '''),
+        'detalles': ('''
+            SELECT id, DATE(created_at), importe_original, moneda_original, importe_eur
+            FROM viaje_detalles
+            WHERE moneda_original != 'EUR' AND importe_original > 0
+              AND COALESCE(cuadrado, 0) = 0
+        ''', 'DATE(created_at)', '''
+            UPDATE viaje_detalles SET importe_eur = ?
+            WHERE id = ? AND importe_eur IS ? AND COALESCE(cuadrado, 0) = 0
+        '''),
+    }
+
+    cursor = conn.cursor()
+    resultado = {'dry_run': dry_run}
+    pendientes = []
+    for paso, (tabla, (query, columna_fecha, update)) in enumerate(consultas.items()):
+        params = []
+        if desde:
+            query += f' AND {columna_fecha} >= ?'
+            params.append(desde)
+        if hasta:
+            query += f' AND {columna_fecha} <= ?'
+            params.append(hasta)
+        cursor.execute(query, params)
+        filas = cursor.fetchall()
+
+        cambios, diferencia = [], 0.0
+        if filas:
+            ids, fechas, importes, monedas, actuales = zip(*filas)
+            nuevos = rates.to_eur_bulk(importes, monedas, fechas)
+            previos = np.array([actual or 0 for actual in actuales], dtype=np.float64)
+            cambiados = np.flatnonzero(np.abs(nuevos - previos) >= 0.005)
+            diferencia = float(np.sum(nuevos[cambiados] - previos[cambiados]))
+            cambios = [(float(nuevos[i]), ids[i], actuales[i]) for i in cambiados]
+        pendientes.append((tabla, update, cambios))
+
+        resultado[tabla] = {'revisados': len(filas), 'cambiados': len(cambios),
+                            'diferencia_eur': round(diferencia, 2)}
+        if progress:
+            progress(round(100 * (paso + 1) / (len(consultas) + 1)))
+    conn.commit()
+
+    if dry_run:
+        return resultado
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        for tabla, update, cambios in pendientes:
+            guardados = 0
+            for cambio in cambios:
+                cursor.execute(update, cambio)
+                guardados += cursor.rowcount
+            resultado[tabla]['cambiados'] = guardados
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return resultado
+
+
+if __name__ == '__main__':
+    # Carga de un fichero local: python exchange_rates.py eurofxref-hist.csv [gastos.db]
+    import sys
+
+    from database import ConnectionPool, run_migrations
+
+    if len(sys.argv) < 2:
+        print('Uso: python exchange_rates.py <fichero.csv> [base_de_datos]')
+        sys.exit(1)
+    pool = ConnectionPool(sys.argv[2] if len(sys.argv) > 2 else 'gastos.db')
+    with pool.connection() as conn:
+        run_migrations(conn)
+    with open(sys.argv[1], encoding='utf-8-sig') as fichero:
+        guardados = ExchangeRates(pool).import_csv(fichero.read(), fuente=sys.argv[1])
+    print(f"✅ {guardados} tipos de cambio importados de {sys.argv[1]}")
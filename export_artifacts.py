@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de ficheros de exportación (PDF, Excel, ZIP)
+Clave: formato + filtros + ámbito + versión de la tabla gastos, de modo que
+repetir una exportación de un periodo sin cambios se sirve del disco
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from zip_stream import stream_zip
+
+
+def export_cache_key(formato, filtros, ambito, data_version):
+    """Clave estable de un fichero de exportación"""
+    payload = json.dumps({
+        'formato': formato,
+        'filtros': filtros,
+        'ambito': ambito,
+        'version': data_version
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ExportArtifactStore:
+    """Ficheros generados en folder e indexados en la tabla export_artifacts
+
+    Expulsión por antigüedad (ttl_seconds) y LRU por número de ficheros y
+    tamaño total (max_entries, max_bytes).
+    """
+
+    def __init__(self, pool, folder, max_entries=50, max_bytes=2 * 1024 ** 3, ttl_seconds=24 * 3600):
+        self.pool = pool
+        self.folder = folder
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def get(self, key):
+        """Datos del fichero (dict) o None si no existe, caducó o falta en disco"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT cache_key, formato, filename, mimetype, path, size, ambito, created_at
+                FROM export_artifacts WHERE cache_key = ?
+            ''', (key,))
+            row = cursor.fetchone()
+            if not row or now - row[7] > self.ttl_seconds or not os.path.exists(row[4]):
+                with self._lock:
+                    self.misses += 1
+                return None
+            cursor.execute('UPDATE export_artifacts SET last_used_at = ?, hits = hits + 1 WHERE cache_key = ?',
+                           (now, key))
+            conn.commit()
+        with self._lock:
+            self.hits += 1
+        return {
+            'cache_key': row[0],
+            'formato': row[1],
+            'filename': row[2],
+            'mimetype': row[3],
+            'path': row[4],
+            'size': row[5],
+            'ambito': row[6],
+            'created_at': row[7]
+        }
+
+    def put(self, key, formato, filename, mimetype, contenido, ambito):
+        """Guardar un fichero generado; contenido son bytes o entradas de stream_zip"""
+        path = os.path.join(self.folder, f'{key}{os.path.splitext(filename)[1]}')
+        tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                if isinstance(contenido, (bytes, bytearray)):
+                    f.write(contenido)
+                else:
+                    for chunk in stream_zip(contenido):
+                        f.write(chunk)
+            # Escritura atómica: nadie ve un fichero a medio escribir
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        artifact = {
+            'cache_key': key,
+            'formato': formato,
+            'filename': filename,
+            'mimetype': mimetype,
+            'path': path,
+            'size': os.path.getsize(path),
+            'ambito': ambito,
+            'created_at': time.time()
+        }
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO export_artifacts
+                    (cache_key, formato, filename, mimetype, path, size, ambito, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ''', (key, formato, filename, mimetype, path, artifact['size'], ambito,
+                  artifact['created_at'], artifact['created_at']))
+            conn.commit()
+        self._maybe_evict()
+        return artifact
+
+    def evict(self):
+        """Aplicar TTL y límites de número/tamaño; devuelve el número de ficheros borrados"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT cache_key, path, size, created_at FROM export_artifacts ORDER BY last_used_at DESC')
+            rows = cursor.fetchall()
+
+            conservados = 0
+            total_bytes = 0
+            borrar = []
+            for key, path, size, created_at in rows:
+                if (now - created_at > self.ttl_seconds or conservados >= self.max_entries
+                        or total_bytes + size > self.max_bytes):
+                    borrar.append((key, path))
+                else:
+                    conservados += 1
+                    total_bytes += size
+
+            for key, path in borrar:
+                cursor.execute('DELETE FROM export_artifacts WHERE cache_key = ?', (key,))
+            conn.commit()
+
+        for key, path in borrar:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        return len(borrar)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def _maybe_evict(self):
+        # Como mucho una pasada de expulsión por minuto
+        now = time.time()
+        with self._lock:
+            if now - self._last_eviction < 60:
+                return
+            self._last_eviction = now
+        self.evict()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Conjunto de datos de las exportaciones (PDF, Excel, imágenes y ZIP)
+Una sola consulta filtrada que se lee por bloques y se reparte, en formato
+columnar, a todos los renderizadores de la exportación
+"""
+
+from abc import ABC, abstractmethod
+
+# Columnas de la consulta de exportación, en orden
+EXPORT_COLUMNS = (
+    'fecha', 'concepto', 'motivo', 'descripcion', 'importe_eur',
+    'importe_otra_moneda', 'moneda_otra', 'checkeado', 'usuario', 'imagen_path'
+)
+
+# Filas leídas del cursor en cada bloque
+EXPORT_BATCH_SIZE = 500
+
+
+class ExportEmptyError(Exception):
+    """No hay datos que exportar con los filtros indicados"""
+
+
+class ExportBatch:
+    """Bloque de filas en formato columnar: una lista de valores por columna"""
+
+    __slots__ = ('columns', 'size')
+
+    def __init__(self, rows):
+        self.size = len(rows)
+        self.columns = dict(zip(EXPORT_COLUMNS, (list(valores) for valores in zip(*rows))))
+
+    def __getitem__(self, columna):
+        return self.columns[columna]
+
+    def __len__(self):
+        return self.size
+
+    def rows(self, *columnas):
+        """Iterar tuplas con las columnas pedidas (todas si no se indica ninguna)"""
+        columnas = columnas or EXPORT_COLUMNS
+        return zip(*(self.columns[columna] for columna in columnas))
+
+
+class ExportRenderer(ABC):
+    """Interfaz de un renderizador: recibe bloques y produce un fichero
+
+    finish() devuelve (filename, mimetype, contenido), donde contenido son
+    bytes o una lista de entradas (arcname, ruta o bytes) para stream_zip.
+    """
+
+    @abstractmethod
+    def add_batch(self, batch):
+        """Procesar un bloque de filas en formato columnar"""
+
+    @abstractmethod
+    def finish(self):
+        """Cerrar el fichero y devolver (filename, mimetype, contenido)"""
+
+
+def export_query(filtros, solo_con_imagen=False):
+    """SQL y parámetros de la exportación según usuario, viaje y rango de fechas"""
+    query = f'''
+        SELECT {', '.join(EXPORT_COLUMNS)}
+        FROM gastos
+        WHERE fecha BETWEEN ? AND ?
+    '''
+    params = [filtros['fecha_inicio'], filtros['fecha_fin']]
+
+    if not filtros['admin']:
+        # Usuario normal solo puede exportar sus propios gastos
+        query += ' AND usuario = ?'
+        params.append(filtros['usuario'])
+    elif filtros.get('user'):
+        query += ' AND usuario = ?'
+        params.append(filtros['user'])
+
+    if filtros.get('viaje'):
+        query += ' AND motivo = ?'
+        params.append(filtros['viaje'])
+
+    if solo_con_imagen:
+        query += " AND imagen_path IS NOT NULL AND imagen_path != ''"
+
+    query += ' ORDER BY fecha DESC'
+    return query, params
+
+
+def iter_export_batches(conn, filtros, solo_con_imagen=False, batch_size=EXPORT_BATCH_SIZE):
+    """Ejecutar la consulta una vez y leerla del cursor en bloques columnares"""
+    query, params = export_query(filtros, solo_con_imagen)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield ExportBatch(rows)
+
+
+def render_export(conn, filtros, renderers, solo_con_imagen=False,
+                  mensaje_vacio='No hay gastos en el rango seleccionado'):
+    """Pasar cada bloque de la consulta por todos los renderizadores
+
+    Devuelve el resultado de finish() de cada renderizador, en el mismo
+    orden. Lanza ExportEmptyError si la consulta no devuelve filas.
+    """
+    total = 0
+    for batch in iter_export_batches(conn, filtros, solo_con_imagen):
+        total += len(batch)
+        for renderer in renderers:
+            renderer.add_batch(batch)
+
+    if not total:
+        raise ExportEmptyError(mensaje_vacio)
+    return [renderer.finish() for renderer in renderers]
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Renderizadores de exportación: PDF, Excel e imágenes para ZIP
+Cada uno consume los bloques columnares de export_dataset.render_export
+"""
+
+import os
+import re
+from datetime import datetime
+from io import BytesIO
+
+from export_dataset import ExportRenderer
+from image_archive import REDUCIBLE_EXTENSIONS
+from pdf_report import PdfReport
+from xlsx_stream import XLSX_MIMETYPE, XlsxStreamWriter
+
+# Caracteres no válidos en nombres de archivo
+INVALID_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*]')
+
+
+def format_fecha(date_str):
+    """Convertir YYYY-MM-DD a DD/MM/YYYY (si no se puede, se devuelve tal cual)"""
+    if date_str:
+        try:
+            return datetime.strptime(date_str, '%Y-%m-%d').strftime('%d/%m/%Y')
+        except (TypeError, ValueError):
+            return date_str
+    return date_str
+
+
+class PdfRenderer(ExportRenderer):
+    """Reporte de gastos en PDF maquetado por páginas (pdf_report)
+
+    Las filas se maquetan según llegan los bloques; al final se añaden los
+    totales y, si subtotales es True, los subtotales por viaje y por concepto.
+    """
+
+    mimetype = 'application/pdf'
+
+    # Ancho de cada columna (puntos) y máximo de caracteres de los textos libres
+    COL_WIDTHS = [48, 60, 64, 104, 54, 55, 38, 48]
+    USUARIO_WIDTH = 52
+    MAX_CHARS = {'concepto': 12, 'motivo': 13, 'descripcion': 25, 'usuario': 9}
+
+    def __init__(self, filtros, subtotales=True):
+        self.filtros = filtros
+        self.filename = f"gastos_{filtros['fecha_inicio']}_{filtros['fecha_fin']}.pdf"
+        self.admin = filtros['admin']
+        self.subtotales = subtotales
+        self.total_gastos = 0
+        headers = ['Fecha', 'Concepto', 'Viaje', 'Descripción', 'Importe EUR', 'Otra Moneda', 'Moneda', 'Checkeado']
+        col_widths = list(self.COL_WIDTHS)
+        if self.admin:
+            headers.append('Usuario')
+            col_widths.append(self.USUARIO_WIDTH)
+        else:
+            col_widths[3] += self.USUARIO_WIDTH
+
+        self.buffer = BytesIO()
+        self.report = PdfReport(
+            self.buffer, "Reporte de Gastos",
+            [f"Período: {format_fecha(filtros['fecha_inicio'])} - {format_fecha(filtros['fecha_fin'])}"],
+            headers, col_widths
+        )
+
+    def _truncar(self, columna, texto):
+        limite = self.MAX_CHARS[columna]
+        if len(texto) > limite:
+            return texto[:limite] + '...'
+        return texto
+
+    def add_batch(self, batch):
+        self.total_gastos += len(batch)
+        rows = []
+        for (fecha, concepto, motivo, descripcion, importe_eur, importe_otra_moneda,
+             moneda_otra, checkeado, usuario) in batch.rows(
+                'fecha', 'concepto', 'motivo', 'descripcion', 'importe_eur',
+                'importe_otra_moneda', 'moneda_otra', 'checkeado', 'usuario'):
+            self.report.add_subtotal(motivo, concepto, importe_eur)
+            row = [
+                format_fecha(fecha),
+                self._truncar('concepto', concepto or '-'),
+                self._truncar('motivo', motivo or '-'),
+                self._truncar('descripcion', descripcion or '-'),
+                f'{importe_eur or 0:.2f}',
+                f'{importe_otra_moneda:.2f}' if importe_otra_moneda else '',
+                moneda_otra or '',
+                'Si' if checkeado else 'No'
+            ]
+            if self.admin:
+                row.append(self._truncar('usuario', usuario or '-'))
+            rows.append(row)
+        self.report.add_rows(rows)
+
+    def finish(self):
+        self.report.finish([
+            f"Total de tickets: {self.total_gastos}",
+            f"Importe total: EUR {self.report.total:.2f}"
+        ], subtotales=self.subtotales)
+        return self.filename, self.mimetype, self.buffer.getvalue()
+
+
+class ExcelRenderer(ExportRenderer):
+    """Hoja 'Gastos' con una fila por gasto, escrita en streaming (xlsx_stream)"""
+
+    mimetype = XLSX_MIMETYPE
+
+    def __init__(self, filtros):
+        self.filename = f"gastos_{filtros['fecha_inicio']}_{filtros['fecha_fin']}.xlsx"
+        self.admin = filtros['admin']
+        self.writer = XlsxStreamWriter(title='Gastos')
+
+        columns = ['Fecha', 'Concepto', 'Motivo', 'Descripcion', 'Importe EUR', 'Importe Otra Moneda', 'Moneda', 'Checkeado']
+        if self.admin:
+            columns.append('Usuario')
+        self.writer.append(columns, styles='Encabezado')
+        # Estilo de cada columna de datos: los importes con formato numérico
+        self.styles = [None, None, None, None, 'Importe', 'Importe', None, None, None]
+
+    def add_batch(self, batch):
+        columnas = ['fecha', 'concepto', 'motivo', 'descripcion', 'importe_eur',
+                    'importe_otra_moneda', 'moneda_otra', 'checkeado']
+        if self.admin:
+            columnas.append('usuario')
+        for row in batch.rows(*columnas):
+            row = list(row)
+            row[0] = format_fecha(row[0])
+            row[7] = 'Sí' if row[7] else 'No'
+            self.writer.append(row, styles=self.styles)
+
+    def finish(self):
+        buffer = BytesIO()
+        self.writer.save(buffer)
+        return self.filename, self.mimetype, buffer.getvalue()
+
+
+class ImageEntriesRenderer(ExportRenderer):
+    """Entradas de ZIP con las imágenes de los tickets, leídas de upload_folder
+
+    Cada imagen se nombra descripcion_fecha.ext; si el nombre se repite se
+    añade un sufijo numérico. Con filtros['tamano'] == 'reducido' las
+    imágenes se nombran .jpg porque se recodifican (image_archive).
+    Las que no existan en disco las omite stream_zip con un aviso.
+    """
+
+    mimetype = 'application/zip'
+
+    def __init__(self, filtros, upload_folder, carpeta=''):
+        self.reducido = filtros.get('tamano') == 'reducido'
+        sufijo = '_reducido' if self.reducido else ''
+        self.filename = f"imagenes_gastos_{filtros['fecha_inicio']}_{filtros['fecha_fin']}{sufijo}.zip"
+        self.upload_folder = upload_folder
+        self.carpeta = carpeta
+        self.entries = []
+        self._nombres = set()
+        self._indice = 0
+
+    def add_batch(self, batch):
+        for fecha, descripcion, imagen_path in batch.rows('fecha', 'descripcion', 'imagen_path'):
+            self._indice += 1
+            if not imagen_path:
+                continue
+
+            # Limpiar descripción para nombre de archivo (máximo 50 caracteres)
+            descripcion_clean = INVALID_FILENAME_CHARS.sub('_', descripcion or f"Gasto_{self._indice}")[:50]
+            ext = os.path.splitext(imagen_path)[1] or '.jpg'
+            if self.reducido and ext.lower() in REDUCIBLE_EXTENSIONS:
+                ext = '.jpg'
+            self.entries.append((self._unique_name(f"{descripcion_clean}_{fecha}", ext),
+                                 os.path.join(self.upload_folder, imagen_path)))
+
+    def _unique_name(self, base, ext):
+        nombre = f"{base}{ext}"
+        n = 2
+        while nombre in self._nombres:
+            nombre = f"{base}_{n}{ext}"
+            n += 1
+        self._nombres.add(nombre)
+        return f"{self.carpeta}/{nombre}" if self.carpeta else nombre
+
+    def finish(self):
+        return self.filename, self.mimetype, self.entries
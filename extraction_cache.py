@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Caché persistente de extracciones de tickets
+Clave: SHA-256 del JPEG normalizado que guarda process_image, de modo que
+volver a subir el mismo ticket no repite OCR ni la llamada al LLM
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+
+def image_hash(jpeg_bytes):
+    """Clave de caché de una imagen normalizada"""
+    return hashlib.sha256(jpeg_bytes).hexdigest()
+
+
+class ExtractionCache:
+    """Resultados de OCR + extracción guardados en la tabla extraction_cache
+
+    Expulsión por antigüedad (max_age_seconds) y por tamaño: si se supera
+    max_entries se eliminan las entradas usadas hace más tiempo.
+    """
+
+    def __init__(self, pool, max_entries=5000, max_age_seconds=90 * 24 * 3600):
+        self.pool = pool
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Devolver {'text', 'extracted_info', 'metodo'} o None"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT texto, extracted_info, metodo, created_at
+                FROM extraction_cache WHERE hash = ?
+            ''', (key,))
+            row = cursor.fetchone()
+            if not row or now - row[3] > self.max_age_seconds:
+                with self._lock:
+                    self.misses += 1
+                return None
+            cursor.execute('UPDATE extraction_cache SET last_used_at = ?, hits = hits + 1 WHERE hash = ?',
+                           (now, key))
+            conn.commit()
+        with self._lock:
+            self.hits += 1
+        return {
+            'text': row[0] or '',
+            'extracted_info': json.loads(row[1]) if row[1] else {},
+            'metodo': row[2]
+        }
+
+    def put(self, key, text, extracted_info, metodo):
+        now = time.time()
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO extraction_cache
+                    (hash, texto, extracted_info, metodo, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+            ''', (key, text, json.dumps(extracted_info, ensure_ascii=False), metodo, now, now))
+            conn.commit()
+        self._maybe_evict()
+
+    def evict(self):
+        """Aplicar las políticas de antigüedad y tamaño; devuelve el número de filas borradas"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM extraction_cache WHERE created_at < ?', (now - self.max_age_seconds,))
+            borradas = cursor.rowcount
+            cursor.execute('SELECT COUNT(*) FROM extraction_cache')
+            sobrantes = cursor.fetchone()[0] - self.max_entries
+            if sobrantes > 0:
+                cursor.execute('''
+                    DELETE FROM extraction_cache WHERE hash IN (
+                        SELECT hash FROM extraction_cache ORDER BY last_used_at ASC LIMIT ?
+                    )
+                ''', (sobrantes,))
+                borradas += cursor.rowcount
+            conn.commit()
+        return borradas
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def _maybe_evict(self):
+        # Como mucho una pasada de expulsión cada 5 minutos
+        now = time.time()
+        with self._lock:
+            if now - self._last_eviction < 300:
+                return
+            self._last_eviction = now
+        self.evict()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Estrategias de extracción de datos de tickets (OCR y LLM)
+Decide qué se ejecuta y en qué orden, y cuenta latencia y coste por modo
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+
+from metrics import LatencyRecorder
+
+# Modos disponibles:
+#   llm-first: solo LLM; el OCR se hace únicamente si el LLM falla o no encuentra importe
+#   parallel:  OCR y LLM a la vez, se usa el primer resultado con importe
+#   ocr-only:  solo OCR + parser de texto (sin coste de LLM)
+EXTRACTION_MODES = ('llm-first', 'parallel', 'ocr-only')
+
+
+def is_good(info):
+    """Un resultado sirve si tiene importe"""
+    return bool(info and info.get('amount'))
+
+
+def merge_info(principal, secundario):
+    """Campos de principal completados con los que le falten de secundario"""
+    merged = dict(secundario or {})
+    merged.update({campo: valor for campo, valor in (principal or {}).items() if valor})
+    return merged
+
+
+class ExtractionStrategy:
+    """Orquesta OCR y LLM según el modo
+
+    extract() recibe funciones sin argumentos: ocr() devuelve el texto,
+    parse(texto) los campos del texto y llm() los campos del LLM (lanza una
+    excepción si falla). Con llm=None cualquier modo se comporta como ocr-only.
+    """
+
+    def __init__(self, mode='llm-first', max_workers=4):
+        if mode not in EXTRACTION_MODES:
+            raise ValueError(f'Modo de extracción desconocido: {mode} (válidos: {", ".join(EXTRACTION_MODES)})')
+        self.mode = mode
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self.metrics = {modo: LatencyRecorder() for modo in EXTRACTION_MODES}
+
+    def _submit(self, func):
+        with self._lock:
+            if self._executor is None:
+                # Dos tareas (OCR y LLM) por cada hilo de la cola de tickets
+                self._executor = ThreadPoolExecutor(max_workers=2 * self.max_workers,
+                                                    thread_name_prefix='extraccion')
+            return self._executor.submit(func)
+
+    def extract(self, ocr, parse, llm=None):
+        """Devuelve {'text', 'extracted_info', 'metodo'}"""
+        mode = self.mode if llm is not None else 'ocr-only'
+        metrics = self.metrics[mode]
+        inicio = time.perf_counter()
+        try:
+            if mode == 'llm-first':
+                resultado = self._llm_first(ocr, parse, llm, metrics)
+            elif mode == 'parallel':
+                resultado = self._parallel(ocr, parse, llm, metrics)
+            else:
+                resultado = self._ocr_only(ocr, parse, metrics)
+        finally:
+            metrics.record(time.perf_counter() - inicio)
+        metrics.incr(f"metodo_{resultado['metodo']}")
+        return resultado
+
+    # ------------------------------------------------------------ modos
+
+    def _run_ocr(self, ocr, metrics):
+        inicio = time.perf_counter()
+        try:
+            return ocr()
+        except Exception as e:
+            print(f"Error en OCR: {e}")
+            metrics.incr('ocr_errores')
+            return ''
+        finally:
+            metrics.incr('ocr_llamadas')
+            metrics.incr('ocr_ms', round((time.perf_counter() - inicio) * 1000))
+
+    def _run_llm(self, llm, metrics):
+        inicio = time.perf_counter()
+        try:
+            return llm()
+        except Exception as e:
+            print(f"❌ Error en LLM: {e}")
+            metrics.incr('llm_errores')
+            return None
+        finally:
+            metrics.incr('llm_llamadas')
+            metrics.incr('llm_ms', round((time.perf_counter() - inicio) * 1000))
+
+    def _ocr_only(self, ocr, parse, metrics):
+        text = self._run_ocr(ocr, metrics)
+        return {'text': text, 'extracted_info': parse(text), 'metodo': 'ocr'}
+
+    def _llm_first(self, ocr, parse, llm, metrics):
+        info = self._run_llm(llm, metrics)
+        if is_good(info):
+            metrics.incr('ocr_evitado')
+            return {'text': '', 'extracted_info': info, 'metodo': 'llm'}
+
+        # OCR perezoso: solo cuando el LLM falla o no encuentra el importe
+        metrics.incr('ocr_respaldo')
+        text = self._run_ocr(ocr, metrics)
+        info_ocr = parse(text)
+        if info:
+            # Los campos que sí leyó el LLM tienen prioridad; el OCR aporta el resto
+            return {'text': text, 'extracted_info': merge_info(info, info_ocr), 'metodo': 'llm+ocr'}
+        return {'text': text, 'extracted_info': info_ocr, 'metodo': 'ocr'}
+
+    def _parallel(self, ocr, parse, llm, metrics):
+        futuro_ocr = self._submit(lambda: self._run_ocr(ocr, metrics))
+        futuro_llm = self._submit(lambda: self._run_llm(llm, metrics))
+        pendientes = {futuro_ocr, futuro_llm}
+        text, info_llm, info_ocr = '', None, None
+
+        while pendientes:
+            hechos, pendientes = wait_futures(pendientes, return_when=FIRST_COMPLETED)
+            if futuro_llm in hechos:
+                info_llm = futuro_llm.result()
+                if is_good(info_llm):
+                    metrics.incr('ganador_llm')
+                    if futuro_ocr.done():
+                        text = futuro_ocr.result()
+                    return {'text': text, 'extracted_info': info_llm, 'metodo': 'llm'}
+            if futuro_ocr in hechos:
+                text = futuro_ocr.result()
+                info_ocr = parse(text)
+                if is_good(info_ocr):
+                    metrics.incr('ganador_ocr')
+                    if futuro_llm.done() and futuro_llm.result():
+                        # El LLM ya terminó sin importe: el OCR aporta lo que le falta
+                        return {'text': text, 'extracted_info': merge_info(futuro_llm.result(), info_ocr),
+                                'metodo': 'llm+ocr'}
+                    if not futuro_llm.done():
+                        metrics.incr('llm_descartado')
+                    return {'text': text, 'extracted_info': info_ocr, 'metodo': 'ocr'}
+
+        # Ninguno encontró importe: lo que haya de cada uno
+        if info_llm:
+            return {'text': text, 'extracted_info': merge_info(info_llm, info_ocr), 'metodo': 'llm+ocr'}
+        return {'text': text, 'extracted_info': info_ocr or parse(text), 'metodo': 'ocr'}
+
+    # ---------------------------------------------------------- métricas
+
+    def stats(self):
+        return {
+            'modo': self.mode,
+            'modos': {modo: recorder.snapshot() for modo, recorder in self.metrics.items() if recorder.count}
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Configuración de gunicorn para producción
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Dimensionado (todo se puede cambiar con variables de entorno):
+
+- Hilos (GUNICORN_THREADS, 8 por defecto): casi todo el tiempo de una
+  petición es espera (LLM por HTTP, OCR en otro proceso, SQLite), así que
+  pocos procesos con varios hilos (worker gthread) atienden más tickets a la
+  vez que muchos procesos de un hilo y gastan menos memoria.
+- Procesos (WEB_CONCURRENCY, 2 por defecto): más de uno para que un proceso
+  reiniciándose o bloqueado en Python (PDF, Excel) no deje la web parada.
+  SQLite admite un solo escritor: más procesos no dan más escrituras.
+- CPU: el OCR y la reducción de imágenes de las exportaciones van en pools de
+  procesos dentro de cada worker. Si no se indica OCR_WORKERS ni
+  EXPORT_IMAGE_WORKERS, las CPUs (menos una para la web) se reparten entre
+  los workers en lugar de lanzar un pool completo en cada uno.
+- IMAGE_WORKERS (tickets procesándose a la vez por proceso) y DB_POOL_SIZE
+  se ajustan a los hilos si no se indican.
+
+Arranque y parada:
+
+- preload_app: la aplicación se carga una vez en el proceso maestro, donde
+  se aplican las migraciones (init_db) antes de crear los workers.
+- Al parar (SIGTERM) cada worker termina las peticiones en curso y los
+  tickets y exportaciones encolados antes de salir; graceful_timeout cubre
+  un ticket completo (cola de OCR + OCR + LLM con reintentos).
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5100')}"
+
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# Un worker gthread sigue avisando al maestro durante peticiones largas; esto
+# solo reinicia procesos colgados de verdad
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '150'))
+keepalive = 5
+
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+# Reparto de CPUs y hilos entre los workers (antes de cargar la aplicación)
+_cpus_libres = max(1, (os.cpu_count() or 1) - 1)
+os.environ.setdefault('OCR_WORKERS', str(max(1, _cpus_libres // workers)))
+os.environ.setdefault('EXPORT_IMAGE_WORKERS', str(max(1, min(4, _cpus_libres // workers))))
+os.environ.setdefault('IMAGE_WORKERS', str(max(1, threads // 2)))
+os.environ.setdefault('DB_POOL_SIZE', str(threads + 2))
+
+
+def worker_exit(server, worker):
+    """Terminar los trabajos en segundo plano del worker antes de que salga"""
+    from app import shutdown_background_work
+    shutdown_background_work()
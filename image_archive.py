@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Imágenes de tickets para los ZIP de exportación
+En modo reducido cada imagen se decodifica, se reduce a una resolución
+objetivo y se recodifica en JPEG en un pool de procesos; los resultados se
+entregan en el orden de la consulta a un único escritor (stream_zip)
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Procesos para reducir imágenes (trabajo de CPU: decodificar, escalar, codificar)
+EXPORT_IMAGE_WORKERS = int(os.getenv('EXPORT_IMAGE_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Lado mayor (píxeles) y calidad JPEG de las imágenes en modo reducido
+REDUCED_MAX_SIDE = int(os.getenv('EXPORT_REDUCED_MAX_SIDE', '1280'))
+REDUCED_QUALITY = int(os.getenv('EXPORT_REDUCED_QUALITY', '70'))
+
+# Formatos que se recodifican en modo reducido (el resto se copia tal cual)
+REDUCIBLE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff'}
+
+# El pool se crea desde un worker web con hilos en marcha: forkserver en lugar de
+# fork para que los procesos no hereden cerrojos tomados por otros hilos
+EXPORT_IMAGE_MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def reduce_image(path, max_side=REDUCED_MAX_SIDE, quality=REDUCED_QUALITY):
+    """JPEG de la imagen con el lado mayor limitado a max_side
+
+    Se ejecuta en los procesos del pool. Devuelve None si la imagen reducida
+    no ocupa menos que el original (entonces se copia el original).
+    """
+    with Image.open(path) as img:
+        # En JPEG decodifica directamente a una escala reducida (mucho más rápido)
+        img.draft('RGB', (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        img.save(buffer, 'JPEG', quality=quality, optimize=True)
+
+    data = buffer.getvalue()
+    if len(data) >= os.path.getsize(path):
+        return None
+    return data
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_IMAGE_WORKERS,
+                                        mp_context=EXPORT_IMAGE_MP_CONTEXT)
+        return _pool
+
+
+def _reset_pool(pool):
+    """Descartar un pool roto (un proceso murió) para crear otro en el siguiente uso"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_image_pool(wait=True):
+    """Parar los procesos del pool (al apagar la aplicación)"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def is_reducible(arcname):
+    return os.path.splitext(arcname)[1].lower() in REDUCIBLE_EXTENSIONS
+
+
+def reduced_image_entries(entries, max_side=REDUCED_MAX_SIDE, quality=REDUCED_QUALITY,
+                          workers=EXPORT_IMAGE_WORKERS):
+    """Entradas de stream_zip con las imágenes reducidas en el pool de procesos
+
+    entries son (arcname, contenido) como los de ImageEntriesRenderer; las
+    que son rutas de imágenes se envían al pool y se sustituyen por los bytes
+    reducidos. Se mantienen como mucho 2 * workers imágenes adelantadas y se
+    devuelven en el mismo orden. Si una imagen no se puede reducir se copia
+    el original.
+    """
+    pool = _get_pool()
+    pendientes = deque()
+    ventana = max(2 * workers, 2)
+
+    def resolver(arcname, contenido, future):
+        if future is None:
+            return arcname, contenido
+        try:
+            data = future.result()
+        except BrokenProcessPool as e:
+            print(f"⚠️ Pool de imágenes roto, se copia el original de {arcname}: {e}")
+            _reset_pool(pool)
+            return arcname, contenido
+        except FileNotFoundError:
+            # stream_zip la omite con su propio aviso
+            return arcname, contenido
+        except Exception as e:
+            print(f"⚠️ No se pudo reducir {arcname}, se copia el original: {e}")
+            return arcname, contenido
+        return arcname, data if data is not None else contenido
+
+    try:
+        for arcname, contenido in entries:
+            future = None
+            if isinstance(contenido, str) and is_reducible(arcname):
+                try:
+                    future = pool.submit(reduce_image, contenido, max_side, quality)
+                except (BrokenProcessPool, RuntimeError) as e:
+                    print(f"⚠️ No se pudo encolar {arcname} en el pool de imágenes: {e}")
+            pendientes.append((arcname, contenido, future))
+            if len(pendientes) >= ventana:
+                yield resolver(*pendientes.popleft())
+        while pendientes:
+            yield resolver(*pendientes.popleft())
+    finally:
+        # Si el cliente corta la descarga no se sigue reduciendo lo que queda
+        for _, _, future in pendientes:
+            if future is not None:
+                future.cancel()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Cola de trabajos en segundo plano del Gestor de Gastos
+Pool acotado de hilos cuyo estado se guarda en la tabla jobs de SQLite,
+para que cualquier proceso web pueda consultar un trabajo por su id
+"""
+
+import json
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Estados de un trabajo
+JOB_PENDING = 'pendiente'
+JOB_RUNNING = 'procesando'
+JOB_DONE = 'completado'
+JOB_ERROR = 'error'
+
+
+class QueueFullError(Exception):
+    """La cola ya tiene el máximo de trabajos pendientes"""
+
+
+class JobQueue:
+    """Cola de trabajos con un número fijo de hilos y un límite de pendientes
+
+    submit() devuelve el id al instante; el trabajo corre en un hilo del pool
+    y su resultado (JSON) queda en la tabla jobs hasta que caduca.
+    """
+
+    def __init__(self, pool, nombre, max_workers=4, max_pending=32, ttl_seconds=3600):
+        self.pool = pool
+        self.nombre = nombre
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'job-{nombre}')
+        # Plazas = hilos trabajando + trabajos esperando
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_cleanup = 0.0
+        self._closed = False
+
+    # ------------------------------------------------------------------ API
+
+    def submit(self, func, *args, usuario=None, **kwargs):
+        """Encolar func(*args, **kwargs); lanza QueueFullError si no hay plazas"""
+        if self._closed:
+            raise QueueFullError('La cola se está cerrando')
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError(f'Cola {self.nombre} llena')
+
+        job_id = uuid.uuid4().hex
+        try:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    INSERT INTO jobs (id, tipo, estado, usuario, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (job_id, self.nombre, JOB_PENDING, usuario, time.time(), time.time()))
+                conn.commit()
+            future = self._executor.submit(self._run, job_id, func, args, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._futures[job_id] = future
+        self._maybe_cleanup()
+        return job_id
+
+    def get(self, job_id):
+        """Estado del trabajo como diccionario (None si no existe o caducó)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, tipo, estado, progreso, resultado, error, usuario, created_at, started_at, finished_at
+                FROM jobs WHERE id = ?
+            ''', (job_id,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'tipo': row[1],
+            'estado': row[2],
+            'progreso': row[3],
+            'resultado': json.loads(row[4]) if row[4] else None,
+            'error': row[5],
+            'usuario': row[6],
+            'created_at': row[7],
+            'started_at': row[8],
+            'finished_at': row[9]
+        }
+
+    def wait(self, job_id, timeout=None):
+        """Esperar a que termine un trabajo de este proceso y devolver su estado"""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass  # El error ya está guardado en la tabla
+        return self.get(job_id)
+
+    def update_progress(self, job_id, progreso):
+        """Guardar el progreso (0-100) de un trabajo en curso"""
+        with self.pool.connection() as conn:
+            conn.execute('UPDATE jobs SET progreso = ?, updated_at = ? WHERE id = ?',
+                         (progreso, time.time(), job_id))
+            conn.commit()
+
+    def report_progress(self, progreso):
+        """Progreso del trabajo que se está ejecutando en el hilo actual"""
+        job_id = getattr(self._local, 'job_id', None)
+        if job_id:
+            self.update_progress(job_id, progreso)
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for future in self._futures.values() if not future.done())
+
+    def shutdown(self, wait=True):
+        """Dejar de aceptar trabajos y, si wait, esperar a que terminen los encolados"""
+        self._closed = True
+        self._executor.shutdown(wait=wait)
+
+    # ------------------------------------------------------------ internos
+
+    def _run(self, job_id, func, args, kwargs):
+        started = time.time()
+        self._set_state(job_id, JOB_RUNNING, started_at=started)
+        self._local.job_id = job_id
+        try:
+            resultado = func(*args, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            self._set_state(job_id, JOB_ERROR, error=str(e), finished_at=time.time())
+            raise
+        else:
+            self._set_state(job_id, JOB_DONE, resultado=json.dumps(resultado, default=str),
+                            progreso=100, finished_at=time.time())
+            print(f"✅ Trabajo {self.nombre} {job_id[:8]} completado en {time.time() - started:.2f}s")
+            return resultado
+        finally:
+            self._local.job_id = None
+            self._slots.release()
+            with self._lock:
+                self._futures.pop(job_id, None)
+
+    def _set_state(self, job_id, estado, **campos):
+        campos['estado'] = estado
+        campos['updated_at'] = time.time()
+        asignaciones = ', '.join(f'{campo} = ?' for campo in campos)
+        with self.pool.connection() as conn:
+            conn.execute(f'UPDATE jobs SET {asignaciones} WHERE id = ?', (*campos.values(), job_id))
+            conn.commit()
+
+    def _maybe_cleanup(self):
+        """Borrar trabajos terminados más antiguos que el TTL (como mucho una vez por minuto)"""
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        with self.pool.connection() as conn:
+            conn.execute('DELETE FROM jobs WHERE tipo = ? AND estado IN (?, ?) AND finished_at < ?',
+                         (self.nombre, JOB_DONE, JOB_ERROR, now - self.ttl_seconds))
+            conn.commit()
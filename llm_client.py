@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente HTTP para el LLM de visión de Novita AI
+Sesión persistente (keep-alive) con pool de conexiones, timeouts por llamada
+y reintentos con backoff exponencial con jitter en 429/5xx
+"""
+
+import json
+import random
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import LatencyRecorder
+
+NOVITA_BASE_URL = 'https://api.novita.ai/v3/openai'
+NOVITA_VISION_MODEL = 'qwen/qwen2.5-vl-72b-instruct'
+
+# Códigos HTTP que merece la pena reintentar
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """La llamada al LLM falló después de agotar los reintentos"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMClient:
+    """Cliente de chat completions compatible con la API de OpenAI
+
+    base_url es configurable para poder apuntarlo a un servidor HTTP local
+    de pruebas en lugar de api.novita.ai.
+    """
+
+    def __init__(self, api_key, base_url=NOVITA_BASE_URL, model=NOVITA_VISION_MODEL,
+                 pool_maxsize=8, connect_timeout=5.0, read_timeout=30.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics = LatencyRecorder()
+        # Últimas llamadas (bytes enviados, latencia y resultado) para ajustar LLM_IMAGE_*
+        self.recent_calls = deque(maxlen=50)
+
+        self.session = requests.Session()
+        # Los reintentos los gestiona chat(); el adaptador solo mantiene el pool
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        })
+
+    def chat(self, messages, temperature=0.0, max_tokens=1000, timeout=None):
+        """Enviar mensajes y devolver el texto de la primera respuesta"""
+        payload = {
+            'model': self.model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }
+        result = self._post('/chat/completions', payload, timeout)
+        # Tokens consumidos (coste de la llamada)
+        usage = result.get('usage') if isinstance(result, dict) else None
+        if usage:
+            self.metrics.incr('tokens_entrada', usage.get('prompt_tokens') or 0)
+            self.metrics.incr('tokens_salida', usage.get('completion_tokens') or 0)
+        try:
+            return result['choices'][0]['message']['content'].strip()
+        except (KeyError, IndexError, TypeError, AttributeError):
+            self.metrics.incr('respuestas_invalidas')
+            raise LLMError(f'Respuesta inesperada del LLM: {str(result)[:200]}')
+
+    def _post(self, path, payload, timeout=None):
+        url = f'{self.base_url}{path}'
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        last_error = None
+        # Serializado una vez: el cuerpo (casi todo la imagen en base64) se mide y se reutiliza en los reintentos
+        body = json.dumps(payload).encode('utf-8')
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.metrics.incr('reintentos')
+            self.metrics.incr('bytes_enviados', len(body))
+            start = time.perf_counter()
+            retry_after = None
+            try:
+                response = self.session.post(url, data=body, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.incr('errores_red')
+                self._log_call(len(body), time.perf_counter() - start, 'red')
+                last_error = LLMError(f'Error de red con el LLM: {e}')
+            else:
+                elapsed = time.perf_counter() - start
+                self.metrics.record(elapsed)
+                self._log_call(len(body), elapsed, response.status_code)
+                if response.status_code == 200:
+                    self.metrics.incr('ok')
+                    return response.json()
+                self.metrics.incr(f'http_{response.status_code}')
+                last_error = LLMError(f'HTTP {response.status_code}: {response.text[:300]}',
+                                      status_code=response.status_code)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise last_error
+                retry_after = response.headers.get('Retry-After')
+
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, retry_after))
+
+        self.metrics.incr('fallos')
+        raise last_error
+
+    def _log_call(self, size, seconds, status):
+        self.recent_calls.append({'bytes': size, 'ms': round(seconds * 1000, 1), 'status': status})
+
+    def stats(self):
+        """Métricas del cliente con los bytes medios por llamada y las últimas llamadas"""
+        snapshot = self.metrics.snapshot()
+        calls = list(self.recent_calls)
+        snapshot['bytes_medios'] = round(sum(c['bytes'] for c in calls) / len(calls)) if calls else None
+        snapshot['ultimas_llamadas'] = calls[-10:]
+        return snapshot
+
+    def _backoff(self, attempt, retry_after=None):
+        """Espera antes del siguiente intento: Retry-After o exponencial con jitter completo"""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Imagen que se envía al LLM de visión
+Se codifica a partir de la imagen ya normalizada de process_image (no del
+original del móvil) con lado máximo, calidad y tamaño en bytes acotados
+"""
+
+import os
+from io import BytesIO
+
+from PIL import Image
+
+# Lado mayor en píxeles (los tokens de imagen del modelo crecen con los píxeles)
+LLM_IMAGE_MAX_SIDE = int(os.getenv('LLM_IMAGE_MAX_SIDE', '1200'))
+
+# Calidad JPEG inicial y mínima; se baja por pasos hasta caber en LLM_IMAGE_MAX_KB
+LLM_IMAGE_QUALITY = int(os.getenv('LLM_IMAGE_QUALITY', '75'))
+LLM_IMAGE_MIN_QUALITY = 45
+LLM_IMAGE_MAX_BYTES = int(os.getenv('LLM_IMAGE_MAX_KB', '200')) * 1024
+
+# Escala de grises: menos bytes; los tickets rara vez necesitan color
+LLM_IMAGE_GRAYSCALE = os.getenv('LLM_IMAGE_GRAYSCALE', '0').lower() in ('1', 'true', 'yes')
+
+# Por debajo de este lado ya no se reduce más aunque no quepa en el límite de bytes
+_MIN_SIDE = 640
+
+
+def _jpeg(image, quality):
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def encode_for_llm(image, max_side=LLM_IMAGE_MAX_SIDE, quality=LLM_IMAGE_QUALITY,
+                   max_bytes=LLM_IMAGE_MAX_BYTES, grayscale=LLM_IMAGE_GRAYSCALE):
+    """JPEG de una imagen PIL para el LLM y los parámetros con que se codificó
+
+    Primero se baja la calidad hasta LLM_IMAGE_MIN_QUALITY y, si aún no cabe
+    en max_bytes, se reduce la resolución un 25 % cada vez.
+    """
+    if grayscale:
+        image = image.convert('L')
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    data = _jpeg(image, quality)
+    while len(data) > max_bytes:
+        if quality > LLM_IMAGE_MIN_QUALITY:
+            quality = max(LLM_IMAGE_MIN_QUALITY, quality - 10)
+        elif max(image.size) * 3 // 4 >= _MIN_SIDE:
+            image = image.resize((image.width * 3 // 4, image.height * 3 // 4), Image.Resampling.LANCZOS)
+        else:
+            break
+        data = _jpeg(image, quality)
+
+    return data, {
+        'bytes': len(data),
+        'ancho': image.width,
+        'alto': image.height,
+        'calidad': quality,
+        'grises': image.mode == 'L'
+    }
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas en memoria del Gestor de Gastos
+Contadores y latencias por proceso, expuestos en GET /api/metrics
+"""
+
+import threading
+from collections import deque
+
+
+class LatencyRecorder:
+    """Latencias recientes (ventana deslizante) y contadores acumulados"""
+
+    def __init__(self, window=500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.counters = {}
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total_seconds += seconds
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            counters = dict(self.counters)
+            count = self.count
+            total = self.total_seconds
+
+        def percentile(p):
+            if not samples:
+                return None
+            index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+            return round(samples[index] * 1000, 1)
+
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 1) if count else None,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'max_ms': round(samples[-1] * 1000, 1) if samples else None,
+            'counters': counters
+        }
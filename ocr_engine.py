@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de OCR del Gestor de Gastos
+Pool de procesos de larga duración que ejecutan Tesseract fuera de los hilos
+web, con cola acotada (contrapresión) y tiempos por etapa
+"""
+
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Tesseract usa OpenMP: con varios procesos, un hilo por proceso evita sobresuscribir
+# la CPU. libgomp lee OMP_* una sola vez al cargarse, así que tiene que estar antes
+# de importar tesserocr (aquí y en los procesos del pool, que importan este módulo)
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+from PIL import Image
+
+from metrics import LatencyRecorder
+
+try:
+    # Motor soportado (requirements.txt): enlace directo a libtesseract, los datos
+    # de idioma se cargan una vez por proceso. Sin él se usa pytesseract, que
+    # funciona pero queda marcado como degradado en /api/metrics
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Procesos de OCR: uno por CPU dejando una libre para los hilos web
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', str(max(1, (os.cpu_count() or 1) - 1))))
+
+# Tickets esperando un proceso libre además de los que se están leyendo
+OCR_QUEUE_SIZE = int(os.getenv('OCR_QUEUE_SIZE', str(2 * OCR_WORKERS)))
+
+# Segundos máximos esperando plaza en la cola y leyendo un ticket
+OCR_QUEUE_TIMEOUT = float(os.getenv('OCR_QUEUE_TIMEOUT', '30'))
+OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', '60'))
+
+# Prioridad (nice) de los procesos de OCR: ceden CPU a los hilos web en ráfagas
+OCR_NICE = int(os.getenv('OCR_NICE', '10'))
+
+# Los procesos del pool se crean desde un worker web con hilos en marcha: con fork
+# heredarían cerrojos que otro hilo tuviera tomados. forkserver los crea desde un
+# proceso limpio que importa de nuevo este módulo
+OCR_MP_CONTEXT = multiprocessing.get_context('forkserver')
+
+
+class OcrBusyError(Exception):
+    """No hay plaza en la cola de OCR dentro del tiempo de espera"""
+
+
+class OcrError(Exception):
+    """Error de Tesseract en un proceso de OCR
+
+    Las excepciones de pytesseract no siempre se pueden serializar entre
+    procesos (y romperían el pool), así que llegan convertidas a esta.
+    """
+
+
+# ------------------------------------------------------ procesos del pool
+
+_worker_api = None
+
+
+def _init_worker(languages, config, nice):
+    """Inicializar un proceso de OCR (una sola vez por proceso)"""
+    global _worker_api
+    if nice:
+        try:
+            os.nice(nice)
+        except OSError:
+            pass
+    if tesserocr is not None:
+        try:
+            _worker_api = _tesserocr_api(languages, config)
+        except Exception as e:
+            print(f"⚠️ tesserocr no disponible, se usa pytesseract: {e}")
+            _worker_api = None
+
+
+def _tesserocr_api(languages, config):
+    """PyTessBaseAPI con los idiomas y las opciones de OCR_CONFIG (--psm, --oem, -c var=valor)"""
+    psm = re.search(r'--psm\s+(\d+)', config)
+    oem = re.search(r'--oem\s+(\d+)', config)
+    kwargs = {'lang': languages}
+    if psm:
+        kwargs['psm'] = tesserocr.PSM(int(psm.group(1)))
+    if oem:
+        kwargs['oem'] = tesserocr.OEM(int(oem.group(1)))
+    api = tesserocr.PyTessBaseAPI(**kwargs)
+    for nombre, valor in re.findall(r'-c\s+(\w+)=(\S+)', config):
+        api.SetVariable(nombre, valor)
+    return api
+
+
+def _recognize(mode, size, data, languages, config, timeout):
+    """Leer el texto de una imagen (en un proceso del pool)
+
+    Devuelve (texto, instante de inicio, segundos de OCR, motor usado).
+    """
+    inicio_wall = time.time()
+    inicio = time.perf_counter()
+    image = Image.frombytes(mode, size, data)
+    try:
+        if _worker_api is not None:
+            _worker_api.SetImage(image)
+            text = _worker_api.GetUTF8Text()
+            motor = 'tesserocr'
+        else:
+            # Modo degradado: un proceso tesseract nuevo por ticket que vuelve a cargar los idiomas
+            import pytesseract
+            text = pytesseract.image_to_string(image, lang=languages, config=config, timeout=timeout)
+            motor = 'pytesseract'
+    except Exception as e:
+        raise OcrError(str(e) or type(e).__name__) from None
+    return text, inicio_wall, time.perf_counter() - inicio, motor
+
+
+# ------------------------------------------------------------------ motor
+
+class OcrEngine:
+    """Pool de procesos de OCR con plazas limitadas
+
+    recognize() se llama desde los hilos de trabajo (cola process-image):
+    espera plaza hasta queue_timeout (contrapresión) y bloquea hasta tener
+    el texto. Los procesos se crean al primer uso y se reutilizan.
+    """
+
+    def __init__(self, languages, config, workers=OCR_WORKERS, queue_size=OCR_QUEUE_SIZE,
+                 queue_timeout=OCR_QUEUE_TIMEOUT, timeout=OCR_TIMEOUT, nice=OCR_NICE):
+        self.languages = languages
+        self.config = config
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.nice = nice
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.motor = None
+        self.metrics = {
+            'espera_cola': LatencyRecorder(),
+            'transferencia': LatencyRecorder(),
+            'ocr': LatencyRecorder(),
+            'total': LatencyRecorder()
+        }
+
+    def _get_executor(self):
+        with self._lock:
+            if self._closed:
+                raise OcrBusyError('El motor de OCR se está cerrando')
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=OCR_MP_CONTEXT,
+                    initializer=_init_worker,
+                    initargs=(self.languages, self.config, self.nice)
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        """Descartar un pool roto (un proceso murió) para crear otro en la siguiente llamada"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def recognize(self, image):
+        """Texto de una imagen PIL y tiempos por etapa en segundos
+
+        Lanza OcrBusyError si no hay plaza a tiempo y OcrError si falla Tesseract.
+        """
+        inicio = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.metrics['total'].incr('rechazados')
+            raise OcrBusyError('Cola de OCR llena')
+        try:
+            espera = time.perf_counter() - inicio
+            executor = self._get_executor()
+            enviado = time.time()
+            future = executor.submit(_recognize, image.mode, image.size, image.tobytes(),
+                                     self.languages, self.config, self.timeout)
+        except BaseException:
+            self._slots.release()
+            raise
+        # La plaza se libera cuando el proceso termina de verdad, no cuando se deja
+        # de esperar: un OCR que excede el tiempo sigue ocupando su proceso
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            text, inicio_ocr, segundos_ocr, motor = future.result(timeout=self.timeout + 5)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            self.metrics['total'].incr('errores')
+            raise
+        except FutureTimeoutError:
+            future.cancel()
+            self.metrics['total'].incr('timeouts')
+            raise
+        except Exception:
+            self.metrics['total'].incr('errores')
+            raise
+        self._record_motor(motor)
+
+        total = time.perf_counter() - inicio
+        tiempos = {
+            'espera_cola': espera,
+            # Envío de la imagen al proceso y espera hasta que uno quede libre
+            'transferencia': max(0.0, inicio_ocr - enviado),
+            'ocr': segundos_ocr,
+            'total': total
+        }
+        for etapa, segundos in tiempos.items():
+            self.metrics[etapa].record(segundos)
+        self.metrics['total'].incr('ok')
+        return text, tiempos
+
+    def _record_motor(self, motor):
+        self.metrics['total'].incr(f'motor_{motor}')
+        if motor != self.motor:
+            self.motor = motor
+            if motor != 'tesserocr':
+                print("⚠️ OCR degradado: tesserocr no disponible, cada ticket lanza tesseract y recarga los idiomas")
+
+    def stats(self):
+        # Motor de la última lectura; antes de la primera, el que se espera usar
+        motor = self.motor or ('tesserocr' if tesserocr is not None else 'pytesseract')
+        return {
+            'workers': self.workers,
+            'motor': motor,
+            'degradado': motor != 'tesserocr',
+            'etapas': {etapa: recorder.snapshot() for etapa, recorder in self.metrics.items()}
+        }
+
+    def shutdown(self, wait=True):
+        """Parar los procesos de OCR (al apagar la aplicación)"""
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait, cancel_futures=True)
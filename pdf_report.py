@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de informes PDF por páginas para las exportaciones
+Las filas se maquetan en tablas del tamaño de una página (con la cabecera
+repetida) según llegan, en lugar de una única tabla gigante al final
+"""
+
+import io
+
+import reportlab
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus.doctemplate import BaseDocTemplate, PageTemplate
+from reportlab.platypus.frames import Frame
+
+# Versión de reportlab con la que se ha comprobado _IncrementalDocTemplate (requirements.txt)
+REPORTLAB_VERIFIED = '5.0.1'
+
+# Filas por tabla: algo menos de lo que cabe en una página A4 con letra de 7 puntos
+PDF_ROWS_PER_CHUNK = 50
+
+# Estilos calculados una sola vez y compartidos por todos los informes
+PDF_STYLES = getSampleStyleSheet()
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 7),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ('FONTSIZE', (0, 1), (-1, -1), 7),
+    ('TOPPADDING', (0, 1), (-1, -1), 2),
+    ('BOTTOMPADDING', (0, 1), (-1, -1), 2),
+])
+
+SUBTOTAL_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+])
+
+
+class _IncrementalDocTemplate(BaseDocTemplate):
+    """Documento de una sola plantilla de página que maqueta los flowables según se le entregan
+
+    Usa los mismos pasos que BaseDocTemplate.build (_startBuild,
+    handle_flowable, _endBuild) pero sin necesitar la historia completa.
+    """
+
+    def begin(self):
+        frame = Frame(self.leftMargin, self.bottomMargin, self.width, self.height, id='normal')
+        self.addPageTemplates([PageTemplate(id='Pagina', frames=frame, pagesize=self.pagesize)])
+        self._startBuild()
+        self._savedInfo = self.canv._doc.info
+        self.canv._doctemplate = self
+
+    def add(self, flowables):
+        flowables = list(flowables)
+        while flowables:
+            self.clean_hanging()
+            self.handle_flowable(flowables)
+
+    def end(self):
+        self._endBuild()
+
+
+_build_checked = False
+
+
+def check_incremental_build():
+    """Maquetar un PDF de una página con _IncrementalDocTemplate y comprobar el resultado
+
+    _IncrementalDocTemplate usa métodos internos de BaseDocTemplate: si otra
+    versión de reportlab los cambia, las exportaciones fallan aquí con un
+    error claro en lugar de generar PDFs rotos. PdfReport lo ejecuta una vez.
+    """
+    global _build_checked
+    motivo = None
+    faltan = [nombre for nombre in ('_startBuild', 'handle_flowable', '_endBuild', 'clean_hanging')
+              if not hasattr(BaseDocTemplate, nombre)]
+    if faltan:
+        motivo = f"faltan {', '.join(faltan)}"
+    else:
+        buf = io.BytesIO()
+        try:
+            doc = _IncrementalDocTemplate(buf, pagesize=A4)
+            doc.begin()
+            doc.add([Paragraph('Prueba', PDF_STYLES['Normal'])])
+            doc.end()
+        except Exception as e:
+            motivo = f'{type(e).__name__}: {e}'
+        else:
+            data = buf.getvalue()
+            if not data.startswith(b'%PDF-') or not data.rstrip().endswith(b'%%EOF'):
+                motivo = 'el resultado no es un PDF completo'
+            elif doc.page != 1:
+                motivo = f'se esperaba 1 página y salen {doc.page}'
+    if motivo:
+        raise RuntimeError(f'reportlab {reportlab.Version} no es compatible con el PDF por páginas '
+                           f'(comprobado con {REPORTLAB_VERIFIED}): {motivo}')
+    _build_checked = True
+
+
+class PdfReport:
+    """Informe con título, tabla de datos paginada y resumen final
+
+    add_rows() recibe filas ya formateadas (listas de textos); cada
+    rows_per_chunk filas se maqueta una tabla con la cabecera repetida.
+    add_subtotal() acumula importes por viaje y por concepto para el resumen.
+    """
+
+    def __init__(self, output, title, lines, headers, col_widths,
+                 rows_per_chunk=PDF_ROWS_PER_CHUNK, pagesize=A4):
+        self.headers = list(headers)
+        self.col_widths = col_widths
+        self.rows_per_chunk = rows_per_chunk
+        self.pending = []
+        self.rows = 0
+        self.total = 0.0
+        self.por_viaje = {}
+        self.por_concepto = {}
+
+        if not _build_checked:
+            check_incremental_build()
+        self.doc = _IncrementalDocTemplate(output, pagesize=pagesize,
+                                           leftMargin=36, rightMargin=36, topMargin=36, bottomMargin=36)
+        self.doc.begin()
+        flowables = [Paragraph(title, PDF_STYLES['Title'])]
+        flowables += [Paragraph(line, PDF_STYLES['Normal']) for line in lines]
+        flowables.append(Spacer(1, 12))
+        self.doc.add(flowables)
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.pending.append(row)
+            if len(self.pending) >= self.rows_per_chunk:
+                self._flush()
+
+    def add_subtotal(self, viaje, concepto, importe):
+        importe = importe or 0
+        self.total += importe
+        self.por_viaje[viaje or '-'] = self.por_viaje.get(viaje or '-', 0) + importe
+        self.por_concepto[concepto or '-'] = self.por_concepto.get(concepto or '-', 0) + importe
+
+    def _flush(self):
+        if not self.pending:
+            return
+        table = Table([self.headers] + self.pending, colWidths=self.col_widths, repeatRows=1)
+        table.setStyle(TABLE_STYLE)
+        self.rows += len(self.pending)
+        self.pending = []
+        self.doc.add([table])
+
+    def _subtotal_table(self, titulo, totales):
+        data = [[titulo, 'Importe EUR']]
+        data += [[nombre, f'{importe:.2f}'] for nombre, importe in
+                 sorted(totales.items(), key=lambda item: (-item[1], item[0]))]
+        data.append(['Total', f'{self.total:.2f}'])
+        table = Table(data, colWidths=[200, 90], repeatRows=1, hAlign='LEFT')
+        table.setStyle(SUBTOTAL_STYLE)
+        return table
+
+    def finish(self, lines=(), subtotales=True):
+        """Maquetar las filas pendientes y el resumen, y cerrar el PDF"""
+        self._flush()
+        flowables = [Spacer(1, 12)]
+        flowables += [Paragraph(line, PDF_STYLES['Normal']) for line in lines]
+        if subtotales and self.por_viaje:
+            flowables += [Spacer(1, 12), self._subtotal_table('Viaje', self.por_viaje),
+                          Spacer(1, 12), self._subtotal_table('Concepto', self.por_concepto)]
+        self.doc.add(flowables)
+        self.doc.end()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Preprocesado de imágenes de tickets antes del OCR (OpenCV/NumPy)
+Receta configurable de pasos sobre arrays: escala de grises, recorte al
+contorno del ticket, enderezado, normalización de resolución y umbral
+adaptativo, con el tiempo de cada paso
+"""
+
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from metrics import LatencyRecorder
+
+# Receta por defecto (config.OCR_PREPROCESS la sustituye); 'contrast' reproduce el preprocesado anterior
+DEFAULT_RECIPE = 'grayscale,crop,deskew,dpi,threshold'
+
+# Ancho de un ticket térmico estándar, para estimar su resolución
+RECEIPT_WIDTH_MM = 80
+
+
+def to_grayscale(img):
+    """Escala de grises (la imagen llega en RGB desde PIL)"""
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return img
+
+
+def increase_contrast(img, factor=2.0):
+    """Contraste respecto al gris medio, como ImageEnhance.Contrast de PIL"""
+    media = float(img.mean())
+    out = (img.astype(np.float32) - media) * factor + media
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def crop_to_receipt(img, min_area=0.2, margin=8):
+    """Recortar al contorno del papel (zona clara más grande) si ocupa al menos min_area de la imagen
+
+    El fondo que queda dentro del recorte (esquinas de un ticket torcido) se
+    rellena con el tono medio del papel para que no cuente como tinta.
+    """
+    blur = cv2.GaussianBlur(img, (5, 5), 0)
+    _, papel = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Cerrar los huecos del texto para que el papel sea una sola región
+    papel = cv2.morphologyEx(papel, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contornos, _ = cv2.findContours(papel, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contornos:
+        return img
+
+    contorno = max(contornos, key=cv2.contourArea)
+    x, y, w, h = cv2.boundingRect(contorno)
+    alto, ancho = img.shape[:2]
+    if cv2.contourArea(contorno) < min_area * alto * ancho or (w >= ancho - 2 and h >= alto - 2):
+        return img
+
+    mascara = np.zeros_like(img)
+    cv2.drawContours(mascara, [contorno], -1, 255, thickness=cv2.FILLED)
+    # Unos píxeles hacia dentro: el borde del papel no debe quedar como una línea de tinta
+    mascara = cv2.erode(mascara, np.ones((7, 7), np.uint8))
+    x0, y0 = max(x - margin, 0), max(y - margin, 0)
+    x1, y1 = min(x + w + margin, ancho), min(y + h + margin, alto)
+    recorte = img[y0:y1, x0:x1].copy()
+    recorte[mascara[y0:y1, x0:x1] == 0] = int(cv2.mean(img, mask=mascara)[0])
+    return recorte
+
+
+def skew_angle(img):
+    """Inclinación del bloque de texto en grados (minAreaRect sobre los píxeles de tinta)"""
+    _, tinta = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    puntos = cv2.findNonZero(tinta)
+    if puntos is None or len(puntos) < 50:
+        return 0.0
+    angulo = cv2.minAreaRect(puntos)[-1]
+    # Según la versión de OpenCV el ángulo va de [-90, 0) o de (0, 90]: se lleva a [-45, 45]
+    if angulo > 45:
+        angulo -= 90
+    elif angulo < -45:
+        angulo += 90
+    return float(angulo)
+
+
+def deskew(img, max_angle=15.0, min_angle=0.3):
+    """Enderezar el ticket; los ángulos mayores que max_angle se consideran mal estimados"""
+    angulo = skew_angle(img)
+    if abs(angulo) < min_angle or abs(angulo) > max_angle:
+        return img
+    alto, ancho = img.shape[:2]
+    matriz = cv2.getRotationMatrix2D((ancho / 2, alto / 2), angulo, 1.0)
+    return cv2.warpAffine(img, matriz, (ancho, alto), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def normalize_dpi(img, dpi=300, max_scale=3.0):
+    """Escalar para que el ancho del ticket equivalga a dpi puntos por pulgada"""
+    ancho_objetivo = RECEIPT_WIDTH_MM / 25.4 * dpi
+    alto, ancho = img.shape[:2]
+    escala = min(max(ancho_objetivo / ancho, 1 / max_scale), max_scale)
+    if abs(escala - 1) < 0.05:
+        return img
+    interpolacion = cv2.INTER_CUBIC if escala > 1 else cv2.INTER_AREA
+    return cv2.resize(img, (round(ancho * escala), round(alto * escala)), interpolation=interpolacion)
+
+
+def adaptive_threshold(img, block_size=31, c=15):
+    """Binarizar con umbral gaussiano local (iluminación desigual, papel térmico desvaído)"""
+    block_size = int(block_size) | 1  # debe ser impar
+    return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c)
+
+
+def denoise(img, ksize=3):
+    """Filtro de mediana contra el ruido de sal y pimienta"""
+    return cv2.medianBlur(img, int(ksize) | 1)
+
+
+# Pasos disponibles en una receta: nombre -> función(img, *parámetros)
+PREPROCESS_STEPS = {
+    'grayscale': to_grayscale,
+    'contrast': increase_contrast,
+    'crop': crop_to_receipt,
+    'deskew': deskew,
+    'dpi': normalize_dpi,
+    'denoise': denoise,
+    'threshold': adaptive_threshold
+}
+
+
+def parse_recipe(recipe):
+    """'grayscale,dpi:300,threshold:31:15' -> [(nombre, función, parámetros)]"""
+    pasos = []
+    for paso in recipe.split(','):
+        paso = paso.strip()
+        if not paso:
+            continue
+        nombre, *params = paso.split(':')
+        if nombre not in PREPROCESS_STEPS:
+            raise ValueError(f'Paso de preprocesado desconocido: {nombre}')
+        pasos.append((nombre, PREPROCESS_STEPS[nombre], [float(p) for p in params]))
+    return pasos
+
+
+class ReceiptPreprocessor:
+    """Aplica una receta de pasos a una imagen PIL y mide el tiempo de cada paso
+
+    Las operaciones de OpenCV liberan el GIL, así que se puede llamar desde
+    los hilos de la cola de tickets sin bloquear a los hilos web.
+    """
+
+    def __init__(self, recipe=DEFAULT_RECIPE):
+        self.recipe = recipe
+        self.steps = parse_recipe(recipe)
+        self.metrics = {nombre: LatencyRecorder() for nombre, _, _ in self.steps}
+
+    def run(self, image):
+        """Imagen PIL en escala de grises lista para el OCR y tiempos por paso en segundos"""
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        img = np.asarray(image)
+        tiempos = {}
+        for nombre, funcion, params in self.steps:
+            inicio = time.perf_counter()
+            img = funcion(img, *params)
+            tiempos[nombre] = time.perf_counter() - inicio
+            self.metrics[nombre].record(tiempos[nombre])
+        if img.ndim == 3:
+            img = to_grayscale(img)
+        return Image.fromarray(np.ascontiguousarray(img)), tiempos
+
+    def stats(self):
+        return {
+            'receta': self.recipe,
+            'pasos': {nombre: recorder.snapshot() for nombre, recorder in self.metrics.items()}
+        }
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Cuadre automático de un viaje: emparejar gastos con los detalles esperados
+Los importes se comparan en céntimos enteros (sin errores de coma flotante).
+Además de uno a uno, un detalle puede cuadrar con varios gastos que suman su
+importe y un gasto con varios detalles (suma de subconjuntos acotada).
+"""
+
+import os
+from bisect import bisect_left, bisect_right
+from itertools import combinations
+from math import comb
+
+# Diferencia máxima en EUR para emparejar importes que no coinciden al céntimo
+# (redondeos de conversión de moneda, propinas pequeñas...)
+CUADRE_TOLERANCIA = float(os.getenv('CUADRE_TOLERANCIA', '0.05'))
+
+# Diferencia máxima en EUR para los cuadres de varios elementos: un pago dividido
+# suele sumar exacto, y cada céntimo de margen multiplica las sumas casuales
+CUADRE_TOLERANCIA_GRUPOS = float(os.getenv('CUADRE_TOLERANCIA_GRUPOS', '0'))
+
+# Elementos como máximo en la parte "varios" de un cuadre (tickets de un mismo hotel...)
+CUADRE_MAX_GRUPO = int(os.getenv('CUADRE_MAX_GRUPO', '4'))
+
+# Con muchos importes libres casi cualquier cifra es suma de algunos de ellos: si el
+# número esperado de combinaciones que caerían por azar en las ventanas de todos los
+# objetivos de una pasada supera este valor, no se busca (una solución única ahí
+# sería casualidad)
+CUADRE_MAX_AZAR = 0.5
+
+# Límite del DP por bits: piezas x céntimos del objetivo x tamaño de grupo (~25 MB de historia)
+CUADRE_MAX_DP_BITS = 200_000_000
+
+# Candidatos como máximo para meet-in-the-middle cuando el DP no cabe (2^12 sumas por mitad)
+CUADRE_MAX_MITM = 24
+
+
+def to_cents(importe):
+    """Importe en EUR -> céntimos enteros"""
+    return int(round(float(importe) * 100))
+
+
+def match_amounts(gastos, detalles, tolerancia=CUADRE_TOLERANCIA):
+    """Emparejar gastos y detalles de un mismo viaje y usuario
+
+    gastos y detalles son listas de (id, importe_eur) en orden de
+    preferencia: con varios candidatos gana el primero de la lista.
+    Primero se emparejan los importes exactos al céntimo y después, con lo
+    que queda, los más cercanos dentro de la tolerancia (de menor a mayor
+    diferencia). Devuelve [(gasto_id, detalle_id, diferencia_centimos)].
+    """
+    # Índice de detalles por céntimos: importe -> ids en orden de preferencia
+    por_importe = {}
+    for detalle_id, importe in detalles:
+        por_importe.setdefault(to_cents(importe), []).append(detalle_id)
+    for ids in por_importe.values():
+        ids.reverse()  # pop() saca el preferido
+
+    emparejados = []
+    gastos_libres = []
+    for gasto_id, importe in gastos:
+        cents = to_cents(importe)
+        ids = por_importe.get(cents)
+        if ids:
+            emparejados.append((gasto_id, ids.pop(), 0))
+        else:
+            gastos_libres.append((gasto_id, cents))
+
+    tolerancia_cents = to_cents(tolerancia)
+    if not gastos_libres or tolerancia_cents <= 0:
+        return emparejados
+
+    # Detalles sin pareja ordenados por importe; cada gasto busca su ventana con bisect
+    libres = sorted(
+        (cents, orden, detalle_id)
+        for cents, ids in por_importe.items()
+        for orden, detalle_id in enumerate(reversed(ids))
+    )
+    importes = [cents for cents, _, _ in libres]
+    candidatos = []
+    for orden_gasto, (gasto_id, cents) in enumerate(gastos_libres):
+        inicio = bisect_left(importes, cents - tolerancia_cents)
+        fin = bisect_right(importes, cents + tolerancia_cents)
+        for importe, orden, detalle_id in libres[inicio:fin]:
+            candidatos.append((abs(importe - cents), orden_gasto, orden, gasto_id, detalle_id, importe - cents))
+
+    # Voraz por diferencia: cada gasto y cada detalle se usan una sola vez
+    candidatos.sort()
+    gastos_usados, detalles_usados = set(), set()
+    for _, _, _, gasto_id, detalle_id, diferencia in candidatos:
+        if gasto_id in gastos_usados or detalle_id in detalles_usados:
+            continue
+        gastos_usados.add(gasto_id)
+        detalles_usados.add(detalle_id)
+        emparejados.append((gasto_id, detalle_id, diferencia))
+    return emparejados
+
+
+def _window_bits(capa, desde, ancho):
+    return (capa >> desde) & ((1 << ancho) - 1)
+
+
+class _SubsetSums:
+    """Sumas de subconjuntos de piezas (id, céntimos) hasta limite, por capas de bits
+
+    una[k] tiene a 1 las sumas alcanzables con k piezas y dos[k] las que se
+    alcanzan con al menos dos subconjuntos distintos de k piezas. Se calcula
+    una vez y sirve para todos los objetivos hasta que cambian las piezas.
+    """
+
+    def __init__(self, piezas, limite, max_items):
+        self.piezas = [(item_id, cents) for item_id, cents in piezas if 0 < cents <= limite]
+        self.max_items = max_items
+        mascara = (1 << (limite + 1)) - 1
+        una = [1] + [0] * max_items
+        dos = [0] * (max_items + 1)
+        self.historia = []
+        for _, cents in self.piezas:
+            self.historia.append(una[:])
+            for k in range(max_items, 0, -1):
+                nuevas = (una[k - 1] << cents) & mascara
+                dos[k] |= ((dos[k - 1] << cents) & mascara) | (una[k] & nuevas)
+                una[k] |= nuevas
+        self.una, self.dos = una, dos
+
+    def find(self, target, tolerance):
+        """Ids de la única combinación que suma target ± tolerance, o None si no hay o hay varias"""
+        desde = max(target - tolerance, 1)
+        ancho = target + tolerance + 1 - desde
+        solucion = None
+        for k in range(1, self.max_items + 1):
+            bits = _window_bits(self.una[k], desde, ancho)
+            if not bits:
+                continue
+            if solucion or bits & (bits - 1) or _window_bits(self.dos[k], desde, ancho):
+                return None
+            solucion = (k, desde + bits.bit_length() - 1)
+        if solucion is None:
+            return None
+
+        # Reconstrucción: la pieza i se usó si la suma no era alcanzable antes de ella
+        k, suma = solucion
+        elegidos = []
+        for i in range(len(self.historia) - 1, -1, -1):
+            if k == 0:
+                break
+            if not self.historia[i][k] >> suma & 1:
+                item_id, cents = self.piezas[i]
+                elegidos.append(item_id)
+                k -= 1
+                suma -= cents
+        return elegidos[::-1]
+
+
+def _half_sums(mitad, max_items):
+    return [(sum(c for _, c in combo), [i for i, _ in combo])
+            for k in range(max_items + 1) for combo in combinations(mitad, k)]
+
+
+def _subset_sum_mitm(candidatos, target, tolerance, max_items):
+    """Meet-in-the-middle: sumas de cada mitad y búsqueda binaria del complemento"""
+    medio = len(candidatos) // 2
+    izquierda = _half_sums(candidatos[:medio], max_items)
+    derecha = sorted(_half_sums(candidatos[medio:], max_items), key=lambda x: x[0])
+    sumas_derecha = [suma for suma, _ in derecha]
+    soluciones = []
+    for suma, ids in izquierda:
+        inicio = bisect_left(sumas_derecha, target - tolerance - suma)
+        fin = bisect_right(sumas_derecha, target + tolerance - suma)
+        for _, ids_d in derecha[inicio:fin]:
+            elegidos = ids + ids_d
+            if elegidos and len(elegidos) <= max_items:
+                soluciones.append(elegidos)
+                if len(soluciones) > 1:
+                    return None
+    return soluciones[0] if soluciones else None
+
+
+def _fits_dp(piezas, limite, max_items):
+    return len(piezas) * limite * max_items <= CUADRE_MAX_DP_BITS
+
+
+def _too_random(piezas, max_items, tolerance, objetivos=1):
+    """¿Demasiadas combinaciones casuales de max_items piezas en las ventanas de los objetivos?
+
+    Cada ventana mide 2 * tolerance + 1 céntimos; como aproximación, las sumas
+    de k piezas se reparten de manera uniforme sobre k veces la pieza mayor.
+    """
+    mayor = max(cents for _, cents in piezas)
+    azar = comb(len(piezas), max_items) * (2 * tolerance + 1) / (max_items * mayor)
+    return azar * objetivos > CUADRE_MAX_AZAR
+
+
+def subset_sum(items, target, tolerance, max_items=CUADRE_MAX_GRUPO):
+    """Ids de items [(id, céntimos)] cuya suma queda a no más de tolerance de target
+
+    Como mucho max_items elementos. Devuelve None si no hay solución, si hay
+    más de una o si hay tantos candidatos que una solución podría ser casual
+    (elegirla sería adivinar), y también si el problema excede los límites
+    de búsqueda.
+    """
+    limite = target + tolerance
+    candidatos = [(item_id, cents) for item_id, cents in items if 0 < cents <= limite]
+    if not candidatos or sum(cents for _, cents in candidatos) < target - tolerance:
+        return None
+    if _too_random(candidatos, max_items, tolerance):
+        return None
+    if _fits_dp(candidatos, limite, max_items):
+        return _SubsetSums(candidatos, limite, max_items).find(target, tolerance)
+    if len(candidatos) <= CUADRE_MAX_MITM:
+        return _subset_sum_mitm(candidatos, target, tolerance, max_items)
+    return None
+
+
+def _group_by_sum(objetivos, piezas, tolerance, max_items):
+    """Para cada objetivo (de mayor a menor) la única combinación de piezas libres que lo suma
+
+    Las sumas se calculan una vez para todos los objetivos y solo se
+    recalculan cuando un cuadre retira piezas.
+    """
+    grupos = []
+    libres = dict(piezas)
+    tabla = None
+    for objetivo_id, target in sorted(objetivos.items(), key=lambda x: -x[1]):
+        limite = target + tolerance
+        if tabla is None:
+            candidatos = [(item_id, cents) for item_id, cents in libres.items() if 0 < cents <= limite]
+            if not candidatos or _too_random(candidatos, max_items, tolerance, len(objetivos)):
+                continue
+            if _fits_dp(candidatos, limite, max_items):
+                tabla = _SubsetSums(candidatos, limite, max_items)
+        # Los objetivos van de mayor a menor: la tabla del primero sirve para los siguientes
+        if tabla is not None:
+            elegidos = tabla.find(target, tolerance)
+        else:
+            elegidos = subset_sum(list(libres.items()), target, tolerance, max_items)
+        if elegidos:
+            grupos.append((objetivo_id, elegidos, sum(libres[i] for i in elegidos) - target))
+            for item_id in elegidos:
+                del libres[item_id]
+            tabla = None
+    return grupos
+
+
+def solve(gastos, detalles, tolerancia=CUADRE_TOLERANCIA, max_items=CUADRE_MAX_GRUPO,
+          tolerancia_grupos=CUADRE_TOLERANCIA_GRUPOS, conceptos=None):
+    """Cuadre completo de un viaje y usuario
+
+    Uno a uno (match_amounts) y después, por tamaño de grupo creciente,
+    detalles cubiertos por varios gastos y gastos que cubren varios
+    detalles. Los varios gastos de un detalle se buscan entre gastos del
+    mismo concepto (conceptos: gasto_id -> concepto), lo que reduce mucho
+    las combinaciones casuales. Devuelve grupos
+    {'gastos': [ids], 'detalles': [ids], 'diferencia': céntimos detalles - gastos}.
+    """
+    grupos = [{'gastos': [gasto_id], 'detalles': [detalle_id], 'diferencia': diferencia}
+              for gasto_id, detalle_id, diferencia in match_amounts(gastos, detalles, tolerancia)]
+    usados_g = {gasto_id for grupo in grupos for gasto_id in grupo['gastos']}
+    usados_d = {detalle_id for grupo in grupos for detalle_id in grupo['detalles']}
+    gastos_libres = {gasto_id: to_cents(importe) for gasto_id, importe in gastos if gasto_id not in usados_g}
+    detalles_libres = {detalle_id: to_cents(importe) for detalle_id, importe in detalles if detalle_id not in usados_d}
+    tolerancia_cents = to_cents(tolerancia_grupos)
+    conceptos = conceptos or {}
+
+    # Grupos de 2 elementos para todos los importes antes que de 3, etc.: cuantos
+    # más elementos, más combinaciones suman por casualidad cualquier importe
+    for tamano in range(2, max_items + 1):
+        # Varios gastos -> un detalle (el importe esperado del hotel pagado en varios tickets)
+        for concepto in sorted({conceptos.get(gasto_id) for gasto_id in gastos_libres}, key=str):
+            piezas = {gasto_id: cents for gasto_id, cents in gastos_libres.items()
+                      if conceptos.get(gasto_id) == concepto}
+            for detalle_id, elegidos, exceso in _group_by_sum(detalles_libres, piezas, tolerancia_cents, tamano):
+                grupos.append({'gastos': elegidos, 'detalles': [detalle_id], 'diferencia': -exceso})
+                del detalles_libres[detalle_id]
+                for gasto_id in elegidos:
+                    del gastos_libres[gasto_id]
+
+        # Un gasto -> varios detalles (un ticket que cubre varios conceptos esperados)
+        for gasto_id, elegidos, exceso in _group_by_sum(gastos_libres, detalles_libres, tolerancia_cents, tamano):
+            grupos.append({'gastos': [gasto_id], 'detalles': elegidos, 'diferencia': exceso})
+            del gastos_libres[gasto_id]
+            for detalle_id in elegidos:
+                del detalles_libres[detalle_id]
+    return grupos
+
+
+# ------------------------------------------------------ enlaces en la base de datos
+
+def _placeholders(ids):
+    return ','.join('?' * len(ids))
+
+
+def save_groups(cursor, grupos):
+    """Guardar los enlaces de los grupos y marcar sus gastos y detalles como cuadrados"""
+    enlaces = [(gasto_id, detalle_id) for grupo in grupos
+               for gasto_id in grupo['gastos'] for detalle_id in grupo['detalles']]
+    if not enlaces:
+        return
+    cursor.executemany('INSERT OR IGNORE INTO cuadre_enlaces (gasto_id, detalle_id) VALUES (?, ?)', enlaces)
+    cursor.executemany('UPDATE viaje_detalles SET cuadrado = TRUE WHERE id = ?',
+                       [(detalle_id,) for detalle_id in {d for _, d in enlaces}])
+    cursor.executemany('UPDATE gastos SET detalle_cuadrado = TRUE WHERE id = ?',
+                       [(gasto_id,) for gasto_id in {g for g, _ in enlaces}])
+
+
+def unlink(cursor, gasto_ids=(), detalle_ids=()):
+    """Deshacer los cuadres en los que participan estos gastos o detalles
+
+    Un cuadre de varios elementos se deshace entero: si se borra uno de los
+    tickets del hotel, el detalle y los demás tickets vuelven a pendientes.
+    Devuelve (gastos, detalles) afectados.
+    """
+    gastos, detalles = set(gasto_ids), set(detalle_ids)
+    nuevos_g, nuevos_d = set(gastos), set(detalles)
+    while nuevos_g or nuevos_d:
+        enlazados_d, enlazados_g = set(), set()
+        if nuevos_g:
+            cursor.execute(f'SELECT detalle_id FROM cuadre_enlaces WHERE gasto_id IN ({_placeholders(nuevos_g)})',
+                           tuple(nuevos_g))
+            enlazados_d = {row[0] for row in cursor.fetchall()}
+        if nuevos_d:
+            cursor.execute(f'SELECT gasto_id FROM cuadre_enlaces WHERE detalle_id IN ({_placeholders(nuevos_d)})',
+                           tuple(nuevos_d))
+            enlazados_g = {row[0] for row in cursor.fetchall()}
+        nuevos_g, nuevos_d = enlazados_g - gastos, enlazados_d - detalles
+        gastos |= nuevos_g
+        detalles |= nuevos_d
+
+    if gastos:
+        ids = tuple(gastos)
+        cursor.execute(f'DELETE FROM cuadre_enlaces WHERE gasto_id IN ({_placeholders(ids)})', ids)
+        cursor.execute(f'UPDATE gastos SET detalle_cuadrado = FALSE WHERE id IN ({_placeholders(ids)})', ids)
+    if detalles:
+        ids = tuple(detalles)
+        cursor.execute(f'DELETE FROM cuadre_enlaces WHERE detalle_id IN ({_placeholders(ids)})', ids)
+        cursor.execute(f'UPDATE viaje_detalles SET cuadrado = FALSE WHERE id IN ({_placeholders(ids)})', ids)
+    return gastos, detalles
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de la paginación por cursor de GET /api/gastos, incluidos gastos
+antiguos sin created_at
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+_tmpdir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = os.path.join(_tmpdir, 'gastos.db')
+os.environ['UPLOAD_FOLDER'] = os.path.join(_tmpdir, 'uploads')
+
+import app as gastos_app  # noqa: E402  (después de elegir la base de datos)
+
+
+def tearDownModule():
+    gastos_app.shutdown_background_work()
+    gastos_app.db_pool.close_all()
+    shutil.rmtree(_tmpdir, ignore_errors=True)
+
+
+class GastosPaginationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        gastos_app.init_db()
+        conn = sqlite3.connect(os.environ['DATABASE_URL'])
+        filas = [
+            # (fecha, created_at): empates de fecha con y sin created_at
+            ('2025-03-01', '2025-03-01 10:00:00'),
+            ('2025-03-01', None),
+            ('2025-03-01', None),
+            ('2025-03-01', '2025-03-01 09:00:00'),
+            ('2025-02-15', None),
+            ('2025-02-10', '2025-02-10 08:00:00'),
+            ('2025-02-10', None),
+        ]
+        conn.executemany(
+            "INSERT INTO gastos (fecha, concepto, importe_eur, usuario, created_at) VALUES (?, 'Otros', 1, 'paul', ?)",
+            filas)
+        conn.commit()
+        conn.close()
+        cls.total = len(filas)
+
+    def setUp(self):
+        self.client = gastos_app.app.test_client()
+        response = self.client.post('/login', data={'username': 'paul', 'password': 'paul'})
+        self.assertEqual(response.status_code, 302)
+
+    def _paginar(self, limit):
+        ids, cursor = [], None
+        while True:
+            url = f'/api/gastos?limit={limit}' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [gasto['id'] for gasto in response.get_json()]
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return ids
+
+    def test_paginas_igual_que_listado_completo(self):
+        completo = [gasto['id'] for gasto in self.client.get('/api/gastos').get_json()]
+        self.assertEqual(len(completo), self.total)
+        for limit in (1, 2, 3, self.total):
+            with self.subTest(limit=limit):
+                self.assertEqual(self._paginar(limit), completo)
+
+    def test_orden_sin_created_at_al_final_de_su_fecha(self):
+        gastos = self.client.get('/api/gastos?fecha_inicio=2025-03-01').get_json()
+        self.assertEqual([g['created_at'] for g in gastos],
+                         ['2025-03-01 10:00:00', '2025-03-01 09:00:00', None, None])
+
+    def test_cursor_no_valido(self):
+        self.assertEqual(self.client.get('/api/gastos?limit=2&cursor=zzz').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas de reintentos del cliente LLM contra un servidor HTTP local que
+responde 429/503 antes de dar la respuesta buena
+"""
+
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_client import LLMClient, LLMError
+
+RESPUESTA_OK = {
+    'choices': [{'message': {'content': ' {"amount": 12.5} '}}],
+    'usage': {'prompt_tokens': 10, 'completion_tokens': 5}
+}
+
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    """Responde con la siguiente respuesta del guion del servidor y apunta la hora"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.llegadas.append(time.perf_counter())
+            status, headers = server.guion.pop(0) if server.guion else (200, {})
+        body = json.dumps(RESPUESTA_OK if status == 200 else {'error': 'ocupado'}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for nombre, valor in headers.items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LLMClientRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _LLMHandler)
+        self.server.lock = threading.Lock()
+        self.server.llegadas = []
+        self.server.guion = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        self.client = LLMClient('clave', base_url=f'http://{host}:{port}/v1',
+                                max_retries=3, backoff_base=0.01, backoff_max=8.0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reintenta_429_y_503_respetando_retry_after(self):
+        self.server.guion = [(429, {'Retry-After': '1'}), (503, {})]
+        self.assertEqual(self.client.chat([{'role': 'user', 'content': 'hola'}]), '{"amount": 12.5}')
+
+        llegadas = self.server.llegadas
+        self.assertEqual(len(llegadas), 3)
+        self.assertGreaterEqual(llegadas[1] - llegadas[0], 1.0)
+        # Sin Retry-After: backoff exponencial corto (base 0.01)
+        self.assertLess(llegadas[2] - llegadas[1], 1.0)
+
+        stats = self.client.stats()
+        self.assertEqual(stats['counters']['reintentos'], 2)
+        self.assertEqual(stats['counters']['http_429'], 1)
+        self.assertEqual(stats['counters']['http_503'], 1)
+        self.assertEqual(stats['counters']['ok'], 1)
+        self.assertEqual(stats['counters']['tokens_entrada'], 10)
+
+    def test_retry_after_limitado_por_backoff_max(self):
+        self.client.backoff_max = 0.2
+        self.server.guion = [(429, {'Retry-After': '120'})]
+        inicio = time.perf_counter()
+        self.client.chat([{'role': 'user', 'content': 'hola'}])
+        self.assertLess(time.perf_counter() - inicio, 5)
+        self.assertEqual(len(self.server.llegadas), 2)
+
+    def test_agota_reintentos(self):
+        self.server.guion = [(503, {})] * 10
+        with self.assertRaises(LLMError) as ctx:
+            self.client.chat([{'role': 'user', 'content': 'hola'}])
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertEqual(len(self.server.llegadas), self.client.max_retries + 1)
+        self.assertEqual(self.client.stats()['counters']['fallos'], 1)
+
+    def test_no_reintenta_errores_del_cliente(self):
+        self.server.guion = [(400, {})]
+        with self.assertRaises(LLMError) as ctx:
+            self.client.chat([{'role': 'user', 'content': 'hola'}])
+        self.assertEqual(ctx.exception.status_code, 400)
+        self.assertEqual(len(self.server.llegadas), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
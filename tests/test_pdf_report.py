@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del PDF por páginas: falla si una versión de reportlab rompe
+_IncrementalDocTemplate (usa métodos internos de BaseDocTemplate)
+"""
+
+import io
+import unittest
+from unittest import mock
+
+import pdf_report
+from pdf_report import PdfReport, check_incremental_build
+
+
+class IncrementalBuildTest(unittest.TestCase):
+
+    def test_una_pagina(self):
+        check_incremental_build()
+
+    def test_api_interna_desaparecida(self):
+        with mock.patch.object(pdf_report, 'BaseDocTemplate', object):
+            with self.assertRaisesRegex(RuntimeError, 'faltan _startBuild'):
+                check_incremental_build()
+
+    def test_pdf_incompleto(self):
+        with mock.patch.object(pdf_report._IncrementalDocTemplate, 'end', lambda self: None):
+            with self.assertRaisesRegex(RuntimeError, 'no es un PDF completo'):
+                check_incremental_build()
+
+    def test_informe_varias_paginas(self):
+        buf = io.BytesIO()
+        report = PdfReport(buf, 'Gastos', ['Periodo: 2025'], ['Fecha', 'Importe'], [80, 80],
+                           rows_per_chunk=20)
+        for i in range(120):
+            report.add_rows([[f'2025-01-{i % 28 + 1:02d}', f'{i:.2f}']])
+            report.add_subtotal('Viaje', 'Otros', i)
+        report.finish()
+        data = buf.getvalue()
+        self.assertTrue(data.startswith(b'%PDF-'))
+        self.assertTrue(data.rstrip().endswith(b'%%EOF'))
+        self.assertEqual(report.rows, 120)
+        self.assertGreater(report.doc.page, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
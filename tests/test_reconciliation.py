@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del cuadre automático: uno a uno, suma de subconjuntos (DP por bits
+y meet-in-the-middle contra fuerza bruta) y abstención ante ambigüedad
+"""
+
+import random
+import unittest
+from itertools import combinations
+from unittest import mock
+
+import reconciliation
+from reconciliation import match_amounts, solve, subset_sum, to_cents
+
+
+def _fuerza_bruta(items, target, tolerance, max_items):
+    soluciones = [sorted(i for i, _ in combo)
+                  for k in range(1, max_items + 1) for combo in combinations(items, k)
+                  if abs(sum(c for _, c in combo) - target) <= tolerance]
+    return soluciones[0] if len(soluciones) == 1 else None
+
+
+class MatchAmountsTest(unittest.TestCase):
+
+    def test_centimos_sin_error_de_coma_flotante(self):
+        self.assertEqual(to_cents(0.1 + 0.2), 30)
+        self.assertEqual(to_cents('12.345'), 1234)
+
+    def test_exactos_primero_y_en_orden_de_preferencia(self):
+        gastos = [(1, 10.0), (2, 10.0), (3, 25.0)]
+        detalles = [(10, 10.0), (11, 10.0), (12, 25.0)]
+        self.assertEqual(sorted(match_amounts(gastos, detalles)),
+                         [(1, 10, 0), (2, 11, 0), (3, 12, 0)])
+
+    def test_tolerancia_por_menor_diferencia(self):
+        gastos = [(1, 20.03), (2, 20.01)]
+        detalles = [(10, 20.00)]
+        self.assertEqual(match_amounts(gastos, detalles, tolerancia=0.05), [(2, 10, -1)])
+
+    def test_fuera_de_tolerancia(self):
+        self.assertEqual(match_amounts([(1, 20.10)], [(10, 20.00)], tolerancia=0.05), [])
+
+
+class SubsetSumTest(unittest.TestCase):
+
+    def test_solucion_unica(self):
+        items = [(1, 4500), (2, 3000), (3, 1234), (4, 999)]
+        self.assertEqual(sorted(subset_sum(items, 5499, 0)), [1, 4])
+
+    def test_ambigua_no_se_elige(self):
+        # 300 = 300 = 100 + 200
+        self.assertIsNone(subset_sum([(1, 100), (2, 200), (3, 300)], 300, 0))
+        # Dos gastos iguales: cualquiera de los dos valdría
+        self.assertIsNone(subset_sum([(1, 500), (2, 500), (3, 700)], 1200, 0))
+
+    def test_sin_solucion(self):
+        self.assertIsNone(subset_sum([(1, 100), (2, 250)], 300, 0))
+        self.assertIsNone(subset_sum([(1, 100), (2, 150)], 1000, 0))
+
+    def test_max_items(self):
+        items = [(1, 100), (2, 200), (3, 400)]
+        self.assertIsNone(subset_sum(items, 700, 0, max_items=2))
+        self.assertEqual(sorted(subset_sum(items, 700, 0, max_items=3)), [1, 2, 3])
+
+    def test_demasiados_candidatos_se_abstiene(self):
+        rng = random.Random(3)
+        items = [(i, rng.randint(1000, 5000)) for i in range(60)]
+        objetivo = items[0][1] + items[1][1] + items[2][1]
+        self.assertIsNone(subset_sum(items, objetivo, 0, max_items=3))
+
+    def test_dp_y_mitm_igual_que_fuerza_bruta(self):
+        rng = random.Random(7)
+        with mock.patch.object(reconciliation, 'CUADRE_MAX_AZAR', float('inf')):
+            for _ in range(300):
+                items = [(i, rng.randint(1, 60)) for i in range(rng.randint(1, 9))]
+                target = rng.randint(1, 150)
+                tolerance = rng.choice((0, 0, 1, 2))
+                max_items = rng.randint(1, 4)
+                esperado = _fuerza_bruta(items, target, tolerance, max_items)
+                dp = subset_sum(items, target, tolerance, max_items)
+                with mock.patch.object(reconciliation, 'CUADRE_MAX_DP_BITS', 0):
+                    mitm = subset_sum(items, target, tolerance, max_items)
+                self.assertEqual(sorted(dp) if dp else None, esperado, (items, target, tolerance, max_items))
+                self.assertEqual(sorted(mitm) if mitm else None, esperado, (items, target, tolerance, max_items))
+
+
+class SolveTest(unittest.TestCase):
+
+    def test_uno_a_uno_y_grupos(self):
+        gastos = [(1, 30.00), (2, 120.00), (3, 80.50), (4, 55.25)]
+        detalles = [(10, 30.00), (11, 200.50), (12, 40.00), (13, 15.25)]
+        conceptos = {2: 'Alojamiento', 3: 'Alojamiento', 4: 'Restaurante'}
+        grupos = solve(gastos, detalles, conceptos=conceptos)
+        normalizados = sorted((sorted(g['gastos']), sorted(g['detalles']), g['diferencia']) for g in grupos)
+        self.assertEqual(normalizados, [
+            ([1], [10], 0),
+            # El hotel pagado en dos tickets
+            ([2, 3], [11], 0),
+            # Un ticket que cubre dos detalles
+            ([4], [12, 13], 0),
+        ])
+
+    def test_varios_gastos_solo_del_mismo_concepto(self):
+        gastos = [(1, 60.00), (2, 40.00)]
+        detalles = [(10, 100.00)]
+        self.assertEqual(solve(gastos, detalles, conceptos={1: 'Alojamiento', 2: 'Restaurante'}), [])
+        self.assertEqual(len(solve(gastos, detalles, conceptos={1: 'Alojamiento', 2: 'Alojamiento'})), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Pruebas del Excel en streaming: las celdas numéricas deben ser XML válido
+para Excel (sin inf ni nan)
+"""
+
+import io
+import unittest
+import zipfile
+
+from xlsx_stream import XlsxStreamWriter
+
+
+class XlsxStreamWriterTest(unittest.TestCase):
+
+    def _sheet(self, values):
+        writer = XlsxStreamWriter()
+        writer.append(values)
+        buf = io.BytesIO()
+        writer.save(buf)
+        writer.close()
+        with zipfile.ZipFile(io.BytesIO(buf.getvalue())) as zf:
+            return zf.read('xl/worksheets/sheet1.xml').decode('utf-8')
+
+    def test_numeros(self):
+        sheet = self._sheet([1, 2.5, True])
+        self.assertIn('<c r="A1"><v>1</v></c>', sheet)
+        self.assertIn('<c r="B1"><v>2.5</v></c>', sheet)
+        self.assertIn('<t>Sí</t>', sheet)
+
+    def test_no_finitos_quedan_vacios(self):
+        sheet = self._sheet([float('inf'), float('nan'), -float('inf'), 3.0])
+        for texto in ('inf', 'nan'):
+            self.assertNotIn(texto, sheet)
+        self.assertNotIn('r="A1"', sheet)
+        self.assertIn('<c r="D1"><v>3.0</v></c>', sheet)
+
+
+if __name__ == '__main__':
+    unittest.main()
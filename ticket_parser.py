@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Extracción de datos de tickets a partir del texto OCR
+Patrones compilados una sola vez al importar el módulo: una pasada para
+importes, otra para fechas y otra para las palabras clave de conceptos
+
+Las pasadas de importes y palabras clave prueban cada posición del texto
+(lookahead), así que las coincidencias se solapan. Para conceptos el
+resultado es el mismo que buscar cada palabra clave como subcadena. Para
+importes, cuando dos números se pisan ("3.46,835") ahora se consideran
+todos y gana el mayor (46,83); la versión anterior, sin solapes, se quedaba
+con el primero que encontraba (3,46)
+"""
+
+import re
+from datetime import date, datetime
+
+# Palabras clave por concepto (el orden decide los empates de puntuación)
+ESTABLISHMENT_KEYWORDS = {
+    'Restaurante': [
+        'restaurante', 'bar', 'cafe', 'cafeteria', 'taberna', 'tapas', 'comida', 'menú',
+        'pizzeria', 'hamburgueseria', 'marisqueria', 'asador', 'braseria', 'cerveceria',
+        'tasca', 'bistro', 'gastrobar', 'parrilla', 'cocina', 'burger', 'pizza'
+    ],
+    'Transporte': [
+        'taxi', 'uber', 'cabify', 'metro', 'bus', 'tren', 'avión', 'vuelo', 'parking',
+        'aparcamiento', 'peaje', 'renfe', 'aena', 'aeropuerto', 'estacion', 'transport'
+    ],
+    'Alojamiento': [
+        'hotel', 'hostal', 'apartamento', 'alojamiento', 'booking', 'pension', 'resort',
+        'motel', 'airbnb', 'hospedaje', 'lodge', 'inn'
+    ],
+    'Combustible': [
+        'gasolina', 'diesel', 'combustible', 'repsol', 'cepsa', 'bp', 'shell', 'galp',
+        'petronor', 'esso', 'fuel', 'gas', 'carburante'
+    ],
+    'Compras': [
+        'supermercado', 'tienda', 'shop', 'centro comercial', 'farmacia', 'mercadona',
+        'carrefour', 'dia', 'lidl', 'alcampo', 'corte inglés', 'market', 'store'
+    ],
+    'Entretenimiento': [
+        'cine', 'teatro', 'concierto', 'museo', 'parque', 'discoteca', 'pub', 'club'
+    ],
+    'Salud': [
+        'farmacia', 'hospital', 'clinica', 'médico', 'dentista', 'veterinario', 'óptica'
+    ],
+    'Tecnología': [
+        'mediamarkt', 'fnac', 'apple', 'samsung', 'phone house', 'tech', 'electronics'
+    ]
+}
+
+# Rango razonable de un importe de ticket
+MAX_AMOUNT_CENTS = 999999
+
+# Cualquier número con dos decimales, probado en cada posición (lookahead): las
+# coincidencias se solapan, así "0,1234.12" da también 1234.12 y no solo 0,12 y 34.12
+AMOUNT_RE = re.compile(r'(?=(\d+)[.,](\d{2}))')
+
+# Contexto que marca un número como importe: "total", "importe", "suma" o "€"
+# justo delante, o "€"/"eur" justo detrás
+AMOUNT_PREFIX_RE = re.compile(r'(?:(?:total|importe|suma)[:\s]*€?|€)\s*$', re.IGNORECASE)
+AMOUNT_SUFFIX_RE = re.compile(r'\s*(?:€|eur)', re.IGNORECASE)
+
+MONTHS = {
+    'enero': 1, 'ene': 1, 'january': 1, 'jan': 1,
+    'febrero': 2, 'feb': 2, 'february': 2,
+    'marzo': 3, 'mar': 3, 'march': 3,
+    'abril': 4, 'abr': 4, 'april': 4, 'apr': 4,
+    'mayo': 5, 'may': 5,
+    'junio': 6, 'jun': 6, 'june': 6,
+    'julio': 7, 'jul': 7, 'july': 7,
+    'agosto': 8, 'ago': 8, 'august': 8, 'aug': 8,
+    'septiembre': 9, 'setiembre': 9, 'sep': 9, 'sept': 9, 'september': 9,
+    'octubre': 10, 'oct': 10, 'october': 10,
+    'noviembre': 11, 'nov': 11, 'november': 11,
+    'diciembre': 12, 'dic': 12, 'december': 12, 'dec': 12
+}
+
+# Fechas año-mes-día, día-mes-año (año de 2 o 4 cifras) y "12 de marzo de 2024"
+DATE_RE = re.compile(r'''
+    (?<!\d)(?P<y1>\d{4})[/.-](?P<m1>\d{1,2})[/.-](?P<d1>\d{1,2})(?!\d)
+  | (?<!\d)(?P<d2>\d{1,2})[/.-](?P<m2>\d{1,2})[/.-](?P<y2>\d{4}|\d{2})(?!\d)
+  | (?<!\d)(?P<d3>\d{1,2})\s+(?:de\s+)?(?P<mes>%s)\.?\s+(?:de\s+)?(?P<y3>\d{4})(?!\d)
+''' % '|'.join(sorted(MONTHS, key=len, reverse=True)), re.IGNORECASE | re.VERBOSE)
+
+# Líneas que son solo números o fechas (no sirven como descripción)
+NUMERIC_LINE_RE = re.compile(r'^[\d\s/.-]+$')
+
+
+def _trie_pattern(words):
+    """Alternancia de palabras factorizada por prefijos comunes (un trie en forma de regex)
+
+    Así el motor de re solo prueba, en cada posición, las ramas que empiezan
+    por el carácter actual en lugar de las ~90 palabras una tras otra.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        ramas = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not ramas:
+            return ''
+        patron = ramas[0] if len(ramas) == 1 else '(?:' + '|'.join(ramas) + ')'
+        # Si una palabra termina aquí el resto es opcional (greedy: gana la más larga)
+        return '(?:' + patron + ')?' if '' in node else patron
+
+    return build(trie)
+
+
+_KEYWORDS = sorted({kw for kws in ESTABLISHMENT_KEYWORDS.values() for kw in kws})
+# Lookahead: en cada posición del texto la palabra clave más larga que empieza ahí,
+# aunque se solape con la anterior ("dentistapas" contiene "dentista" y "tapas")
+KEYWORD_RE = re.compile('(?=(' + _trie_pattern(_KEYWORDS) + '))')
+
+# Al encontrar "gasolina" cuentan también las palabras clave que empiezan dentro
+# de ella y no son la más larga de su posición ("gas"); junto con la pasada
+# solapada, el resultado es el de buscar cada palabra clave como subcadena
+_KEYWORDS_CONTAINED = {kw: frozenset(other for other in _KEYWORDS if other in kw) for kw in _KEYWORDS}
+
+# Conceptos de cada palabra clave ("farmacia" puntúa en Compras y Salud)
+_KEYWORD_CONCEPTS = {}
+for _concept, _keywords in ESTABLISHMENT_KEYWORDS.items():
+    for _keyword in _keywords:
+        _KEYWORD_CONCEPTS.setdefault(_keyword, []).append(_concept)
+_CONCEPT_ORDER = {concept: i for i, concept in enumerate(ESTABLISHMENT_KEYWORDS)}
+
+
+def find_amount(text):
+    """Mayor importe del ticket dentro del rango razonable (o None)"""
+    best = 0
+    for match in AMOUNT_RE.finditer(text):
+        entero, decimales = match.groups()
+        # Sin contexto solo cuentan las tres últimas cifras ("1234,56" -> 234,56)
+        cents = int(entero[-3:]) * 100 + int(decimales)
+        # Con contexto de importe se acepta el número completo ("total 1234,56"),
+        # nunca el final de una cifra más larga ("4983,88" dentro de "84983,88")
+        inicio = match.start(1)
+        if len(entero) > 3 and not (inicio and text[inicio - 1].isdigit()) and (
+                AMOUNT_PREFIX_RE.search(text, max(0, inicio - 16), inicio)
+                or AMOUNT_SUFFIX_RE.match(text, match.end(2))):
+            full = int(entero) * 100 + int(decimales)
+            if full <= MAX_AMOUNT_CENTS:
+                cents = max(cents, full)
+        if cents > best:
+            best = cents
+    return best / 100 if best else None
+
+
+def find_date(text):
+    """Primera fecha válida del texto en formato YYYY-MM-DD (o None)"""
+    for match in DATE_RE.finditer(text):
+        if match.group('y1'):
+            year, month, day = int(match.group('y1')), int(match.group('m1')), int(match.group('d1'))
+        elif match.group('y2'):
+            year, month, day = int(match.group('y2')), int(match.group('m2')), int(match.group('d2'))
+            if year < 100:
+                year += 2000
+        else:
+            year, month, day = int(match.group('y3')), MONTHS[match.group('mes').lower()], int(match.group('d3'))
+        try:
+            return date(year, month, day).isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def find_description(text):
+    """Primera línea con longitud de nombre de establecimiento que no sea solo números"""
+    for line in text.split('\n'):
+        line = line.strip()
+        if 3 < len(line) < 50 and not NUMERIC_LINE_RE.match(line):
+            return line
+    return None
+
+
+def find_concept(text):
+    """Concepto con más palabras clave distintas presentes en el texto (o None)"""
+    found = set()
+    for match in KEYWORD_RE.finditer(text.lower()):
+        found |= _KEYWORDS_CONTAINED[match.group(1)]
+    if not found:
+        return None
+
+    scores = {}
+    for keyword in found:
+        for concept in _KEYWORD_CONCEPTS[keyword]:
+            scores[concept] = scores.get(concept, 0) + 1
+    # Mayor puntuación; a igualdad, el primero en ESTABLISHMENT_KEYWORDS
+    return min(scores, key=lambda concept: (-scores[concept], _CONCEPT_ORDER[concept]))
+
+
+def parse_ticket_text(text):
+    """Extraer importe, fecha, descripción y concepto del texto OCR de un ticket"""
+    info = {}
+
+    # Si no hay texto, usar la fecha actual y el concepto por defecto
+    if not text or len(text.strip()) < 5:
+        info['date'] = datetime.now().strftime('%Y-%m-%d')
+        info['concept'] = 'Otros'
+        return info
+
+    amount = find_amount(text)
+    if amount is not None:
+        info['amount'] = amount
+
+    fecha = find_date(text)
+    if fecha:
+        info['date'] = fecha
+
+    description = find_description(text)
+    if description:
+        info['description'] = description
+
+    concept = find_concept(text)
+    if concept:
+        info['concept'] = concept
+
+    return info
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Punto de entrada WSGI de producción
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Procesos, hilos y tiempos de espera en gunicorn.conf.py
+"""
+
+from app import create_app
+
+app = application = create_app()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Escritura de Excel (XLSX) en streaming para las exportaciones
+Las filas se serializan según llegan a un fichero temporal (memoria acotada)
+y los anchos de columna se calculan con un máximo acumulado mientras se escriben
+"""
+
+import math
+import re
+import tempfile
+from xml.sax.saxutils import escape
+
+from zip_stream import stream_zip
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Filas serializadas que se mantienen en memoria antes de pasar a disco
+XLSX_SPOOL_MEMORY = 1024 * 1024
+
+# Caracteres de control que no admite XML (pueden venir del texto OCR)
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Estilos con nombre compartidos por todas las celdas: nombre -> índice en cellXfs
+NAMED_STYLES = {
+    'Normal': 0,
+    'Encabezado': 1,
+    'Importe': 2
+}
+
+_STYLES_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="#,##0.00"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill><fill><patternFill patternType="solid"><fgColor rgb="FFCCCCCC"/><bgColor rgb="FFCCCCCC"/></patternFill></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="3">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>
+<xf numFmtId="0" fontId="1" fillId="2" borderId="0" applyFont="1" applyFill="1" applyAlignment="1"><alignment horizontal="center"/></xf>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" applyNumberFormat="1"/>
+</cellStyleXfs>
+<cellXfs count="3">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="1" applyFont="1" applyFill="1" applyAlignment="1"><alignment horizontal="center"/></xf>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="2" applyNumberFormat="1"/>
+</cellXfs>
+<cellStyles count="3"><cellStyle name="Normal" xfId="0" builtinId="0"/><cellStyle name="Encabezado" xfId="1"/><cellStyle name="Importe" xfId="2"/></cellStyles>
+</styleSheet>'''
+
+_CONTENT_TYPES_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>'''
+
+_ROOT_RELS_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+_WORKBOOK_RELS_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>'''
+
+_WORKBOOK_XML = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{title}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+
+
+def column_letter(index):
+    """Letra de columna de Excel para un índice empezando en 1 (1 -> A, 28 -> AB)"""
+    letters = ''
+    while index:
+        index, resto = divmod(index - 1, 26)
+        letters = chr(65 + resto) + letters
+    return letters
+
+
+class XlsxStreamWriter:
+    """Libro de una sola hoja escrito fila a fila (solo escritura)
+
+    append() serializa la fila al momento; save() o iter_chunks() montan el
+    XLSX con la sección <cols> calculada a partir del máximo acumulado.
+    """
+
+    def __init__(self, title='Hoja1', max_width=50):
+        self.title = title
+        self.max_width = max_width
+        self.widths = []
+        self.rows = 0
+        self._letters = []
+        self._spool = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MEMORY)
+
+    def append(self, values, styles=None):
+        """Añadir una fila; styles es un nombre de NAMED_STYLES o una lista por columna"""
+        self.rows += 1
+        if len(values) > len(self.widths):
+            self.widths.extend([0] * (len(values) - len(self.widths)))
+            self._letters = [column_letter(i + 1) for i in range(len(self.widths))]
+
+        row = self.rows
+        cells = []
+        for i, value in enumerate(values):
+            if value is None or value == '':
+                continue
+            style = styles[i] if isinstance(styles, (list, tuple)) else styles
+            s = f' s="{NAMED_STYLES[style]}"' if style else ''
+            ref = f'{self._letters[i]}{row}'
+            if isinstance(value, bool):
+                text = 'Sí' if value else 'No'
+                cells.append(f'<c r="{ref}"{s} t="inlineStr"><is><t>{text}</t></is></c>')
+            elif isinstance(value, float) and not math.isfinite(value):
+                # Excel no admite inf ni nan en una celda numérica: se deja vacía
+                continue
+            elif isinstance(value, (int, float)):
+                text = repr(float(value)) if isinstance(value, float) else str(int(value))
+                cells.append(f'<c r="{ref}"{s}><v>{text}</v></c>')
+            else:
+                text = str(value)
+                cells.append(f'<c r="{ref}"{s} t="inlineStr"><is><t xml:space="preserve">'
+                             f'{escape(_INVALID_XML_CHARS.sub("", text))}</t></is></c>')
+            if len(text) > self.widths[i]:
+                self.widths[i] = len(text)
+
+        self._spool.write(f'<row r="{row}">{"".join(cells)}</row>'.encode('utf-8'))
+
+    def _sheet_chunks(self, chunk_size=64 * 1024):
+        cols = ''.join(
+            f'<col min="{i}" max="{i}" width="{min(width + 2, self.max_width)}" customWidth="1"/>'
+            for i, width in enumerate(self.widths, 1)
+        )
+        yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+               '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+               + (f'<cols>{cols}</cols>' if cols else '') + '<sheetData>').encode('utf-8')
+        self._spool.seek(0)
+        while True:
+            block = self._spool.read(chunk_size)
+            if not block:
+                break
+            yield block
+        yield b'</sheetData></worksheet>'
+
+    def entries(self):
+        """Partes del paquete XLSX como entradas de stream_zip"""
+        return [
+            ('[Content_Types].xml', _CONTENT_TYPES_XML.encode('utf-8')),
+            ('_rels/.rels', _ROOT_RELS_XML.encode('utf-8')),
+            ('xl/workbook.xml', _WORKBOOK_XML.format(title=escape(self.title, {'"': '&quot;'})).encode('utf-8')),
+            ('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS_XML.encode('utf-8')),
+            ('xl/styles.xml', _STYLES_XML.encode('utf-8')),
+            ('xl/worksheets/sheet1.xml', self._sheet_chunks())
+        ]
+
+    def iter_chunks(self):
+        """El XLSX en trozos de bytes, para una respuesta en streaming"""
+        try:
+            yield from stream_zip(self.entries())
+        finally:
+            self.close()
+
+    def save(self, fileobj):
+        """Escribir el XLSX en un fichero abierto o un BytesIO"""
+        for chunk in self.iter_chunks():
+            fileobj.write(chunk)
+
+    def close(self):
+        self._spool.close()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Escritura de ZIP en streaming para las exportaciones
+El archivo se genera en trozos que se envían directamente en la respuesta,
+sin directorios temporales ni copia completa en memoria
+"""
+
+import os
+import time
+import zipfile
+
+# Tamaño de lectura de los ficheros y de los trozos enviados al cliente
+ZIP_CHUNK_SIZE = 64 * 1024
+
+# Formatos ya comprimidos: recomprimirlos solo gasta CPU
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.xlsx'}
+
+
+class _ChunkSink:
+    """Destino de escritura de ZipFile que acumula los bytes hasta que se recogen
+
+    Tiene tell() pero no seek(), así que ZipFile escribe en modo no
+    posicionable (descriptores de datos tras cada entrada).
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pending(self):
+        return self._size
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+
+def zip_entry_info(arcname, mtime=None, size=None):
+    """ZipInfo con el método de compresión adecuado según la extensión"""
+    date_time = time.localtime(mtime if mtime is not None else time.time())[:6]
+    info = zipfile.ZipInfo(arcname, date_time=date_time)
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    if size is not None:
+        info.file_size = size
+    return info
+
+
+def stream_zip(entries, chunk_size=ZIP_CHUNK_SIZE):
+    """Generar un ZIP en trozos de bytes
+
+    entries es un iterable de (arcname, contenido), donde contenido es la
+    ruta de un fichero en disco (se lee por bloques, sin copiarlo), bytes o
+    un iterable de trozos de bytes generados sobre la marcha.
+    Los ficheros que no se pueden abrir se omiten con un aviso.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for arcname, contenido in entries:
+            if isinstance(contenido, (bytes, bytearray)):
+                zf.writestr(zip_entry_info(arcname, size=len(contenido)), contenido)
+            elif not isinstance(contenido, (str, os.PathLike)):
+                with zf.open(zip_entry_info(arcname), 'w') as dest:
+                    for block in contenido:
+                        dest.write(block)
+                        if sink.pending() >= chunk_size:
+                            yield sink.drain()
+            else:
+                try:
+                    src = open(contenido, 'rb')
+                except OSError as e:
+                    print(f"⚠️ No se pudo añadir {arcname} al ZIP: {e}")
+                    continue
+                with src:
+                    stat = os.fstat(src.fileno())
+                    info = zip_entry_info(arcname, mtime=stat.st_mtime, size=stat.st_size)
+                    with zf.open(info, 'w') as dest:
+                        while True:
+                            block = src.read(chunk_size)
+                            if not block:
+                                break
+                            dest.write(block)
+                            if sink.pending() >= chunk_size:
+                                yield sink.drain()
+            if sink.pending() >= chunk_size:
+                yield sink.drain()
+    # Directorio central al cerrar el ZipFile
+    if sink.pending():
+        yield sink.drain()